@@ -1,105 +1,518 @@
 import os
 import sys
+import time
+import zlib
 import random
 import io
+import json
+import inspect
+import argparse
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from multiprocessing import Pool, cpu_count
+
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from PIL import Image, ImageEnhance, ImageFilter
+
+import geometry
+import photometric
+import shards
+import catalog
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SRC_DIR = os.path.join(BASE_DIR, "generated_dataset")
 OUT_DIR = os.path.join(BASE_DIR, "augmented_dataset")
+POLICY_FILE = os.path.join(BASE_DIR, "augment.json")
 
+SEED = 42
+FUSED = True    # цветовые операции цепочки — одним проходом (photometric.py)
 
-def flip_h(img):
-    return ImageOps.mirror(img)
-
-def flip_v(img):
-    return ImageOps.flip(img)
 
-def rotate(img):
-    angle = random.choice([-12, -8, -5, 5, 8, 12])
-    rot = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=(0,0,0))
-    w, h = img.size
-    rw, rh = rot.size
-    return rot.crop(((rw-w)//2, (rh-h)//2, (rw+w)//2, (rh+h)//2))
+# Параметры операций (диапазоны) — keyword-аргументы функций; значения по
+# умолчанию берутся из сигнатуры, augment.json может их переопределить.
 
-def crop(img):
-    w, h = img.size
-    s = random.uniform(0.80, 0.92)
+# Геометрия: каждая операция — матрица (geometry.py). В цепочке подряд
+# идущие геометрические операции перемножаются и применяются одним
+# ресэмплингом; та же матрица переводит боксы.
+def _crop_matrix(w, h, scale):
+    s = random.uniform(*scale)
     cw, ch = int(w*s), int(h*s)
     x = random.randint(0, w-cw)
     y = random.randint(0, h-ch)
-    return img.crop((x, y, x+cw, y+ch)).resize((w, h), Image.LANCZOS)
+    return geometry.crop_resize(x, y, cw, ch, w, h)
+
+def flip_h(img):
+    return geometry.warp(img, GEOMETRIC[flip_h](*img.size))
+
+def flip_v(img):
+    return geometry.warp(img, GEOMETRIC[flip_v](*img.size))
 
-def brightness(img):
-    return ImageEnhance.Brightness(img).enhance(random.uniform(0.65, 1.35))
+def rotate(img, angles=(-12, -8, -5, 5, 8, 12)):
+    return geometry.warp(img, GEOMETRIC[rotate](*img.size, angles=angles))
 
-def contrast(img):
-    return ImageEnhance.Contrast(img).enhance(random.uniform(0.75, 1.25))
+def crop(img, scale=(0.80, 0.92)):
+    return geometry.warp(img, GEOMETRIC[crop](*img.size, scale=scale))
 
-def saturation(img):
-    return ImageEnhance.Color(img).enhance(random.uniform(0.6, 1.4))
+def zoom(img, scale=(0.9, 1.15)):
+    return geometry.warp(img, GEOMETRIC[zoom](*img.size, scale=scale))
 
-def sharpness(img):
-    return ImageEnhance.Sharpness(img).enhance(random.uniform(1.3, 2.0))
+def brightness(img, factor=(0.65, 1.35)):
+    return ImageEnhance.Brightness(img).enhance(random.uniform(*factor))
 
-def noise(img):
+def contrast(img, factor=(0.75, 1.25)):
+    return ImageEnhance.Contrast(img).enhance(random.uniform(*factor))
+
+def saturation(img, factor=(0.6, 1.4)):
+    return ImageEnhance.Color(img).enhance(random.uniform(*factor))
+
+def sharpness(img, factor=(1.3, 2.0)):
+    return ImageEnhance.Sharpness(img).enhance(random.uniform(*factor))
+
+def noise(img, sigma=(5, 18)):
     a = np.array(img).astype(np.float32)
-    a += np.random.normal(0, random.uniform(5, 18), a.shape)
+    a += np.random.normal(0, random.uniform(*sigma), a.shape)
     return Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
 
-def blur(img):
-    return img.filter(ImageFilter.GaussianBlur(random.uniform(0.5, 1.5)))
+def blur(img, radius=(0.5, 1.5)):
+    return img.filter(ImageFilter.GaussianBlur(random.uniform(*radius)))
 
-def warm(img):
+def warm(img, red=(8, 20), blue=(5, 15)):
     a = np.array(img).astype(np.float32)
-    a[:,:,0] = np.clip(a[:,:,0] + random.uniform(8, 20), 0, 255)
-    a[:,:,2] = np.clip(a[:,:,2] - random.uniform(5, 15), 0, 255)
+    a[:,:,0] = np.clip(a[:,:,0] + random.uniform(*red), 0, 255)
+    a[:,:,2] = np.clip(a[:,:,2] - random.uniform(*blue), 0, 255)
     return Image.fromarray(a.astype(np.uint8))
 
-def cold(img):
+def cold(img, red=(5, 15), blue=(8, 20)):
     a = np.array(img).astype(np.float32)
-    a[:,:,0] = np.clip(a[:,:,0] - random.uniform(5, 15), 0, 255)
-    a[:,:,2] = np.clip(a[:,:,2] + random.uniform(8, 20), 0, 255)
+    a[:,:,0] = np.clip(a[:,:,0] - random.uniform(*red), 0, 255)
+    a[:,:,2] = np.clip(a[:,:,2] + random.uniform(*blue), 0, 255)
     return Image.fromarray(a.astype(np.uint8))
 
-def jpeg_compress(img):
+def jpeg_compress(img, quality=(25, 55)):
     buf = io.BytesIO()
-    img.save(buf, "JPEG", quality=random.randint(25, 55))
+    img.save(buf, "JPEG", quality=random.randint(*quality))
     buf.seek(0)
     return Image.open(buf).convert("RGB")
 
 
-AUGMENTATIONS = [
-    ("fliph",           [flip_h]),
-    ("bright_cont",     [brightness, contrast]),
-    ("fliph_warm",      [flip_h, warm]),
-    ("crop_noise",      [crop, noise]),
-    ("rot_bright",      [rotate, brightness]),
-    ("sat_blur_jpeg",   [saturation, blur, jpeg_compress]),
-    ("cold_sharp",      [cold, sharpness]),
-]
+OPS = {f.__name__: f for f in (
+    flip_h, flip_v, rotate, crop, zoom,
+    brightness, contrast, saturation, sharpness, noise, blur, warm, cold,
+    jpeg_compress,
+)}
 
+# Шаг цепочки: операция, её параметры (поверх умолчаний) и вероятность
+Step = namedtuple("Step", "func params p")
+# Цепочка: имя (суффикс файла), шаги и вероятность, что она будет сделана
+Chain = namedtuple("Chain", "name steps p")
 
-def apply_chain(img, funcs):
-    for f in funcs:
-        img = f(img)
-    return img
+# Встроенная политика — если нет augment.json
+AUGMENTATIONS = [
+    Chain("fliph",          [flip_h], 1.0),
+    Chain("bright_cont",    [brightness, contrast], 1.0),
+    Chain("fliph_warm",     [flip_h, warm], 1.0),
+    Chain("crop_noise",     [crop, noise], 1.0),
+    Chain("rot_bright",     [rotate, brightness], 1.0),
+    Chain("sat_blur_jpeg",  [saturation, blur, jpeg_compress], 1.0),
+    Chain("cold_sharp",     [cold, sharpness], 1.0),
+]
 
 
-def transform_label(line, aug_name):
-    parts = line.strip().split()
-    if len(parts) != 5:
-        return line
-    cls, xc, yc, w, h = parts[0], float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])
-    if "fliph" in aug_name:
-        xc = 1.0 - xc
-    if "flipv" in aug_name:
-        yc = 1.0 - yc
-    return f"{cls} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}"
+# Цветовые операции в виде параметров для photometric.py. Случайные
+# параметры тянутся в том же порядке и из тех же диапазонов, что и в
+# функциях выше, поэтому fused-путь воспроизводит их результат.
+PHOTOMETRIC = {
+    brightness: lambda factor: [("brightness", random.uniform(*factor))],
+    contrast:   lambda factor: [("contrast", random.uniform(*factor))],
+    saturation: lambda factor: [("saturation", random.uniform(*factor))],
+    noise:      lambda sigma: [("noise", random.uniform(*sigma))],
+    warm:       lambda red, blue: [("shift", random.uniform(*red), 0.0, -random.uniform(*blue))],
+    cold:       lambda red, blue: [("shift", -random.uniform(*red), 0.0, random.uniform(*blue))],
+}
+
+
+GEOMETRIC = {
+    flip_h: geometry.flip_h,
+    flip_v: geometry.flip_v,
+    rotate: lambda w, h, angles: geometry.rotation(random.choice(angles), w, h),
+    crop:   _crop_matrix,
+    zoom:   lambda w, h, scale: geometry.scale(random.uniform(*scale), w, h),
+}
+
+
+@lru_cache(maxsize=None)
+def _defaults(func):
+    """Параметры операции по умолчанию — из сигнатуры функции."""
+    return {k: v.default for k, v in inspect.signature(func).parameters.items()
+            if v.default is not inspect.Parameter.empty}
+
+
+# ──────────────────────────────────────────────────────────
+#  Политика (augment.json)
+# ──────────────────────────────────────────────────────────
+def _compile_step(spec, params):
+    """"имя" или {"op": имя, "p": ..., параметры...} → Step."""
+    spec = {"op": spec} if isinstance(spec, str) else dict(spec)
+    name = spec.pop("op", None)
+    if name not in OPS:
+        raise ValueError(f"augment.json: неизвестная операция '{name}'")
+    func = OPS[name]
+    p = float(spec.pop("p", 1.0))
+    merged = {**params.get(name, {}), **spec}
+    unknown = set(merged) - set(_defaults(func))
+    if unknown:
+        raise ValueError(f"augment.json: у '{name}' нет параметров {sorted(unknown)}")
+    return Step(func, merged, p)
+
+
+def _compile_chains(specs, params):
+    chains = []
+    for c in specs:
+        if not c.get("name"):
+            raise ValueError("augment.json: у цепочки нет 'name'")
+        p = float(c.get("p", 1.0))
+        if p <= 0:
+            continue
+        chains.append(Chain(c["name"], [_compile_step(s, params) for s in c.get("ops", [])], p))
+    return chains
+
+
+def load_policy(path=POLICY_FILE):
+    """
+    Ожидаемый формат:
+    {
+      "params": {"brightness": {"factor": [0.65, 1.35]}, ...},
+      "chains": [
+        {"name": "fliph",      "ops": ["flip_h"]},
+        {"name": "crop_noise", "p": 0.5,
+         "ops": ["crop", {"op": "noise", "sigma": [5, 18], "p": 0.8}]},
+        ...
+      ],
+      "classes": {
+        "damaged_metal": {"params": {...}, "chains": [{"name": "crop_noise", "p": 0}, ...]}
+      }
+    }
+    params — диапазоны операций по умолчанию, p — вероятность шага или
+    цепочки. Цепочки класса дополняют одноимённые общие (p: 0 — выключить)
+    или добавляются к ним.
+
+    Возвращает {None: [Chain, ...], "damaged_metal": [Chain, ...], ...}.
+    Без файла — встроенные AUGMENTATIONS.
+    """
+    if not os.path.exists(path):
+        return {None: AUGMENTATIONS}
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    params = raw.get("params", {})
+    specs = raw.get("chains", [])
+    if not specs:
+        raise ValueError("augment.json: раздел 'chains' пуст или отсутствует")
+    policy = {None: _compile_chains(specs, params)}
+
+    for cls_name, over in raw.get("classes", {}).items():
+        cls_params = dict(params)
+        for op, values in over.get("params", {}).items():
+            cls_params[op] = {**params.get(op, {}), **values}
+        cls_specs = {c["name"]: c for c in specs}
+        for c in over.get("chains", []):
+            cls_specs[c["name"]] = {**cls_specs.get(c["name"], {}), **c}
+        policy[cls_name] = _compile_chains(list(cls_specs.values()), cls_params)
+    return policy
+
+
+def chains_for(policy, cls_name):
+    return policy.get(cls_name, policy[None])
+
+
+# ──────────────────────────────────────────────────────────
+#  Профилировщик
+# ──────────────────────────────────────────────────────────
+class Profiler:
+    """
+    Время, выделенная память и размер результата по операциям и цепочкам.
+    Слитые операции учитываются одной строкой ("brightness+contrast").
+    Память — пик tracemalloc за операцию (numpy и Python; внутренние
+    буферы PIL tracemalloc не видит). tracemalloc замедляет каждое
+    выделение, поэтому память меряется отдельным повторным проходом
+    (tracing()), а время — без него.
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stats = {}         # (вид, имя) → [вызовов, секунд, байт выделено, байт на выходе]
+        self._alloc = 0         # выделено операциями — для строки цепочки
+
+    def add(self, kind, name, sec, alloc=0, out=0, calls=1):
+        s = self.stats.setdefault((kind, name), [0, 0.0, 0, 0])
+        s[0] += calls
+        s[1] += sec
+        s[2] += alloc
+        s[3] += out
+
+    @contextmanager
+    def tracing(self):
+        """Проход для памяти: measure() пишет только выделения, не время и не вызовы."""
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            tracemalloc.stop()
+
+    @contextmanager
+    def measure(self, name):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                yield
+            finally:
+                alloc = tracemalloc.get_traced_memory()[1] - base
+                self._alloc += alloc
+                self.add("op", name, 0.0, alloc, calls=0)
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add("op", name, time.perf_counter() - t)
+
+    def merge(self, stats):
+        for (kind, name), (n, sec, alloc, out) in stats.items():
+            s = self.stats.setdefault((kind, name), [0, 0.0, 0, 0])
+            s[0] += n
+            s[1] += sec
+            s[2] += alloc
+            s[3] += out
+
+    def report(self):
+        for kind, title in (("op", "Операция"), ("chain", "Цепочка")):
+            rows = sorted(((name, s) for (k, name), s in self.stats.items() if k == kind),
+                          key=lambda r: -r[1][1])
+            if not rows:
+                continue
+            total = sum(s[1] for _, s in rows) or 1e-9
+            print(f"\n  {title:26s} {'вызовов':>8s} {'мс/выз':>8s} {'всего,с':>8s} {'доля':>6s}"
+                  f" {'МБ/выз':>7s}" + (f" {'КБ файла':>9s}" if kind == "chain" else ""))
+            print(f"  {'─'*26} {'─'*8} {'─'*8} {'─'*8} {'─'*6} {'─'*7}"
+                  + (f" {'─'*9}" if kind == "chain" else ""))
+            for name, (n, sec, alloc, out) in rows:
+                line = (f"  {name:26s} {n:8d} {sec / n * 1000:8.1f} {sec:8.1f}"
+                        f" {sec / total:6.0%} {alloc / n / 1e6:7.1f}")
+                if kind == "chain":
+                    line += f" {out / n / 1024:9.0f}"
+                print(line)
+
+
+def _timed(prof, name, fn, *args, **kwargs):
+    if prof is None:
+        return fn(*args, **kwargs)
+    with prof.measure(name):
+        return fn(*args, **kwargs)
+
+
+def apply_chain(img, steps, fused=None, prof=None):
+    """
+    Применяет цепочку, возвращает (картинка, матрица всей геометрии).
+    steps — функции из OPS или Step (с параметрами и вероятностью).
+    Подряд идущие геометрические операции (GEOMETRIC) — один warp,
+    подряд идущие цветовые (PHOTOMETRIC) — один проход photometric.apply().
+    """
+    if fused is None:
+        fused = FUSED
+    w, h = img.size
+    total = np.eye(3)
+    geo, geo_names = None, []
+    ops, op_names = [], []
+
+    for s in steps:
+        if not isinstance(s, Step):
+            s = Step(s, {}, 1.0)
+        if s.p < 1 and random.random() >= s.p:
+            continue
+        f = s.func
+        params = {**_defaults(f), **s.params}
+
+        if f in GEOMETRIC:
+            if ops:
+                img = _timed(prof, "+".join(op_names), photometric.apply, img, ops)
+                ops, op_names = [], []
+            m = GEOMETRIC[f](w, h, **params)
+            geo = m if geo is None else m @ geo
+            geo_names.append(f.__name__)
+            continue
+        if geo is not None:
+            img = _timed(prof, "+".join(geo_names), geometry.warp, img, geo)
+            total = geo @ total
+            geo, geo_names = None, []
+        if fused and f in PHOTOMETRIC:
+            ops += PHOTOMETRIC[f](**params)
+            op_names.append(f.__name__)
+            continue
+        if ops:
+            img = _timed(prof, "+".join(op_names), photometric.apply, img, ops)
+            ops, op_names = [], []
+        img = _timed(prof, f.__name__, f, img, **params)
+
+    if geo is not None:
+        img = _timed(prof, "+".join(geo_names), geometry.warp, img, geo)
+        total = geo @ total
+    if ops:
+        img = _timed(prof, "+".join(op_names), photometric.apply, img, ops)
+    return img, total
+
+
+def transform_labels(lines, m, size):
+    """
+    YOLO-строки через матрицу m (geometry.transform_boxes). Боксы, ушедшие
+    из кадра, выбрасываются; строки неверного формата остаются как есть.
+    """
+    parsed = []
+    for line in lines:
+        parts = line.split()
+        try:
+            parsed.append((parts[0], [float(v) for v in parts[1:]]) if len(parts) == 5 else None)
+        except ValueError:
+            parsed.append(None)
+    valid = [p for p in parsed if p is not None]
+    if not valid or np.allclose(m, np.eye(3)):
+        return list(lines)
+
+    boxes, keep = geometry.transform_boxes([v for _, v in valid], m, size)
+    moved = iter(boxes)
+    flags = iter(keep)
+    out = []
+    for line, p in zip(lines, parsed):
+        if p is None:
+            out.append(line)
+        elif next(flags):
+            xc, yc, w, h = next(moved)
+            out.append(f"{p[0]} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}")
+    return out
+
+
+def sample_seed(seed: int, stem: str, aug_name: str) -> int:
+    """Зерно для одного выходного файла: зависит только от имён, а не от
+    порядка обработки — результат одинаков при любом числе процессов."""
+    return zlib.crc32(f"{seed}:{stem}:{aug_name}".encode("utf-8"))
+
+
+# Состояние процесса-воркера (см. _init_worker)
+_POLICY = {None: AUGMENTATIONS}
+_PROFILE = False
+_PACK = False
+
+
+def _init_worker(policy, profile, pack=False):
+    global _POLICY, _PROFILE, _PACK
+    _POLICY = policy
+    _PROFILE = profile
+    _PACK = pack
+
+
+def _encode(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def process_image(job):
+    """
+    Оригинал + цепочки политики (для класса картинки) для одного исходника.
+    Возвращает (сколько файлов записано, [(имя, ошибка), ...], статистика
+    профилировщика или None, сэмплы для шардов или None, записи для
+    каталога). С --pack файлы не пишутся, а возвращаются как
+    [(ключ, байты JPEG, лейбл), ...]; иначе записи — [(имя, цепочка,
+    размер, лейбл), ...] для catalog.py.
+    """
+    cls_dir, fname, seed = job
+    prof = Profiler() if _PROFILE else None
+    samples = [] if _PACK else None
+    records = []
+    stem = os.path.splitext(fname)[0]
+    img_path = os.path.join(SRC_DIR, cls_dir, fname)
+    lbl_path = os.path.join(SRC_DIR, "labels", f"{stem}.txt")
+    out_images = os.path.join(OUT_DIR, "images")
+    out_labels = os.path.join(OUT_DIR, "labels")
+    done = 0
+    errors = []
+
+    def emit(out_stem, aug, size, data, lines):
+        label = "\n".join(lines) + "\n"
+        if samples is not None:
+            samples.append((f"images/{out_stem}.jpg", data, label))
+            return
+        with open(os.path.join(out_images, f"{out_stem}.jpg"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(out_labels, f"{out_stem}.txt"), "w") as f:
+            f.write(label)
+        records.append((out_stem, aug, size, label))
+
+    try:
+        img = Image.open(img_path).convert("RGB")
+    except Exception as e:
+        return 0, [(stem, str(e))], None, samples, records
+
+    label_lines = []
+    if os.path.exists(lbl_path):
+        with open(lbl_path) as f:
+            label_lines = [l.strip() for l in f if l.strip()]
+
+    # Оригинал
+    emit(stem, "", img.size, _encode(img, 95), label_lines)
+    done += 1
+
+    # Аугментации
+    for chain in chains_for(_POLICY, cls_dir):
+        out_stem = f"{stem}_{chain.name}"
+        s = sample_seed(seed, stem, chain.name)
+
+        def reseed():
+            random.seed(s)
+            np.random.seed(s)
+            return not (chain.p < 1 and random.random() >= chain.p)
+
+        if not reseed():
+            continue
+        try:
+            t = time.perf_counter()
+            aug_img, m = apply_chain(img, chain.steps, prof=prof)
+            data = _encode(aug_img, 90)
+            if prof:
+                sec = time.perf_counter() - t
+                prof._alloc = 0
+                if prof.memory:
+                    # Тот же сэмпл ещё раз — уже под tracemalloc, только ради памяти
+                    reseed()
+                    with prof.tracing():
+                        apply_chain(img, chain.steps, prof=prof)
+                prof.add("chain", chain.name, sec, prof._alloc, len(data))
+            emit(out_stem, chain.name, aug_img.size, data, transform_labels(label_lines, m, img.size))
+            done += 1
+        except Exception as e:
+            errors.append((out_stem, str(e)))
+
+    return done, errors, prof.stats if prof else None, samples, records
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Аугментация generated_dataset → augmented_dataset")
+    p.add_argument("--workers", type=int, default=cpu_count(), help="процессов (1 — без пула)")
+    p.add_argument("--seed", type=int, default=SEED, help="базовое зерно")
+    p.add_argument("--policy", default=POLICY_FILE, help="файл политики аугментаций")
+    p.add_argument("--profile", action="store_true",
+                   help="время/память/размер по операциям и цепочкам в конце")
+    p.add_argument("--pack", metavar="DIR",
+                   help="писать в упакованный датасет (shards.py) вместо augmented_dataset/")
+    return p.parse_args()
 
 
 def main():
+    args = parse_args()
+    workers = max(1, args.workers)
+
     print("=" * 55)
     print("  АУГМЕНТАЦИЯ ДАТАСЕТА")
     print("=" * 55)
@@ -107,97 +520,128 @@ def main():
     if not os.path.isdir(SRC_DIR):
         sys.exit(f"Нет папки {SRC_DIR}")
 
-    src_labels = os.path.join(SRC_DIR, "labels")
-    class_dirs = sorted([
-        d for d in os.listdir(SRC_DIR)
-        if os.path.isdir(os.path.join(SRC_DIR, d)) and d.startswith("damaged_")
-    ])
+    policy = load_policy(args.policy)
+    pack = bool(args.pack)
+    _init_worker(policy, args.profile, pack)
+
+    # Исходники — из каталога (generate_data.py пишет туда каждую картинку,
+    # sync() добирает то, что появилось мимо него, например composite.py)
+    cat = catalog.Catalog()
+    cat.sync("generated", SRC_DIR)
+    all_images = []
+    for path, _, _, _ in cat.samples("generated"):
+        cls_dir, fname = path.split("/")[-2:]
+        all_images.append((cls_dir, fname))
+    class_dirs = sorted({d for d, _ in all_images})
 
     if not class_dirs:
         sys.exit("Нет папок damaged_*")
 
-    # Выходные папки
-    out_images = os.path.join(OUT_DIR, "images")
-    out_labels = os.path.join(OUT_DIR, "labels")
-    os.makedirs(out_images, exist_ok=True)
-    os.makedirs(out_labels, exist_ok=True)
-
     # classes.txt
+    txt = ""
     src_cls = os.path.join(SRC_DIR, "classes.txt")
     if os.path.exists(src_cls):
         with open(src_cls) as f:
             txt = f.read()
-        with open(os.path.join(OUT_DIR, "classes.txt"), "w") as f:
-            f.write(txt)
 
-    # Собираем все картинки
-    all_images = []
-    for cls_dir in class_dirs:
-        full = os.path.join(SRC_DIR, cls_dir)
-        for fname in sorted(os.listdir(full)):
-            if fname.lower().endswith((".jpg", ".jpeg", ".png")):
-                all_images.append((cls_dir, fname))
+    # Выходные папки (или шарды)
+    out_images = os.path.join(OUT_DIR, "images")
+    out_labels = os.path.join(OUT_DIR, "labels")
+    writer = None
+    if pack:
+        writer = shards.ShardWriter(args.pack, classes=txt)
+    else:
+        os.makedirs(out_images, exist_ok=True)
+        os.makedirs(out_labels, exist_ok=True)
+        if txt:
+            with open(os.path.join(OUT_DIR, "classes.txt"), "w") as f:
+                f.write(txt)
+
+    cls_ids = {name: i for i, name in catalog.read_classes(src_cls).items()}
+    src_class = {os.path.splitext(fname)[0]: d for d, fname in all_images}
 
     total_src = len(all_images)
-    total_out = total_src * (1 + len(AUGMENTATIONS))
+    total_out = sum(1 + len(chains_for(policy, d)) for d, _ in all_images)
     print(f"\n  Исходных: {total_src}")
     for d in class_dirs:
         c = sum(1 for x in all_images if x[0] == d)
-        print(f"    {d}: {c}")
-    print(f"  Аугментаций: {len(AUGMENTATIONS)} на каждую")
-    print(f"  Итого: {total_out}")
+        print(f"    {d}: {c}  (цепочек: {len(chains_for(policy, d))})")
+    print(f"  Политика: {args.policy if os.path.exists(args.policy) else 'встроенная'}")
+    print(f"  Итого: до {total_out}")
+    print(f"  Процессов: {workers}")
     print(f"\n{'─'*55}\n")
 
+    t0 = time.time()
     done = 0
-
-    for cls_dir, fname in all_images:
-        stem = os.path.splitext(fname)[0]
-        img_path = os.path.join(SRC_DIR, cls_dir, fname)
-        lbl_path = os.path.join(src_labels, f"{stem}.txt")
-
-        img = Image.open(img_path).convert("RGB")
-
-        label_lines = []
-        if os.path.exists(lbl_path):
-            with open(lbl_path) as f:
-                label_lines = [l.strip() for l in f if l.strip()]
-
-        # Оригинал
-        img.save(os.path.join(out_images, f"{stem}.jpg"), "JPEG", quality=95)
-        with open(os.path.join(out_labels, f"{stem}.txt"), "w") as f:
-            f.write("\n".join(label_lines) + "\n")
-        done += 1
-
-        # Аугментации
-        for aug_name, aug_funcs in AUGMENTATIONS:
-            out_stem = f"{stem}_{aug_name}"
-            try:
-                aug_img = apply_chain(img, aug_funcs)
-                aug_img.save(os.path.join(out_images, f"{out_stem}.jpg"),
-                             "JPEG", quality=90)
-                aug_labels = [transform_label(l, aug_name) for l in label_lines]
-                with open(os.path.join(out_labels, f"{out_stem}.txt"), "w") as f:
-                    f.write("\n".join(aug_labels) + "\n")
-                done += 1
-            except Exception as e:
-                print(f"  ✗ {out_stem}: {e}")
-
-        if done % 100 == 0:
-            print(f"  {done}/{total_out} ...")
+    errors = []
+    jobs = [(cls_dir, fname, args.seed) for cls_dir, fname in all_images]
+
+    if workers == 1:
+        results = map(process_image, jobs)
+        pool = None
+    else:
+        pool = Pool(workers, initializer=_init_worker, initargs=(policy, args.profile, pack))
+        # В шарды — по порядку исходников, чтобы упаковка была воспроизводимой
+        imap = pool.imap if pack else pool.imap_unordered
+        results = imap(process_image, jobs, chunksize=4)
+
+    prof = Profiler(memory=False) if args.profile else None
+    step = 100
+    for n, errs, stats, samples, records in results:
+        if prof and stats:
+            prof.merge(stats)
+        for key, data, label in samples or ():
+            writer.add(key, data, label)
+        if records:
+            stem = records[0][0]        # первая запись — оригинал
+            cls_id = cls_ids.get(src_class.get(stem))
+            cat.add_many("augmented", [
+                (os.path.join(out_images, f"{out_stem}.jpg"), {
+                    "label_path": os.path.join(out_labels, f"{out_stem}.txt"),
+                    "label_text": label, "size": size, "source": stem,
+                    "cls_id": cls_id, "aug": aug,
+                })
+                for out_stem, aug, size, label in records])
+        before = done
+        done += n
+        errors += errs
+        for name, err in errs:
+            print(f"  ✗ {name}: {err}")
+        if done // step > before // step:
+            rate = done / max(time.time() - t0, 1e-9)
+            print(f"  {done}/{total_out} ...  ({rate:.0f} карт/с)")
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    cat.close()
 
     # Итог
-    n_imgs = len([f for f in os.listdir(out_images) if f.endswith(".jpg")])
-    n_lbls = len([f for f in os.listdir(out_labels) if f.endswith(".txt")])
+    if writer is not None:
+        writer.close()
+        n_imgs = n_lbls = len(writer.keys)
+    else:
+        n_imgs = len([f for f in os.listdir(out_images) if f.endswith(".jpg")])
+        n_lbls = len([f for f in os.listdir(out_labels) if f.endswith(".txt")])
 
     print(f"\n{'='*55}")
-    print(f"  ГОТОВО!")
+    print(f"  ГОТОВО!  ({time.time() - t0:.1f}с)")
     print(f"  {total_src} → {n_imgs} картинок (×{n_imgs/total_src:.1f})")
+    if errors:
+        print(f"  Ошибок: {len(errors)}")
     print(f"  Лейблов: {n_lbls}")
     print(f"")
-    print(f"  {OUT_DIR}/")
-    print(f"    images/  {n_imgs}")
-    print(f"    labels/  {n_lbls}")
-    print(f"    classes.txt")
+    if writer is not None:
+        print(f"  {args.pack}/  (shards.py, шардов: {writer.shards})")
+    else:
+        print(f"  {OUT_DIR}/")
+        print(f"    images/  {n_imgs}")
+        print(f"    labels/  {n_lbls}")
+        print(f"    classes.txt")
+    if prof:
+        print(f"\n  ПРОФИЛЬ")
+        prof.report()
     print(f"{'='*55}")
 
 
@@ -0,0 +1,427 @@
+"""
+Бэкенды генерации картинок и пул с балансировкой / failover.
+
+Конфиг — backends.json рядом со скриптами (формат см. backends.example.json):
+    {
+      "backends": [
+        {"name": "gpt-image", "type": "openrouter", "model": "openai/gpt-5-image-mini",
+         "concurrency": 4, "rate": 1.0, "cost": 0.042},
+        {"name": "stub", "type": "stub", "latency": 2.0, "concurrency": 8}
+      ]
+    }
+
+У каждого бэкенда — свой лимит одновременных запросов, свой token bucket,
+цена картинки и статистика (EWMA задержки, ошибки, 429). Пул отправляет
+запрос на самый быстрый свободный здоровый бэкенд; после 429 / 5xx /
+таймаута бэкенд уходит на паузу, а запрос повторяется на другом.
+"""
+import os
+import json
+import time
+import base64
+import random
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pngstub import make_png
+
+OK = "ok"
+EMPTY = "empty"                 # ответ 200, но без картинки
+RATE_LIMITED = "rate_limited"   # 429
+NO_MONEY = "no_money"           # 402
+TIMEOUT = "timeout"
+ERROR = "error"
+
+Result = namedtuple("Result", "status data cost retry_after note")
+
+
+def _result(status, data=None, cost=0.0, retry_after=None, note=""):
+    return Result(status, data, cost, retry_after, note)
+
+
+# ──────────────────────────────────────────────────────────
+#  Ограничение частоты запросов
+# ──────────────────────────────────────────────────────────
+class RateLimiter:
+    """
+    Token bucket, общий для всех воркеров одного бэкенда.
+
+    Каждый запрос забирает один токен; токены пополняются со скоростью
+    rate в секунду. Если любой воркер получил 429, penalize() ставит на
+    паузу весь бэкенд и вдвое снижает скорость; успешные ответы
+    постепенно возвращают её к исходной (AIMD).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, stop=None) -> bool:
+        """Ждёт токен. Возвращает False, если выставлен stop."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(
+                        self.burst,
+                        self.tokens + max(0.0, now - self.stamp) * self.rate,
+                    )
+                    self.stamp = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(min(wait, 1.0)):
+                return False
+
+    def penalize(self, wait: float):
+        """429: общая пауза на wait секунд и снижение скорости."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + wait)
+            self.stamp = self.paused_until
+            self.tokens = 0.0
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def reward(self):
+        """Успешный ответ: плавно возвращаем скорость к исходной."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+
+def make_session(pool_size: int = 4) -> requests.Session:
+    """Общая keep-alive сессия: одно TCP/TLS-соединение на воркер."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ──────────────────────────────────────────────────────────
+#  Бэкенды
+# ──────────────────────────────────────────────────────────
+class Backend(ABC):
+    """Базовый бэкенд: лимиты, здоровье и статистика. request() — в наследниках."""
+
+    kind = "base"
+
+    def __init__(self, name: str, model: str = "", concurrency: int = 4,
+                 rate: float = 1.0, burst: int = None, cost: float = 0.0,
+                 weight: float = 1.0, timeout: float = 180, **_):
+        self.name = name
+        self.model = model or name
+        self.concurrency = max(1, int(concurrency))
+        self.cost = cost
+        self.weight = max(weight, 1e-6)
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate, burst or self.concurrency)
+
+        # Состояние (меняется под замком пула)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.fails_in_row = 0
+        self.disabled = None        # причина отключения, например "402"
+        self.latency = None         # EWMA длительности успешного запроса, с
+        self.stats = {"requests": 0, "ok": 0, "empty": 0, "rate_limited": 0,
+                      "errors": 0, "timeouts": 0, "spent": 0.0, "busy": 0.0}
+
+    @abstractmethod
+    def request(self, prompt: str) -> Result:
+        """Один запрос картинки, без повторов (их делает пул)."""
+
+    # ── Здоровье и маршрутизация ──────────────────────────
+    def ready(self, now: float) -> bool:
+        return (self.disabled is None and now >= self.cooldown_until
+                and self.in_flight < self.concurrency)
+
+    def score(self) -> float:
+        """Ожидаемое время ответа с учётом загрузки; меньше — лучше.
+        Бэкенд без замеров получает 0, чтобы его попробовали."""
+        lat = self.latency or 0.0
+        return lat * (1 + self.in_flight / self.concurrency) / self.weight
+
+    def record(self, res: Result, elapsed: float):
+        s = self.stats
+        s["requests"] += 1
+        s["busy"] += elapsed
+        s["spent"] += res.cost or 0.0
+        now = time.monotonic()
+
+        if res.status in (OK, EMPTY):
+            s["ok" if res.status == OK else "empty"] += 1
+            self.fails_in_row = 0
+            self.latency = elapsed if self.latency is None else 0.7 * self.latency + 0.3 * elapsed
+            self.limiter.reward()
+        elif res.status == RATE_LIMITED:
+            s["rate_limited"] += 1
+            wait = res.retry_after or 20
+            self.cooldown_until = max(self.cooldown_until, now + wait)
+            self.limiter.penalize(wait)
+        elif res.status == NO_MONEY:
+            self.disabled = "402"
+        else:
+            s["timeouts" if res.status == TIMEOUT else "errors"] += 1
+            self.fails_in_row += 1
+            self.cooldown_until = max(self.cooldown_until,
+                                      now + min(60, 5 * self.fails_in_row))
+
+
+class OpenRouterBackend(Backend):
+    """OpenAI-совместимый chat/completions с картинкой в ответе (OpenRouter)."""
+
+    kind = "openrouter"
+
+    def __init__(self, name: str, base_url: str = None,
+                 api_key_env: str = "OPENROUTER_API_KEY", session=None, **kw):
+        super().__init__(name, **kw)
+        base_url = base_url or os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        self.base_url = base_url.rstrip("/")
+        self.api_key = os.getenv(api_key_env)
+        self.session = session or make_session(self.concurrency)
+
+    def request(self, prompt: str) -> Result:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/subway-damage",
+        }
+        try:
+            r = self.session.post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json={
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                },
+                timeout=self.timeout,
+            )
+        except requests.exceptions.Timeout:
+            return _result(TIMEOUT, note="таймаут")
+        except Exception as e:
+            return _result(ERROR, note=f"ошибка: {e}")
+
+        if r.status_code == 200:
+            body = r.json()
+            cost = body.get("usage", {}).get("cost", 0) or 0
+
+            # Извлечение base64-картинки из ответа
+            images = (
+                body.get("choices", [{}])[0]
+                .get("message", {})
+                .get("images", [])
+            )
+            for item in images:
+                url = item.get("image_url", {}).get("url", "")
+                if url.startswith("data:image"):
+                    b64 = url.split(",", 1)[1]
+                    return _result(OK, base64.b64decode(b64), cost)
+            return _result(EMPTY, cost=cost, note="нет картинки")
+
+        if r.status_code == 429:
+            try:
+                wait = float(r.headers.get("Retry-After", ""))
+            except ValueError:
+                wait = None
+            return _result(RATE_LIMITED, retry_after=wait, note="429")
+        if r.status_code == 402:
+            return _result(NO_MONEY, note="402")
+        return _result(ERROR, note=f"HTTP {r.status_code}")
+
+
+class StubBackend(Backend):
+    """
+    Локальная заглушка без сети: случайная PNG-мозаика через latency секунд.
+    fail — доля ответов 5xx, rps — лимит запросов в секунду (сверх — 429).
+    Нужна, чтобы проверять маршрутизацию и failover офлайн.
+    """
+
+    kind = "stub"
+
+    def __init__(self, name: str, latency: float = 1.0, fail: float = 0.0,
+                 rps: float = 0, size: int = 256, **kw):
+        kw.setdefault("model", f"stub/{name}")
+        super().__init__(name, **kw)
+        self.delay = latency
+        self.fail = fail
+        self.rps = rps
+        self.size = size
+        self._window = []
+        self._lock = threading.Lock()
+
+    def request(self, prompt: str) -> Result:
+        if self.rps:
+            with self._lock:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.rps:
+                    return _result(RATE_LIMITED, retry_after=1.0, note="429")
+                self._window.append(now)
+
+        time.sleep(self.delay * random.uniform(0.8, 1.2))
+        if self.fail and random.random() < self.fail:
+            return _result(ERROR, note="HTTP 500")
+        png = make_png(self.size, self.size, seed=random.getrandbits(64))
+        return _result(OK, png, self.cost)
+
+
+BACKEND_TYPES = {
+    OpenRouterBackend.kind: OpenRouterBackend,
+    StubBackend.kind: StubBackend,
+}
+
+
+# ──────────────────────────────────────────────────────────
+#  Пул
+# ──────────────────────────────────────────────────────────
+class BackendPool:
+    def __init__(self, backends, log=print, retries: int = 3, telemetry=None):
+        if not backends:
+            raise ValueError("BackendPool: нет ни одного бэкенда")
+        self.backends = list(backends)
+        self.log = log
+        self.telemetry = telemetry      # telemetry.Telemetry или None
+        self.retries = max(retries, len(self.backends) + 1)
+        self.cond = threading.Condition()
+
+    @property
+    def models(self):
+        return [b.model for b in self.backends]
+
+    @property
+    def capacity(self) -> int:
+        return sum(b.concurrency for b in self.backends)
+
+    def _acquire(self, stop, tried):
+        """Занимает слот на лучшем готовом бэкенде. None — если стоп или все отключены."""
+        with self.cond:
+            while True:
+                if stop is not None and stop.is_set():
+                    return None
+                live = [b for b in self.backends if b.disabled is None]
+                if not live:
+                    return None
+                now = time.monotonic()
+                ready = [b for b in live if b.ready(now)]
+                # Сначала — бэкенды, которые этот запрос ещё не пробовал
+                fresh = [b for b in ready if b not in tried] or ready
+                if fresh:
+                    best = min(fresh, key=Backend.score)
+                    best.in_flight += 1
+                    return best
+                wake = min((b.cooldown_until - now for b in live
+                            if b.cooldown_until > now), default=1.0)
+                self.cond.wait(timeout=max(0.05, min(wake, 1.0)))
+
+    def _release(self, backend, res, elapsed):
+        with self.cond:
+            backend.in_flight -= 1
+            backend.record(res, elapsed)
+            self.cond.notify_all()
+
+    def generate(self, prompt: str, stop=None):
+        """
+        Возвращает (bytes | None | "NO_MONEY" | "SKIPPED", cost, backend).
+        При 429 / 5xx / таймауте запрос уходит на следующий бэкенд.
+        """
+        tel = self.telemetry
+        tried = set()
+        for attempt in range(1, self.retries + 1):
+            t = time.monotonic()
+            backend = self._acquire(stop, tried)
+            if backend is None:
+                if all(b.disabled for b in self.backends):
+                    return "NO_MONEY", 0, None
+                return "SKIPPED", 0, None
+            if tel:
+                tel.wait("slot_wait", time.monotonic() - t, backend.name)
+
+            t = time.monotonic()
+            if not backend.limiter.acquire(stop):
+                with self.cond:
+                    backend.in_flight -= 1
+                    self.cond.notify_all()
+                return "SKIPPED", 0, None
+            if tel:
+                tel.wait("ratelimit_wait", time.monotonic() - t, backend.name)
+            t = time.monotonic()
+            try:
+                res = backend.request(prompt)
+            except Exception as e:
+                res = _result(ERROR, note=f"ошибка: {e}")
+            elapsed = time.monotonic() - t
+            self._release(backend, res, elapsed)
+            if tel:
+                tel.request(backend.name, res.status, elapsed, res.cost or 0.0, attempt,
+                            (res.retry_after or 20) if res.status == RATE_LIMITED else 0.0, res.note)
+
+            if res.status == OK:
+                return res.data, res.cost, backend
+            if res.status == EMPTY:
+                self.log(f"    [{backend.name}: нет картинки]")
+                return None, res.cost, backend
+
+            tried.add(backend)
+            if res.status == RATE_LIMITED:
+                self.log(f"    [{backend.name}: 429, пауза {res.retry_after or 20:.0f}с]")
+            elif res.status == NO_MONEY:
+                self.log(f"    [{backend.name}: 402, бэкенд отключён]")
+            else:
+                self.log(f"    [{backend.name}: {res.note} #{attempt}]")
+
+        return None, 0, None
+
+    def report(self):
+        """Строки таблицы со статистикой по бэкендам."""
+        lines = [f"  {'Бэкенд':18s} {'ok':>5s} {'ошиб':>5s} {'429':>5s} "
+                 f"{'тайм':>5s} {'задерж':>7s} {'$':>7s}"]
+        for b in self.backends:
+            s = b.stats
+            lat = f"{b.latency:.1f}с" if b.latency is not None else "—"
+            flag = f"  (отключён: {b.disabled})" if b.disabled else ""
+            lines.append(f"  {b.name:18s} {s['ok']:5d} {s['errors'] + s['empty']:5d} "
+                         f"{s['rate_limited']:5d} {s['timeouts']:5d} {lat:>7s} "
+                         f"{s['spent']:7.2f}{flag}")
+        return lines
+
+
+def load_backends(path: str, default: list, log=print) -> BackendPool:
+    """
+    Собирает пул из JSON-конфига; если файла нет — из default
+    (список словарей в том же формате).
+    """
+    specs = default
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        specs = raw.get("backends", [])
+        if not specs:
+            raise ValueError(f"{os.path.basename(path)}: раздел 'backends' пуст")
+
+    specs = [s for s in specs if s.get("enabled", True)]
+    session = make_session(sum(int(s.get("concurrency", 4)) for s in specs))
+    backends = []
+    for spec in specs:
+        spec = dict(spec)
+        kind = spec.pop("type", OpenRouterBackend.kind)
+        spec.pop("enabled", None)
+        if kind not in BACKEND_TYPES:
+            raise ValueError(f"Неизвестный тип бэкенда: '{kind}'")
+        if kind == OpenRouterBackend.kind:
+            spec.setdefault("session", session)
+        name = spec.pop("name", spec.get("model") or kind)
+        backends.append(BACKEND_TYPES[kind](name, **spec))
+    return BackendPool(backends, log=log)
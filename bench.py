@@ -0,0 +1,293 @@
+"""
+Замер скорости обученной модели: задержка, пропускная способность, память.
+
+    python bench.py                                   # все модели из runs/metro_damage/weights
+    python bench.py --batch 1 4 8 --threads 1 2 4 --imgsz 480 640
+    python bench.py --models runs/metro_damage/weights/best_int8.onnx --inter 0 2
+    python bench.py --save-baseline                   # текущий замер → bench_baseline.json
+    python bench.py                                   # сравнение с базой; код 1 при регрессии
+
+Бэкенды: PyTorch (best.pt через Ultralytics, fused), ONNX fp32 и любые
+другие .onnx рядом (best_int8.onnx из quantize.py). Сетка — модель ×
+imgsz × batch × intra-op потоки × inter-op потоки; сочетания, которые
+модель не поддерживает (фиксированный batch или размер входа), пропускаются.
+
+Каждая точка сетки — отдельный процесс: холодный старт (импорт
+фреймворка, загрузка модели, первый прогон) и пиковый RSS не
+смешиваются с предыдущими замерами. Задержка — чистый прогон модели на
+батче (без декодирования картинок и NMS): p50/p95/p99 по RUNS прогонам
+после WARMUP.
+
+Результат — JSON в runs/bench/ (окружение + точки). Если есть база
+(bench_baseline.json), точки сравниваются с ней: p50 или картинок/с хуже
+больше чем на --tolerance, либо RSS больше чем на RSS_TOLERANCE — регрессия,
+выход с кодом 1. Точка базы, которая теперь падает или пропала (модели
+нет), — тоже регрессия.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+from importlib import metadata
+
+import numpy as np
+
+from telemetry import percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHTS = os.path.join(BASE_DIR, "runs", "metro_damage", "weights")
+OUT_DIR = os.path.join(BASE_DIR, "runs", "bench")
+BASELINE = os.path.join(BASE_DIR, "bench_baseline.json")
+
+IMGSZ = 640
+RUNS = 30
+WARMUP = 5
+TOLERANCE = 0.10        # допустимое ухудшение p50 и картинок/с
+RSS_TOLERANCE = 0.20
+TIMEOUT = 900           # с на одну точку
+KEY = ("model", "backend", "imgsz", "batch", "threads", "inter")
+
+
+# ──────────────────────────────────────────────────────────
+#  Замер одной точки (в отдельном процессе)
+# ──────────────────────────────────────────────────────────
+def _torch_runner(path, x, threads, inter):
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    if inter:
+        torch.set_num_interop_threads(inter)
+    from ultralytics import YOLO
+
+    net = YOLO(path).model.fuse(verbose=False).eval().float()
+    t = torch.from_numpy(x)
+
+    def run():
+        with torch.inference_mode():
+            net(t)
+    return run
+
+
+def _onnx_runner(path, x, threads, inter):
+    import infer
+
+    sess = infer.session(path, threads, inter)
+    inp = sess.get_inputs()[0]
+    for dim, want in zip(inp.shape, x.shape):
+        if isinstance(dim, int) and dim != want:
+            return f"вход модели {inp.shape}"
+    name = inp.name
+    if "float16" in inp.type:
+        x = x.astype(np.float16)
+
+    def run():
+        sess.run(None, {name: x})
+    return run
+
+
+def measure(cfg: dict) -> dict:
+    """Одна точка сетки: холодный старт, тёплые прогоны, пиковый RSS."""
+    x = np.random.default_rng(0).random((cfg["batch"], 3, cfg["imgsz"], cfg["imgsz"]),
+                                        dtype=np.float32)
+    t0 = time.perf_counter()
+    make = _torch_runner if cfg["backend"] == "torch" else _onnx_runner
+    run = make(cfg["model_path"], x, cfg["threads"], cfg["inter"])
+    if isinstance(run, str):
+        return {"skip": run}
+    load = time.perf_counter() - t0
+    t = time.perf_counter()
+    run()
+    first = time.perf_counter() - t
+    for _ in range(cfg["warmup"]):
+        run()
+    times = []
+    for _ in range(cfg["runs"]):
+        t = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    mean = sum(times) / len(times)
+    return {"load_s": load, "first_s": first, "cold_start_s": load + first,
+            "p50_ms": percentile(times, 0.5), "p95_ms": percentile(times, 0.95),
+            "p99_ms": percentile(times, 0.99), "mean_ms": mean,
+            "ips": cfg["batch"] * 1000 / mean,
+            "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def spawn(cfg: dict) -> dict:
+    """measure() в новом процессе; результат — последняя строка stdout."""
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(cfg)],
+                              capture_output=True, text=True, timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return {"error": f"таймаут {TIMEOUT}с"}
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return {"error": (proc.stderr.strip().splitlines() or ["?"])[-1]}
+    return json.loads(lines[-1])
+
+
+# ──────────────────────────────────────────────────────────
+#  Сетка, отчёт, база
+# ──────────────────────────────────────────────────────────
+def find_models(weights: str = WEIGHTS):
+    if not os.path.isdir(weights):
+        return []
+    return [os.path.join(weights, f) for f in sorted(os.listdir(weights))
+            if f == "best.pt" or f.endswith(".onnx")]
+
+
+def environment():
+    def version(pkg):
+        try:
+            return metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            return None
+
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f
+                        if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {"cpu": cpu, "cores": os.cpu_count(), "platform": platform.platform(),
+            "python": platform.python_version(), "onnxruntime": version("onnxruntime"),
+            "torch": version("torch"), "ultralytics": version("ultralytics"),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def key(r: dict):
+    return tuple(r[k] for k in KEY)
+
+
+def compare(results, baseline: dict, tolerance: float = TOLERANCE):
+    """
+    Сравнение с базой: [(точка, Δp50, Δips, Δrss, регрессия)]. Точка базы,
+    которая теперь упала (error) или пропала из прогона при той же сетке
+    (модели нет), — тоже регрессия, с Δ = None.
+    """
+    base = {key(r): r for r in baseline.get("results", []) if "p50_ms" in r}
+    done = {key(r): r for r in results}
+    grid = {key(r)[2:] for r in results}
+    rows = []
+    for k, b in base.items():
+        r = done.get(k)
+        if r is None:
+            if k[2:] in grid:
+                rows.append(({**b, "error": "нет в прогоне"}, None, None, None, True))
+            continue
+        if "p50_ms" not in r:
+            if "error" in r:
+                rows.append((r, None, None, None, True))
+            continue
+        d50 = r["p50_ms"] / b["p50_ms"] - 1
+        dips = r["ips"] / b["ips"] - 1
+        drss = r["rss_mb"] / b["rss_mb"] - 1
+        rows.append((r, d50, dips, drss, d50 > tolerance or dips < -tolerance or drss > RSS_TOLERANCE))
+    return rows
+
+
+def print_row(r: dict):
+    head = (f"  {r['model']:22s} {r['imgsz']:5d} {r['batch']:3d} "
+            f"{r['threads'] or '-':>3} {r['inter'] or '-':>3}")
+    if "p50_ms" in r:
+        print(f"{head} {r['cold_start_s']:7.2f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['ips']:7.1f} {r['rss_mb']:7.0f}")
+    else:
+        print(f"{head}  — {r.get('skip') or r.get('error')}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Бенчмарк инференса: PyTorch / ONNX / INT8")
+    p.add_argument("--models", nargs="+", default=None,
+                   help="best.pt / *.onnx (по умолчанию все из runs/metro_damage/weights)")
+    p.add_argument("--imgsz", type=int, nargs="+", default=[IMGSZ])
+    p.add_argument("--batch", type=int, nargs="+", default=[1])
+    p.add_argument("--threads", type=int, nargs="+", default=[0], help="intra-op потоки (0 — по умолчанию)")
+    p.add_argument("--inter", type=int, nargs="+", default=[0], help="inter-op потоки (0 — последовательно)")
+    p.add_argument("--runs", type=int, default=RUNS)
+    p.add_argument("--warmup", type=int, default=WARMUP)
+    p.add_argument("--out", default=None, help="JSON с результатами (по умолчанию runs/bench/<время>.json)")
+    p.add_argument("--baseline", default=BASELINE, help="с чем сравнивать")
+    p.add_argument("--save-baseline", action="store_true", help="записать результат как новую базу")
+    p.add_argument("--tolerance", type=float, default=TOLERANCE)
+    p.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(json.loads(args.worker))))
+        return
+
+    models = args.models or find_models()
+    if not models:
+        sys.exit(f"Нет моделей в {WEIGHTS}\nСначала: python main.py train && python main.py export")
+
+    print("=" * 92)
+    print("  БЕНЧМАРК ИНФЕРЕНСА")
+    print("=" * 92)
+    env = environment()
+    print(f"  {env['cpu']}, ядер {env['cores']}, onnxruntime {env['onnxruntime']}, torch {env['torch']}")
+    print(f"\n  {'модель':22s} {'imgsz':>5s} {'bs':>3s} {'thr':>3s} {'int':>3s} {'старт,с':>7s} "
+          f"{'p50, мс':>8s} {'p95, мс':>8s} {'p99, мс':>8s} {'карт/с':>7s} {'RSS,МБ':>7s}")
+
+    results = []
+    for path in models:
+        backend = "torch" if path.endswith(".pt") else "onnx"
+        for imgsz in args.imgsz:
+            for batch in args.batch:
+                for threads in args.threads:
+                    for inter in args.inter:
+                        cfg = {"model": os.path.basename(path), "model_path": os.path.abspath(path),
+                               "backend": backend, "imgsz": imgsz, "batch": batch,
+                               "threads": threads, "inter": inter,
+                               "runs": args.runs, "warmup": args.warmup}
+                        r = {**cfg, **spawn(cfg)}
+                        del r["model_path"], r["runs"], r["warmup"]
+                        results.append(r)
+                        print_row(r)
+
+    report = {"env": env, "runs": args.runs, "results": results}
+    out = args.out or os.path.join(OUT_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n  Результат: {out}")
+
+    failed = False
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"  База записана: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\n  Сравнение с базой от {baseline['env'].get('date')} "
+              f"(допуск {args.tolerance:.0%}, RSS {RSS_TOLERANCE:.0%}):")
+        if baseline["env"].get("cpu") != env["cpu"] or baseline["env"].get("cores") != env["cores"]:
+            print(f"  ⚠ база снята на другой машине: {baseline['env'].get('cpu')}, "
+                  f"ядер {baseline['env'].get('cores')}")
+        for r, d50, dips, drss, bad in rows:
+            head = (f"  {'❌' if bad else '✅'} {r['model']:22s} {r['imgsz']:5d} bs{r['batch']:<3d} "
+                    f"thr {r['threads'] or '-'}/{r['inter'] or '-'}")
+            if d50 is None:
+                print(f"{head}  нет замера: {r['error']}")
+            else:
+                print(f"{head}  p50 {d50:+.1%}  карт/с {dips:+.1%}  RSS {drss:+.1%}")
+        if not rows:
+            print("  Нет общих точек с базой")
+        failed = any(row[4] for row in rows)
+        if failed:
+            print(f"\n  ❌ РЕГРЕССИЯ: {sum(row[4] for row in rows)} из {len(rows)} точек хуже базы")
+    print(f"{'=' * 92}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Content-addressed кэш ответов модели генерации картинок.
+
+Ключ — sha256(model, полный промпт, номер варианта). Значение — байты
+картинки ровно в том виде, в каком их вернул провайдер. Сами байты лежат
+в blobs/<2 символа>/<sha256 содержимого>, поэтому одинаковые картинки
+под разными ключами хранятся один раз. Индекс (ключ → blob, размер,
+время доступа, цена) — SQLite, вытеснение LRU по суммарному размеру.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "image_cache")
+MAX_MB = 2048
+
+
+def make_key(model: str, prompt: str, variant: int = 0) -> str:
+    raw = json.dumps([model, prompt, int(variant)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, root: str = CACHE_DIR, max_mb: float = MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0        # сколько $ не потратили благодаря кэшу
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"),
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key     TEXT PRIMARY KEY,
+                blob    TEXT NOT NULL,
+                size    INTEGER NOT NULL,
+                cost    REAL NOT NULL DEFAULT 0,
+                model   TEXT,
+                variant INTEGER,
+                atime   REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries(atime)")
+        self.db.commit()
+
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self.root, "blobs", blob[:2], blob)
+
+    # ── Чтение ────────────────────────────────────────────
+    def get(self, model, prompt: str, variant: int = 0):
+        """
+        Байты картинки или None. Обновляет время доступа (LRU).
+        model — имя модели или список имён (первое найденное).
+        """
+        models = [model] if isinstance(model, str) else list(model)
+        with self.lock:
+            row = None
+            for m in models:
+                key = make_key(m, prompt, variant)
+                row = self.db.execute(
+                    "SELECT blob, cost FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    break
+            data = None
+            if row is not None:
+                try:
+                    with open(self._blob_path(row[0]), "rb") as f:
+                        data = f.read()
+                except OSError:
+                    # Файл удалён руками — забываем запись
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if data is None:
+                self.misses += 1
+                self.db.commit()
+                return None
+            self.hits += 1
+            self.saved += row[1]
+            self.db.execute("UPDATE entries SET atime = ? WHERE key = ?",
+                            (time.time(), key))
+            self.db.commit()
+            return data
+
+    # ── Запись ────────────────────────────────────────────
+    def put(self, model: str, prompt: str, variant: int, data: bytes,
+            cost: float = 0.0):
+        key = make_key(model, prompt, variant)
+        blob = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob)
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, blob, size, cost, model, variant, atime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, blob, len(data), cost, model, int(variant), time.time()),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """Удаляет самые давние записи, пока кэш больше max_bytes."""
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, blob, size in self.db.execute(
+            "SELECT key, blob, size FROM entries ORDER BY atime"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evicted += 1
+            # Один blob может принадлежать нескольким ключам
+            still_used = self.db.execute(
+                "SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)
+            ).fetchone()
+            if not still_used:
+                try:
+                    os.remove(self._blob_path(blob))
+                except OSError:
+                    pass
+
+    # ── Отчёт ─────────────────────────────────────────────
+    def stats(self) -> dict:
+        with self.lock:
+            n, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved": self.saved,
+            "evicted": self.evicted,
+            "entries": n,
+            "size_mb": size / 1024 / 1024,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,326 @@
+"""
+Каталог датасета — один SQLite-файл, общий для всех стадий.
+
+    python catalog.py                 # синхронизировать с папками и показать сводку
+    python catalog.py --missing       # картинки без лейблов
+
+generate_data.py записывает сюда каждую сохранённую картинку (класс,
+сцена, промпт), augment.py — каждый выход (источник и цепочка), а
+data.py берёт из каталога список сэмплов, классы и статистику вместо
+обхода файлов. Запись о сэмпле: путь, стадия, источник (исходная
+картинка — все её аугментации на одной стороне split), класс, сцена,
+промпт, цепочка аугментации, лейбл, размер картинки и боксы.
+
+sync() подхватывает файлы, появившиеся мимо каталога (старые прогоны,
+composite.py, ручные правки): один listdir на папку, описываются только
+новые или изменённые файлы, исчезнувшие удаляются.
+"""
+import os
+import re
+import time
+import random
+import sqlite3
+import argparse
+import threading
+
+from PIL import Image
+
+import shards
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_FILE = os.path.join(BASE_DIR, "catalog.sqlite")
+
+STAGES = {
+    "generated": os.path.join(BASE_DIR, "generated_dataset"),
+    "augmented": os.path.join(BASE_DIR, "augmented_dataset"),
+}
+
+# damaged_seat_0007_crop_noise → damaged_seat_0007; comp_000012 → comp_000012
+_SOURCE_RE = re.compile(r"^(.*?_\d{4,})(?:_[A-Za-z].*)?$")
+
+
+def source_of(stem: str) -> str:
+    """Исходная картинка по имени файла (для записей без явного источника)."""
+    m = _SOURCE_RE.match(stem)
+    return m.group(1) if m else stem
+
+
+def parse_label(text: str):
+    """[(cls_id, xc, yc, w, h), ...] — строки неверного формата пропускаются."""
+    boxes = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 5:
+            continue
+        try:
+            boxes.append((int(parts[0]), *map(float, parts[1:])))
+        except ValueError:
+            continue
+    return boxes
+
+
+def read_classes(path: str):
+    """classes.txt → {id: имя} (пустой словарь, если файла нет)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {i: name for i, name in enumerate(l.strip() for l in f if l.strip())}
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(os.path.abspath(path), BASE_DIR).replace(os.sep, "/")
+
+
+def group_split(rows, split: float, seed: int):
+    """
+    rows — [(ключ, источник, класс)]. Возвращает (train_keys, val_keys):
+    источник целиком попадает в одну часть, доля train — split по каждому
+    классу отдельно (стратификация по классу источника).
+    """
+    sources = {}
+    for key, src, cls_id in rows:
+        s = sources.setdefault(src, [cls_id, []])
+        s[1].append(key)
+    by_class = {}
+    for src, (cls_id, _) in sources.items():
+        by_class.setdefault(cls_id, []).append(src)
+
+    rng = random.Random(seed)
+    train, val = [], []
+    for cls_id in sorted(by_class, key=lambda c: (c is None, c)):
+        srcs = sorted(by_class[cls_id])
+        rng.shuffle(srcs)
+        n_train = int(round(len(srcs) * split))
+        if len(srcs) > 1:
+            n_train = min(max(n_train, 1), len(srcs) - 1)   # обе части непустые
+        for i, src in enumerate(srcs):
+            (train if i < n_train else val).extend(sources[src][1])
+    return train, val
+
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS classes (
+                id   INTEGER PRIMARY KEY,
+                name TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS samples (
+                path    TEXT PRIMARY KEY,     -- от корня проекта, через /
+                stage   TEXT NOT NULL,        -- generated | augmented
+                source  TEXT NOT NULL,        -- исходная картинка (группа для split)
+                cls_id  INTEGER,
+                scene   TEXT,
+                prompt  TEXT,
+                aug     TEXT NOT NULL DEFAULT '',   -- цепочка ('' — оригинал)
+                label   TEXT,                 -- путь лейбла или NULL
+                width   INTEGER,
+                height  INTEGER,
+                n_boxes INTEGER NOT NULL DEFAULT 0,
+                mtime   REAL,
+                label_mtime REAL              -- mtime лейбла: правка лейбла тоже переиндексирует
+            );
+            CREATE INDEX IF NOT EXISTS samples_stage  ON samples(stage, cls_id);
+            CREATE INDEX IF NOT EXISTS samples_source ON samples(source);
+            CREATE TABLE IF NOT EXISTS boxes (
+                path   TEXT NOT NULL,
+                cls_id INTEGER NOT NULL,
+                xc REAL, yc REAL, w REAL, h REAL
+            );
+            CREATE INDEX IF NOT EXISTS boxes_path ON boxes(path);
+        """)
+        cols = {row[1] for row in self.db.execute("PRAGMA table_info(samples)")}
+        if "label_mtime" not in cols:           # каталог старой версии
+            self.db.execute("ALTER TABLE samples ADD COLUMN label_mtime REAL")
+        self.db.commit()
+
+    # ── Классы ────────────────────────────────────────────
+    def set_classes(self, names):
+        """names — {id: имя} или список имён по порядку id."""
+        items = names.items() if isinstance(names, dict) else enumerate(names)
+        with self.lock:
+            self.db.execute("DELETE FROM classes")
+            self.db.executemany("INSERT INTO classes (id, name) VALUES (?, ?)", list(items))
+            self.db.commit()
+
+    def classes(self) -> dict:
+        with self.lock:
+            return dict(self.db.execute("SELECT id, name FROM classes ORDER BY id"))
+
+    # ── Запись ────────────────────────────────────────────
+    def _upsert(self, stage, path, label_path=None, label_text=None, size=None,
+                source=None, cls_id=None, scene=None, prompt=None, aug=None, mtime=None,
+                label_mtime=None):
+        rel = _rel(path)
+        if label_text is None and label_path and os.path.exists(label_path):
+            with open(label_path, encoding="utf-8") as f:
+                label_text = f.read()
+        boxes = parse_label(label_text) if label_text is not None else []
+        if cls_id is None and boxes:
+            cls_id = boxes[0][0]
+        if size is None:
+            try:
+                with Image.open(path) as img:      # читается только заголовок
+                    size = img.size
+            except Exception:
+                size = (None, None)
+        if mtime is None:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                mtime = None
+        if label_mtime is None and label_path and os.path.exists(label_path):
+            label_mtime = os.path.getmtime(label_path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        source = source or source_of(stem)
+        if aug is None:
+            aug = stem[len(source) + 1:] if stem.startswith(source + "_") else ""
+        self.db.execute(
+            "INSERT OR REPLACE INTO samples (path, stage, source, cls_id, scene, prompt, aug,"
+            " label, width, height, n_boxes, mtime, label_mtime)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel, stage, source, cls_id, scene, prompt, aug,
+             _rel(label_path) if label_text is not None and label_path else None,
+             size[0], size[1], len(boxes), mtime, label_mtime))
+        self.db.execute("DELETE FROM boxes WHERE path = ?", (rel,))
+        self.db.executemany("INSERT INTO boxes (path, cls_id, xc, yc, w, h) VALUES (?, ?, ?, ?, ?, ?)",
+                            [(rel, *b) for b in boxes])
+
+    def add(self, stage, path, **fields):
+        """Одна запись (заменяет прежнюю с тем же путём)."""
+        with self.lock:
+            self._upsert(stage, path, **fields)
+            self.db.commit()
+
+    def add_many(self, stage, records):
+        """records — [(путь, {поля}), ...] одной транзакцией."""
+        with self.lock:
+            for path, fields in records:
+                self._upsert(stage, path, **fields)
+            self.db.commit()
+
+    def remove(self, paths):
+        rels = [(_rel(p),) for p in paths]
+        with self.lock:
+            self.db.executemany("DELETE FROM samples WHERE path = ?", rels)
+            self.db.executemany("DELETE FROM boxes WHERE path = ?", rels)
+            self.db.commit()
+
+    # ── Синхронизация с папками ───────────────────────────
+    def sync(self, stage: str, root: str = None):
+        """
+        Подтягивает каталог к содержимому папки стадии. Возвращает
+        (добавлено/обновлено, удалено).
+        """
+        root = root or STAGES[stage]
+        if not os.path.isdir(root):
+            return 0, 0
+        cls_ids = {name: i for i, name in read_classes(os.path.join(root, "classes.txt")).items()}
+        with self.lock:
+            known = {path: (mtime, label_mtime) for path, mtime, label_mtime in self.db.execute(
+                "SELECT path, mtime, label_mtime FROM samples WHERE stage = ?", (stage,))}
+
+        seen = set()
+        fresh = []
+        for key, img_path, lbl_path in shards.scan_dir(root):
+            rel = _rel(img_path)
+            seen.add(rel)
+            lbl_path = lbl_path or os.path.join(
+                root, "labels", os.path.splitext(os.path.basename(img_path))[0] + ".txt")
+            mtime = os.path.getmtime(img_path)
+            label_mtime = os.path.getmtime(lbl_path) if os.path.exists(lbl_path) else None
+            if known.get(rel) == (mtime, label_mtime):
+                continue
+            folder = key.split("/", 1)[0]
+            fresh.append((img_path, {
+                "label_path": lbl_path,
+                "cls_id": cls_ids.get(folder),
+                "mtime": mtime,
+                "label_mtime": label_mtime,
+            }))
+        gone = [os.path.join(BASE_DIR, p) for p in known if p not in seen]
+        if fresh:
+            self.add_many(stage, fresh)
+        if gone:
+            self.remove(gone)
+        return len(fresh), len(gone)
+
+    # ── Запросы ───────────────────────────────────────────
+    def samples(self, stage: str, labeled: bool = None):
+        """[(путь, источник, класс, лейбл), ...] в порядке путей."""
+        q = "SELECT path, source, cls_id, label FROM samples WHERE stage = ?"
+        if labeled is True:
+            q += " AND label IS NOT NULL"
+        elif labeled is False:
+            q += " AND label IS NULL"
+        with self.lock:
+            return self.db.execute(q + " ORDER BY path", (stage,)).fetchall()
+
+    def prompts(self, stage: str):
+        """[(путь, класс, промпт | None), ...]."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, cls_id, prompt FROM samples WHERE stage = ? ORDER BY path",
+                (stage,)).fetchall()
+
+    def missing_labels(self, stage: str):
+        return [r[0] for r in self.samples(stage, labeled=False)]
+
+    def box_classes(self, stage: str):
+        """{путь: {класс: число боксов}} для всех сэмплов стадии."""
+        out = {}
+        with self.lock:
+            for path, cls_id, n in self.db.execute(
+                "SELECT b.path, b.cls_id, COUNT(*) FROM boxes b JOIN samples s ON s.path = b.path"
+                " WHERE s.stage = ? GROUP BY b.path, b.cls_id", (stage,)):
+                out.setdefault(path, {})[cls_id] = n
+        return out
+
+    def histogram(self, stage: str):
+        """{класс: (картинок, боксов)}."""
+        with self.lock:
+            imgs = dict(self.db.execute(
+                "SELECT cls_id, COUNT(*) FROM samples WHERE stage = ? GROUP BY cls_id", (stage,)))
+            boxes = dict(self.db.execute(
+                "SELECT b.cls_id, COUNT(*) FROM boxes b JOIN samples s ON s.path = b.path"
+                " WHERE s.stage = ? GROUP BY b.cls_id", (stage,)))
+        return {c: (imgs.get(c, 0), boxes.get(c, 0)) for c in sorted(set(imgs) | set(boxes),
+                                                                    key=lambda c: (c is None, c))}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Каталог датасета (catalog.sqlite)")
+    p.add_argument("--stage", choices=sorted(STAGES), action="append",
+                   help="какие стадии (по умолчанию все)")
+    p.add_argument("--missing", action="store_true", help="показать картинки без лейблов")
+    args = p.parse_args()
+
+    cat = Catalog()
+    for stage in args.stage or sorted(STAGES):
+        t0 = time.time()
+        added, removed = cat.sync(stage)
+        names = cat.classes() or read_classes(os.path.join(STAGES[stage], "classes.txt"))
+        rows = cat.samples(stage)
+        print(f"\n  {stage}: {len(rows)} сэмплов, {len({r[1] for r in rows})} источников"
+              f"  (sync +{added} −{removed}, {time.time() - t0:.2f}с)")
+        for cls_id, (n_img, n_box) in cat.histogram(stage).items():
+            print(f"    {names.get(cls_id, cls_id)!s:20s} {n_img:7d} карт. {n_box:7d} боксов")
+        missing = cat.missing_labels(stage)
+        if missing:
+            print(f"    Без лейблов: {len(missing)}")
+            if args.missing:
+                for path in missing:
+                    print(f"      {path}")
+    cat.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Локальный синтез без API: вырезаем дефекты из уже сгенерированных картинок
+и вклеиваем их в чистые фоны вагонов.
+
+    python composite.py --count 5000 --workers 8
+
+Источники дефектов — generated_dataset/damaged_*/. Если для картинки есть
+маска generated_dataset/masks/<имя>.png (белое — дефект), вырезается ровно
+она; иначе берётся центральная область кадра (PATCH_FRAC) с мягкими краями —
+промпты ставят повреждение в фокус кадра.
+
+Фоны — backgrounds/*.jpg|png (чистые интерьеры без повреждений).
+
+Каждый патч масштабируется, слегка искажается перспективой, подгоняется по
+цвету к месту вклейки и смешивается по размытой альфе. Метка YOLO —
+настоящий плотный bbox по альфе вклеенного патча. Результат пишется в
+augmented_dataset/ (comp_*.jpg + labels), откуда его забирает data.py.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BASE_DIR, "generated_dataset")
+MASK_DIR = os.path.join(SRC_DIR, "masks")
+BG_DIR = os.path.join(BASE_DIR, "backgrounds")
+OUT_DIR = os.path.join(BASE_DIR, "augmented_dataset")
+
+COUNT = 2000
+PER_IMAGE = (1, 3)       # сколько дефектов вклеивать в один фон
+SCALE = (0.15, 0.45)     # ширина патча относительно ширины фона
+PATCH_FRAC = 0.5         # доля кадра, если маски нет
+PERSPECTIVE = 0.12       # максимальный сдвиг углов, доля стороны
+COLOR_MATCH = 0.6        # 0 — цвет патча как есть, 1 — статистики места вклейки
+MAX_SIDE = 1024          # фоны больше — уменьшаются один раз при загрузке
+MAX_IOU = 0.3            # допустимое перекрытие вклеенных дефектов
+PATCH_CACHE = 256        # вырезанных патчей в памяти воркера (LRU)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+# ──────────────────────────────────────────────────────────
+#  Источники
+# ──────────────────────────────────────────────────────────
+def load_sources():
+    """[(cls_id, путь к картинке, путь к маске | None), ...]"""
+    cls_file = os.path.join(SRC_DIR, "classes.txt")
+    if os.path.exists(cls_file):
+        with open(cls_file, encoding="utf-8") as f:
+            names = [l.strip() for l in f if l.strip()]
+    else:
+        names = sorted(d for d in os.listdir(SRC_DIR) if d.startswith("damaged_"))
+
+    sources = []
+    for cls_id, name in enumerate(names):
+        d = os.path.join(SRC_DIR, name)
+        if not os.path.isdir(d):
+            continue
+        for fname in sorted(os.listdir(d)):
+            if not fname.lower().endswith(IMAGE_EXTS):
+                continue
+            mask = os.path.join(MASK_DIR, os.path.splitext(fname)[0] + ".png")
+            sources.append((cls_id, os.path.join(d, fname),
+                            mask if os.path.exists(mask) else None))
+    return names, sources
+
+
+def load_backgrounds():
+    if not os.path.isdir(BG_DIR):
+        return []
+    return [os.path.join(BG_DIR, f) for f in sorted(os.listdir(BG_DIR))
+            if f.lower().endswith(IMAGE_EXTS)]
+
+
+# ──────────────────────────────────────────────────────────
+#  Патчи
+# ──────────────────────────────────────────────────────────
+def cut_patch(img_path, mask_path):
+    """RGBA-патч дефекта: по маске или центральная область с мягкими краями."""
+    img = Image.open(img_path)
+    img.draft("RGB", (MAX_SIDE, MAX_SIDE))   # JPEG: декодируем сразу в уменьшенном виде
+    img = img.convert("RGB")
+    w, h = img.size
+
+    if mask_path:
+        mask = Image.open(mask_path).convert("L").resize((w, h), Image.BILINEAR)
+        box = mask.point(lambda v: 255 if v > 127 else 0).getbbox()
+        if box is None:
+            return None
+        alpha = mask.filter(ImageFilter.GaussianBlur(2))
+    else:
+        cw, ch = int(w * PATCH_FRAC), int(h * PATCH_FRAC)
+        box = ((w - cw) // 2, (h - ch) // 2, (w + cw) // 2, (h + ch) // 2)
+        alpha = Image.new("L", (w, h), 0)
+        pad_x, pad_y = cw // 10, ch // 10
+        ImageDraw.Draw(alpha).ellipse(
+            (box[0] + pad_x, box[1] + pad_y, box[2] - pad_x, box[3] - pad_y), fill=255)
+        alpha = alpha.filter(ImageFilter.GaussianBlur(min(cw, ch) / 20))
+
+    patch = img.crop(box)
+    patch.putalpha(alpha.crop(box))
+    return patch
+
+
+def perspective_coeffs(src, dst):
+    """Коэффициенты Image.PERSPECTIVE, переводящие dst-углы в src-углы."""
+    m = []
+    for (x, y), (u, v) in zip(dst, src):
+        m.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        m.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+    a = np.array(m, dtype=np.float64)
+    b = np.array(src, dtype=np.float64).reshape(8)
+    return np.linalg.solve(a, b).tolist()
+
+
+def warp_patch(patch, rng):
+    """Случайная перспектива: сдвигаем углы на ±PERSPECTIVE стороны."""
+    w, h = patch.size
+    j = PERSPECTIVE
+    src = [(0, 0), (w, 0), (w, h), (0, h)]
+    dst = [(x + rng.uniform(-j, j) * w, y + rng.uniform(-j, j) * h) for x, y in src]
+    xs, ys = [p[0] for p in dst], [p[1] for p in dst]
+    ox, oy = min(xs), min(ys)
+    dst = [(x - ox, y - oy) for x, y in dst]
+    size = (max(1, int(max(xs) - ox)), max(1, int(max(ys) - oy)))
+    return patch.transform(size, Image.PERSPECTIVE, perspective_coeffs(src, dst),
+                           Image.BILINEAR)
+
+
+def match_colour(rgb, alpha, region):
+    """Подгоняет средние и разброс каналов патча к месту вклейки."""
+    wgt = alpha[..., None]
+    total = max(float(alpha.sum()), 1.0)
+    mu_p = (rgb * wgt).sum(axis=(0, 1)) / total
+    sd_p = np.sqrt(((rgb - mu_p) ** 2 * wgt).sum(axis=(0, 1)) / total) + 1e-3
+    mu_r = region.mean(axis=(0, 1))
+    sd_r = region.std(axis=(0, 1)) + 1e-3
+    # Разброс меняем мягко: дефект должен остаться контрастным
+    scale = 1 + COLOR_MATCH * (np.clip(sd_r / sd_p, 0.5, 2.0) - 1)
+    shift = COLOR_MATCH * (mu_r - mu_p)
+    return (rgb - mu_p) * scale + mu_p + shift
+
+
+def iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+# ──────────────────────────────────────────────────────────
+#  Воркер
+# ──────────────────────────────────────────────────────────
+_state = {}
+
+
+def _init(sources, backgrounds, seed, out_images, out_labels):
+    _state.update(sources=sources, backgrounds=backgrounds, seed=seed,
+                  out_images=out_images, out_labels=out_labels,
+                  bg_cache={}, patch_cache=OrderedDict())
+
+
+def _background(path):
+    cache = _state["bg_cache"]
+    if path not in cache:
+        img = Image.open(path)
+        img.draft("RGB", (MAX_SIDE, MAX_SIDE))
+        img = img.convert("RGB")
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+        cache[path] = np.asarray(img, dtype=np.float32)
+    return cache[path]
+
+
+def _patch(source):
+    """Патч источника; последние PATCH_CACHE держатся в памяти воркера."""
+    cache = _state["patch_cache"]
+    key = source[1]
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = patch = cut_patch(source[1], source[2])
+    if len(cache) > PATCH_CACHE:
+        cache.popitem(last=False)
+    return patch
+
+
+def make_sample(n: int):
+    """Один синтетический кадр. Возвращает (n, число дефектов, ошибка | None)."""
+    rng = random.Random(_state["seed"] * 1_000_003 + n)
+    try:
+        canvas = _background(rng.choice(_state["backgrounds"])).copy()
+        H, W = canvas.shape[:2]
+        boxes, lines = [], []
+
+        for _ in range(rng.randint(*PER_IMAGE)):
+            cls_id, img_path, mask_path = source = rng.choice(_state["sources"])
+            patch = _patch(source)
+            if patch is None:
+                continue
+
+            tw = int(W * rng.uniform(*SCALE))
+            th = max(1, int(tw * patch.size[1] / patch.size[0]))
+            if th > H * 0.8:
+                th = int(H * 0.8)
+                tw = max(1, int(th * patch.size[0] / patch.size[1]))
+            p = patch.resize((tw, th), Image.BILINEAR)
+            if rng.random() < 0.5:
+                p = p.transpose(Image.FLIP_LEFT_RIGHT)
+            p = warp_patch(p, rng)
+            pw, ph = p.size
+            if pw >= W or ph >= H:
+                continue
+
+            # Место без сильного перекрытия с уже вклеенными
+            for _try in range(10):
+                x, y = rng.randint(0, W - pw), rng.randint(0, H - ph)
+                if all(iou((x, y, x + pw, y + ph), b) < MAX_IOU for b in boxes):
+                    break
+            else:
+                continue
+
+            arr = np.asarray(p, dtype=np.float32)
+            alpha = arr[..., 3] / 255.0
+            region = canvas[y:y + ph, x:x + pw]
+            rgb = match_colour(arr[..., :3], alpha, region)
+            a = alpha[..., None]
+            region *= 1 - a
+            region += np.clip(rgb, 0, 255) * a
+
+            # Плотный bbox по альфе
+            ys, xs = np.nonzero(alpha > 0.1)
+            if not len(xs):
+                continue
+            bx0, by0, bx1, by1 = x + xs.min(), y + ys.min(), x + xs.max() + 1, y + ys.max() + 1
+            boxes.append((bx0, by0, bx1, by1))
+            lines.append(f"{cls_id} {(bx0 + bx1) / 2 / W:.6f} {(by0 + by1) / 2 / H:.6f} "
+                         f"{(bx1 - bx0) / W:.6f} {(by1 - by0) / H:.6f}")
+
+        stem = f"comp_{n:06d}"
+        Image.fromarray(canvas.astype(np.uint8)).save(
+            os.path.join(_state["out_images"], f"{stem}.jpg"), "JPEG", quality=90)
+        with open(os.path.join(_state["out_labels"], f"{stem}.txt"), "w") as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        return n, len(lines), None
+    except Exception as e:
+        return n, 0, str(e)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Синтез датасета вклейкой дефектов в чистые фоны")
+    p.add_argument("--count", type=int, default=COUNT, help="сколько кадров сделать")
+    p.add_argument("--workers", type=int, default=cpu_count(), help="процессов")
+    p.add_argument("--seed", type=int, default=0, help="база для зерна каждого кадра")
+    p.add_argument("--start", type=int, default=0, help="номер первого кадра (comp_NNNNNN)")
+    p.add_argument("--out", default=OUT_DIR, help="куда писать images/ и labels/")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 55)
+    print("  СИНТЕЗ ВКЛЕЙКОЙ (без API)")
+    print("=" * 55)
+
+    if not os.path.isdir(SRC_DIR):
+        sys.exit(f"Нет папки {SRC_DIR}")
+    names, sources = load_sources()
+    if not sources:
+        sys.exit("Нет исходных картинок damaged_*")
+    backgrounds = load_backgrounds()
+    if not backgrounds:
+        sys.exit(f"Нет чистых фонов в {BG_DIR}")
+
+    out_images = os.path.join(args.out, "images")
+    out_labels = os.path.join(args.out, "labels")
+    os.makedirs(out_images, exist_ok=True)
+    os.makedirs(out_labels, exist_ok=True)
+    with open(os.path.join(args.out, "classes.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(names) + "\n")
+
+    n_masks = sum(1 for s in sources if s[2])
+    print(f"\n  Дефектов: {len(sources)} (с масками: {n_masks})")
+    for cls_id, name in enumerate(names):
+        print(f"    {name}: {sum(1 for s in sources if s[0] == cls_id)}")
+    print(f"  Фонов:    {len(backgrounds)}")
+    print(f"  Кадров:   {args.count}, процессов: {args.workers}")
+    print(f"\n{'─'*55}\n")
+
+    t0 = time.time()
+    done = objects = 0
+    errors = []
+    jobs = range(args.start, args.start + args.count)
+    with Pool(args.workers, initializer=_init,
+              initargs=(sources, backgrounds, args.seed, out_images, out_labels)) as pool:
+        for n, k, err in pool.imap_unordered(make_sample, jobs, chunksize=16):
+            done += 1
+            objects += k
+            if err:
+                errors.append((n, err))
+            if done % 500 == 0:
+                rate = done / (time.time() - t0) * 60
+                print(f"  {done}/{args.count}  ({rate:.0f} кадров/мин)")
+
+    t = time.time() - t0
+    for n, err in errors[:10]:
+        print(f"  ✗ comp_{n:06d}: {err}")
+
+    print(f"\n{'='*55}")
+    print(f"  ГОТОВО!")
+    print(f"  Кадров:   {done - len(errors)}  (ошибок: {len(errors)})")
+    print(f"  Дефектов: {objects}")
+    print(f"  Время:    {t:.1f}с  ({done / max(t, 1e-9) * 60:.0f} кадров/мин)")
+    print(f"")
+    print(f"  {args.out}/")
+    print(f"    images/  comp_*.jpg")
+    print(f"    labels/  comp_*.txt")
+    print(f"{'='*55}")
+
+
+if __name__ == "__main__":
+    main()
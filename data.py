@@ -1,136 +1,295 @@
 import os
 import sys
-import random
 import shutil
+import argparse
+
+import shards
+import catalog
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SRC_DIR = os.path.join(BASE_DIR, "augmented_dataset")
+GEN_DIR = os.path.join(BASE_DIR, "generated_dataset")
 OUT_DIR = os.path.join(BASE_DIR, "dataset_yolo")
 
 SPLIT = 0.8  # 80% train, 20% val
+SEED = 42
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+# Как раскладывать train/val: ссылки вместо копий, либо только списки
+# train.txt/val.txt (Ultralytics сам найдёт labels/ рядом с images/).
+# auto — первое, что умеет ФС: hardlink → reflink → symlink → списки → copy.
+LINK = "auto"
+LINK_MODES = ("auto", "hardlink", "reflink", "symlink", "list", "copy")
+_FICLONE = 0x40049409     # ioctl Linux: reflink (btrfs, xfs, ...)
+
+
+def collect(online, pack=None):
+    """
+    Сэмплы для split:
+        samples — [(папка | номер в шарде, имя картинки, имя лейбла | None, источник, класс)]
+        src     — папка лейблов или shards.ShardReader
+        names   — {id: имя класса}
+        boxes   — {(папка, имя): {класс: число боксов}}
+
+    online — только исходники generated_dataset/ (аугментирует загрузчик
+    при обучении, см. online_augment.py), иначе augmented_dataset/.
+    Обычный источник читается из каталога (catalog.py) — файлы не
+    обходятся, sync() добирает только новые. pack — упакованный датасет
+    (shards.py): вместо папки — номер сэмпла, вместо папки лейблов — ShardReader.
+    """
+    root = GEN_DIR if online else SRC_DIR
+    if pack:
+        reader = shards.ShardReader(pack)
+        names = {i: n for i, n in enumerate(l.strip() for l in reader.classes.splitlines() if l.strip())}
+        samples, boxes = [], {}
+        for i, key in enumerate(reader.keys):
+            if online and key.startswith("images/"):
+                continue
+            name = os.path.basename(key)
+            stem = os.path.splitext(name)[0]
+            label = reader.label(i)
+            counts = {}
+            for b in catalog.parse_label(label or ""):
+                counts[b[0]] = counts.get(b[0], 0) + 1
+            boxes[(i, name)] = counts
+            samples.append((i, name, f"{stem}.txt" if label is not None else None,
+                            catalog.source_of(stem), next(iter(counts), None)))
+        # Порядок как у папки
+        samples.sort(key=lambda s: s[1])
+        return samples, reader, names, boxes
+
+    if not os.path.isdir(root):
+        hint = "generate_data.py" if online else "augment.py"
+        sys.exit(f"Нет папки {root}\nСначала запустите {hint}")
+    stage = "generated" if online else "augmented"
+    cat = catalog.Catalog()
+    added, removed = cat.sync(stage, root)
+    if added or removed:
+        print(f"\n  Каталог: +{added} −{removed} (синхронизация с {os.path.basename(root)}/)")
+    names = catalog.read_classes(os.path.join(root, "classes.txt")) or cat.classes()
+    by_path = cat.box_classes(stage)
+    samples, boxes = [], {}
+    for path, source, cls_id, label in cat.samples(stage):
+        full = os.path.join(BASE_DIR, *path.split("/"))
+        img_dir, name = os.path.dirname(full), os.path.basename(full)
+        if not online and not name.lower().endswith((".jpg", ".jpeg", ".png")):
+            continue
+        boxes[(img_dir, name)] = by_path.get(path, {})
+        samples.append((img_dir, name, os.path.basename(label) if label else None, source, cls_id))
+    cat.close()
+    return samples, os.path.join(root, "labels"), names, boxes
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def _link(src, dst, mode):
+    """Один файл в dataset_yolo/; при ошибке — следующий способ, в конце copy2."""
+    order = ("hardlink", "reflink", "symlink", "copy")
+    for m in order[order.index(mode):]:
+        try:
+            if m == "hardlink":
+                os.link(src, dst)
+            elif m == "reflink":
+                _reflink(src, dst)
+            elif m == "symlink":
+                os.symlink(os.path.abspath(src), dst)
+            else:
+                shutil.copy2(src, dst)
+            return m
+        except (OSError, ImportError):
+            if m == "copy":
+                raise
+    return "copy"
+
+
+def probe_mode(src, out_dir, can_list):
+    """Для auto: первый способ, который работает между src и out_dir."""
+    probe = os.path.join(out_dir, ".link_probe")
+    for m in ("hardlink", "reflink", "symlink"):
+        try:
+            if os.path.lexists(probe):
+                os.remove(probe)
+            if _link(src, probe, m) == m:
+                return m
+        except OSError:
+            pass
+        finally:
+            if os.path.lexists(probe):
+                os.remove(probe)
+    return "list" if can_list else "copy"
+
+
+def put(src_labels, img_dir, img_name, lbl_name, img_out, lbl_out, mode="copy"):
+    """
+    Картинка и лейбл в dataset_yolo/ — ссылкой/копией файла или байтами
+    из шарда. Возвращает фактически использованный способ.
+    """
+    if isinstance(src_labels, shards.ShardReader):
+        with open(os.path.join(img_out, img_name), "wb") as f:
+            f.write(src_labels.image(img_dir))
+        with open(os.path.join(lbl_out, lbl_name), "w") as f:
+            f.write(src_labels.label(img_dir))
+        return "copy"
+    used = _link(os.path.join(img_dir, img_name), os.path.join(img_out, img_name), mode)
+    _link(os.path.join(src_labels, lbl_name), os.path.join(lbl_out, lbl_name), mode)
+    return used
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Split датасета в dataset_yolo/")
+    p.add_argument("--online", action="store_true",
+                   help="только исходники; аугментация на лету (main.py train --online)")
+    p.add_argument("--pack", metavar="DIR",
+                   help="брать сэмплы из упакованного датасета (shards.py)")
+    p.add_argument("--split", type=float, default=SPLIT, help="доля train")
+    p.add_argument("--seed", type=int, default=SEED, help="зерно перемешивания")
+    p.add_argument("--link", choices=LINK_MODES, default=LINK,
+                   help="как раскладывать файлы (по умолчанию — без копирования)")
+    return p.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("=" * 55)
     print("  ПОДГОТОВКА ДАТАСЕТА ДЛЯ YOLO")
     print("=" * 55)
 
-    src_images = os.path.join(SRC_DIR, "images")
-    src_labels = os.path.join(SRC_DIR, "labels")
+    # Собираем пары image + label
+    samples, src_labels, names, boxes = collect(args.online, args.pack)
+    if not names:
+        names = {0: "damaged_seat", 1: "damaged_floor", 2: "damaged_metal"}
 
-    if not os.path.isdir(src_images):
-        sys.exit(f"Нет папки {src_images}\nСначала запустите augment.py")
+    pairs = [s for s in samples if s[2] is not None]
+    missing_labels = len(samples) - len(pairs)
+    n_sources = len({s[3] for s in pairs})
 
-    # Собираем пары image + label
-    all_imgs = sorted([
-        f for f in os.listdir(src_images)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ])
-
-    pairs = []
-    missing_labels = 0
-    for img_name in all_imgs:
-        stem = os.path.splitext(img_name)[0]
-        lbl_name = f"{stem}.txt"
-        lbl_path = os.path.join(src_labels, lbl_name)
-        if os.path.exists(lbl_path):
-            pairs.append((img_name, lbl_name))
-        else:
-            missing_labels += 1
-
-    print(f"\n  Найдено пар (image + label): {len(pairs)}")
+    print(f"\n  Найдено пар (image + label): {len(pairs)}  (источников: {n_sources})")
     if missing_labels:
         print(f"  Без лейблов (пропущены): {missing_labels}")
 
-    # Перемешиваем и делим
-    random.seed(42)
-    random.shuffle(pairs)
-
-    split_idx = int(len(pairs) * SPLIT)
-    train_pairs = pairs[:split_idx]
-    val_pairs = pairs[split_idx:]
+    # Делим по источникам: все аугментации одной картинки — в одной части,
+    # доля train — отдельно по каждому классу
+    by_key = {(s[0], s[1]): s for s in pairs}
+    train_keys, val_keys = catalog.group_split(
+        [((s[0], s[1]), s[3], s[4]) for s in pairs], args.split, args.seed)
+    train_pairs = [by_key[k][:3] for k in train_keys]
+    val_pairs = [by_key[k][:3] for k in val_keys]
 
     print(f"  Train: {len(train_pairs)}")
     print(f"  Val:   {len(val_pairs)}")
 
-    # Создаём структуру
+    # Создаём структуру. Прошлый split убираем целиком — иначе при другом
+    # seed/SPLIT файлы остались бы сразу в train и val (ссылки удаляются быстро).
     dirs = {
         "train_img": os.path.join(OUT_DIR, "train", "images"),
         "train_lbl": os.path.join(OUT_DIR, "train", "labels"),
         "val_img":   os.path.join(OUT_DIR, "val", "images"),
         "val_lbl":   os.path.join(OUT_DIR, "val", "labels"),
     }
-    for d in dirs.values():
-        os.makedirs(d, exist_ok=True)
-
-    # Копируем файлы
-    print(f"\n  Копирование...")
+    for name in ("train", "val"):
+        shutil.rmtree(os.path.join(OUT_DIR, name), ignore_errors=True)
+        for ext in (".txt", ".cache"):
+            if os.path.exists(os.path.join(OUT_DIR, name + ext)):
+                os.remove(os.path.join(OUT_DIR, name + ext))
+    os.makedirs(OUT_DIR, exist_ok=True)
 
-    for img_name, lbl_name in train_pairs:
-        shutil.copy2(os.path.join(src_images, img_name),
-                     os.path.join(dirs["train_img"], img_name))
-        shutil.copy2(os.path.join(src_labels, lbl_name),
-                     os.path.join(dirs["train_lbl"], lbl_name))
+    # Списки train.txt/val.txt возможны, только когда картинки лежат в
+    # .../images/, а лейблы в соседней .../labels/ (так ищет Ultralytics)
+    is_pack = isinstance(src_labels, shards.ShardReader)
+    can_list = not is_pack and not args.online
+    mode = args.link
+    if is_pack:
+        mode = "copy"       # из шарда — только байтами
+    elif mode == "auto" and pairs:
+        mode = probe_mode(os.path.join(pairs[0][0], pairs[0][1]), OUT_DIR, can_list)
+    elif mode == "list" and not can_list:
+        print("  --link list: раскладка источника не подходит, используем ссылки")
+        mode = probe_mode(os.path.join(pairs[0][0], pairs[0][1]), OUT_DIR, False) if pairs else "copy"
 
-    for img_name, lbl_name in val_pairs:
-        shutil.copy2(os.path.join(src_images, img_name),
-                     os.path.join(dirs["val_img"], img_name))
-        shutil.copy2(os.path.join(src_labels, lbl_name),
-                     os.path.join(dirs["val_lbl"], lbl_name))
+    used = {}
+    if mode == "list":
+        print(f"\n  Списки train.txt / val.txt (без копирования)...")
+        for name, split_pairs in [("train", train_pairs), ("val", val_pairs)]:
+            with open(os.path.join(OUT_DIR, f"{name}.txt"), "w") as f:
+                for img_dir, img_name, _ in split_pairs:
+                    f.write(os.path.abspath(os.path.join(img_dir, img_name)) + "\n")
+        used["list"] = len(pairs)
+        train_ref, val_ref = "train.txt", "val.txt"
+    else:
+        for d in dirs.values():
+            os.makedirs(d, exist_ok=True)
+        print(f"\n  Раскладка файлов ({mode})...")
+        for split_name, split_pairs in [("train", train_pairs), ("val", val_pairs)]:
+            for img_dir, img_name, lbl_name in split_pairs:
+                m = put(src_labels, img_dir, img_name, lbl_name,
+                        dirs[f"{split_name}_img"], dirs[f"{split_name}_lbl"], mode)
+                used[m] = used.get(m, 0) + 1
+        train_ref, val_ref = "train/images", "val/images"
+    print(f"  " + ", ".join(f"{m}: {n}" for m, n in used.items()))
 
     # data.yaml
     yaml_path = os.path.join(OUT_DIR, "data.yaml")
     yaml_content = f"""path: {OUT_DIR}
-train: train/images
-val: val/images
+train: {train_ref}
+val: {val_ref}
 
 names:
-  0: damaged_seat
-  1: damaged_floor
-  2: damaged_metal
-"""
+""" + "".join(f"  {i}: {n}\n" for i, n in sorted(names.items()))
     with open(yaml_path, "w") as f:
         f.write(yaml_content)
 
     # Статистика по классам
     print(f"\n  Статистика по классам:")
-    class_counts = {"train": {0: 0, 1: 0, 2: 0}, "val": {0: 0, 1: 0, 2: 0}}
-    class_names = {0: "damaged_seat", 1: "damaged_floor", 2: "damaged_metal"}
+    class_counts = {"train": {i: 0 for i in names}, "val": {i: 0 for i in names}}
+    class_names = names
 
     for split_name, split_pairs in [("train", train_pairs), ("val", val_pairs)]:
-        lbl_dir = dirs[f"{split_name}_lbl"]
-        for _, lbl_name in split_pairs:
-            with open(os.path.join(lbl_dir, lbl_name)) as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if parts:
-                        cls_id = int(parts[0])
-                        class_counts[split_name][cls_id] += 1
+        for img_dir, img_name, _ in split_pairs:
+            for cls_id, n in boxes[(img_dir, img_name)].items():
+                class_counts[split_name][cls_id] = class_counts[split_name].get(cls_id, 0) + n
 
     print(f"  {'Класс':20s} {'Train':>8s} {'Val':>8s}")
     print(f"  {'─'*18}  {'─'*8} {'─'*8}")
-    for cls_id in sorted(class_names):
-        name = class_names[cls_id]
+    for cls_id in sorted(class_counts["train"].keys() | class_counts["val"].keys()):
+        name = class_names.get(cls_id, f"class_{cls_id}")
         tr = class_counts["train"][cls_id]
         va = class_counts["val"][cls_id]
         print(f"  {name:20s} {tr:8d} {va:8d}")
 
     # Итог
-    n_train = len(os.listdir(dirs["train_img"]))
-    n_val = len(os.listdir(dirs["val_img"]))
+    n_train = len(train_pairs)
+    n_val = len(val_pairs)
 
     print(f"\n{'='*55}")
     print(f"  ГОТОВО!")
     print(f"")
     print(f"  {OUT_DIR}/")
-    print(f"    train/images/  {n_train}")
-    print(f"    train/labels/  {n_train}")
-    print(f"    val/images/    {n_val}")
-    print(f"    val/labels/    {n_val}")
+    if mode == "list":
+        print(f"    train.txt      {n_train}")
+        print(f"    val.txt        {n_val}")
+    else:
+        print(f"    train/images/  {n_train}")
+        print(f"    train/labels/  {n_train}")
+        print(f"    val/images/    {n_val}")
+        print(f"    val/labels/    {n_val}")
     print(f"    data.yaml")
     print(f"")
     print(f"  СЛЕДУЮЩИЙ ШАГ — обучение:")
     print(f"")
+    if args.online:
+        print(f"  python main.py train --online")
+        print(f"{'='*55}")
+        return
     print(f"  pip install ultralytics")
     print(f"")
     print(f"  yolo detect train \\")
@@ -0,0 +1,290 @@
+"""
+Поиск почти-дубликатов по перцептивному хэшу.
+
+    python dedup.py                 # отчёт + перенос дублей в generated_dataset/duplicates/
+    python dedup.py --dry-run       # только отчёт
+    python dedup.py --distance 4    # строже
+
+pHash (64 бита: DCT 32×32 яркости, знак относительно медианы 8×8 низких
+частот) устойчив к пережатию и мелким сдвигам цвета. Индекс — multi-index
+hashing: хэш режется на 4 куска по 16 бит, и если расстояние Хэмминга
+≤ r, то хотя бы один кусок отличается не более чем на r // 4 бит. Поиск —
+несколько словарных обращений и проверка popcount у кандидатов, поэтому
+на 100k хэшей остаётся субмиллисекундным.
+
+Индекс хранится в generated_dataset/phash.tsv ("hex<TAB>имя" на строку,
+только дописывается) и пополняется generate_data.py по мере генерации.
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import threading
+from itertools import combinations
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BASE_DIR, "generated_dataset")
+INDEX_FILE = os.path.join(SRC_DIR, "phash.tsv")
+DUP_DIR = os.path.join(SRC_DIR, "duplicates")
+
+DISTANCE = 6        # порог Хэмминга (из 64 бит) для «почти одинаковых»
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+# ──────────────────────────────────────────────────────────
+#  Хэши
+# ──────────────────────────────────────────────────────────
+def _dct_matrix(n: int):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _gray(img, size):
+    if img.mode != "L":
+        img.draft("L", (size[0] * 4, size[1] * 4))   # JPEG: декодируем сразу уменьшенным
+        img = img.convert("L")
+    return img.resize(size, Image.BILINEAR)
+
+
+def phash(img) -> int:
+    """64-битный DCT-хэш картинки PIL."""
+    a = np.asarray(_gray(img, (32, 32)), dtype=np.float64)
+    low = (_DCT32 @ a @ _DCT32.T)[:8, :8].ravel()
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def dhash(img) -> int:
+    """64-битный разностный хэш (быстрее, чуть менее устойчив)."""
+    a = np.asarray(_gray(img, (9, 8)), dtype=np.int16)
+    return _bits_to_int((a[:, 1:] > a[:, :-1]).ravel())
+
+
+def hash_bytes(data: bytes) -> int:
+    with Image.open(io.BytesIO(data)) as img:
+        return phash(img)
+
+
+def hash_file(path: str) -> int:
+    with Image.open(path) as img:
+        return phash(img)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+# ──────────────────────────────────────────────────────────
+#  Индекс
+# ──────────────────────────────────────────────────────────
+CHUNKS = 4
+CHUNK_BITS = 16
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+_flips = {}
+
+
+def _flip_masks(radius: int):
+    """Все 16-битные маски с не более чем radius единицами."""
+    if radius not in _flips:
+        masks = [0]
+        for r in range(1, radius + 1):
+            for pos in combinations(range(CHUNK_BITS), r):
+                masks.append(sum(1 << p for p in pos))
+        _flips[radius] = masks
+    return _flips[radius]
+
+
+def _chunks(h: int):
+    return [(h >> (CHUNK_BITS * i)) & _CHUNK_MASK for i in range(CHUNKS)]
+
+
+class HashIndex:
+    def __init__(self, path: str = None):
+        self.path = path
+        self.keys = []
+        self.hashes = []
+        self.tables = [{} for _ in range(CHUNKS)]
+        self.lock = threading.Lock()
+        self._fh = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 1)
+                    if len(parts) != 2:
+                        continue
+                    try:
+                        h = int(parts[0], 16)
+                    except ValueError:
+                        continue
+                    self._insert(parts[1], h)
+        return self
+
+    def _insert(self, key: str, h: int):
+        n = len(self.keys)
+        self.keys.append(key)
+        self.hashes.append(h)
+        for table, c in zip(self.tables, _chunks(h)):
+            table.setdefault(c, []).append(n)
+
+    def _persist(self, key: str, h: int):
+        if not self.path:
+            return
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(f"{h:016x}\t{key}\n")
+        self._fh.flush()
+
+    def _query(self, h: int, radius: int):
+        masks = _flip_masks(radius // CHUNKS)
+        seen = set()
+        found = []
+        for table, c in zip(self.tables, _chunks(h)):
+            for m in masks:
+                for n in table.get(c ^ m, ()):
+                    if n in seen:
+                        continue
+                    seen.add(n)
+                    d = (h ^ self.hashes[n]).bit_count()
+                    if d <= radius:
+                        found.append((d, self.keys[n]))
+        found.sort()
+        return found
+
+    def query(self, h: int, radius: int = DISTANCE):
+        """[(расстояние, имя), ...] по возрастанию расстояния."""
+        with self.lock:
+            return self._query(h, radius)
+
+    def add(self, key: str, h: int):
+        with self.lock:
+            self._insert(key, h)
+            self._persist(key, h)
+
+    def add_if_new(self, key: str, h: int, radius: int = DISTANCE):
+        """
+        Атомарно: если похожий хэш уже есть — возвращает (расстояние, имя)
+        ближайшего и ничего не добавляет; иначе добавляет и возвращает None.
+        """
+        with self.lock:
+            found = self._query(h, radius)
+            if found:
+                return found[0]
+            self._insert(key, h)
+            self._persist(key, h)
+            return None
+
+    def close(self):
+        with self.lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+# ──────────────────────────────────────────────────────────
+#  Проход по generated_dataset/
+# ──────────────────────────────────────────────────────────
+def _hash_job(path):
+    try:
+        return path, hash_file(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Поиск почти-дубликатов в generated_dataset/")
+    p.add_argument("--distance", type=int, default=DISTANCE, help="порог Хэмминга")
+    p.add_argument("--dry-run", action="store_true", help="только отчёт, ничего не переносить")
+    p.add_argument("--workers", type=int, default=cpu_count())
+    args = p.parse_args()
+
+    print("=" * 55)
+    print("  ПОИСК ДУБЛИКАТОВ (pHash)")
+    print("=" * 55)
+
+    if not os.path.isdir(SRC_DIR):
+        sys.exit(f"Нет папки {SRC_DIR}")
+    class_dirs = sorted(d for d in os.listdir(SRC_DIR)
+                        if os.path.isdir(os.path.join(SRC_DIR, d)) and d.startswith("damaged_"))
+    paths = []
+    for cls_dir in class_dirs:
+        full = os.path.join(SRC_DIR, cls_dir)
+        paths += [os.path.join(full, f) for f in sorted(os.listdir(full))
+                  if f.lower().endswith(IMAGE_EXTS)]
+    print(f"\n  Картинок: {len(paths)}")
+
+    t0 = time.time()
+    with Pool(args.workers) as pool:
+        hashed = pool.map(_hash_job, paths, chunksize=32)
+    print(f"  Хэширование: {time.time() - t0:.1f}с")
+
+    # Индекс строим заново в порядке имён: первый экземпляр остаётся
+    index = HashIndex()
+    dups = []
+    t1 = time.time()
+    for path, h, err in hashed:
+        if err:
+            print(f"  ✗ {os.path.basename(path)}: {err}")
+            continue
+        key = os.path.splitext(os.path.basename(path))[0]
+        hit = index.add_if_new(key, h, args.distance)
+        if hit:
+            dups.append((path, hit))
+    n = max(len(hashed), 1)
+    print(f"  Поиск:       {(time.time() - t1) / n * 1000:.3f} мс/картинку")
+    print(f"  Дубликатов:  {len(dups)}")
+
+    for path, (d, orig) in dups[:20]:
+        print(f"    {os.path.basename(path):30s} ≈ {orig}  (d={d})")
+    if len(dups) > 20:
+        print(f"    ... и ещё {len(dups) - 20}")
+
+    if not args.dry_run:
+        # Перенос дублей вместе с метками
+        for path, _ in dups:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            cls_dir = os.path.basename(os.path.dirname(path))
+            os.makedirs(os.path.join(DUP_DIR, cls_dir), exist_ok=True)
+            shutil.move(path, os.path.join(DUP_DIR, cls_dir, os.path.basename(path)))
+            lbl = os.path.join(SRC_DIR, "labels", f"{stem}.txt")
+            if os.path.exists(lbl):
+                os.makedirs(os.path.join(DUP_DIR, "labels"), exist_ok=True)
+                shutil.move(lbl, os.path.join(DUP_DIR, "labels", f"{stem}.txt"))
+
+        # Индекс на диске = то, что осталось в датасете
+        tmp = INDEX_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key, h in zip(index.keys, index.hashes):
+                f.write(f"{h:016x}\t{key}\n")
+        os.replace(tmp, INDEX_FILE)
+
+    print(f"\n{'='*55}")
+    print(f"  ГОТОВО!")
+    if dups and not args.dry_run:
+        print(f"  Дубли перенесены в {DUP_DIR}")
+    print(f"  Индекс: {INDEX_FILE} ({len(index)} хэшей)")
+    print(f"{'='*55}")
+
+
+if __name__ == "__main__":
+    main()
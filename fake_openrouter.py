@@ -0,0 +1,140 @@
+"""
+Локальный фейковый OpenRouter для проверки generate_data.py без денег.
+
+    python fake_openrouter.py --port 8765 --latency 2 --rps 3 --budget 50
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 python generate_data.py --workers 8
+
+Отвечает на:
+    POST /api/v1/chat/completions — картинка PNG в base64 через `latency` с
+                                    (429, если превышен лимит `rps`;
+                                     402, когда кончился `budget`)
+    GET  /api/v1/auth/key         — баланс в формате OpenRouter
+"""
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pngstub import make_png
+
+COST = 0.04
+
+
+class State:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.window = []        # время последних принятых запросов
+        self.served = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    def admit(self):
+        """Возвращает HTTP-код, которым ответить (200 / 429 / 402)."""
+        with self.lock:
+            if self.args.budget and self.served >= self.args.budget:
+                return 402
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1.0]
+            if self.args.rps and len(self.window) >= self.args.rps:
+                return 429
+            self.window.append(now)
+            self.served += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return 200
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_handler(state: State):
+    args = state.args
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive
+
+        def _send(self, code, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.endswith("/auth/key"):
+                limit = args.budget * COST if args.budget else None
+                self._send(200, {"data": {"usage": state.served * COST, "limit": limit}})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if not self.path.endswith("/chat/completions"):
+                self._send(404, {"error": "not found"})
+                return
+
+            code = state.admit()
+            if code == 429:
+                self._send(429, {"error": "rate limited"}, {"Retry-After": str(args.retry_after)})
+                return
+            if code == 402:
+                self._send(402, {"error": "insufficient credits"})
+                return
+
+            try:
+                time.sleep(args.latency * random.uniform(0.8, 1.2))
+                if args.fail and random.random() < args.fail:
+                    self._send(500, {"error": "internal"})
+                    return
+                png = make_png(args.size, args.size, seed=random.getrandbits(64))
+                b64 = base64.b64encode(png).decode()
+                self._send(200, {
+                    "choices": [{"message": {"images": [
+                        {"image_url": {"url": f"data:image/png;base64,{b64}"}}
+                    ]}}],
+                    "usage": {"cost": COST},
+                })
+            finally:
+                state.done()
+
+        def log_message(self, fmt, *a):
+            if args.verbose:
+                super().log_message(fmt, *a)
+
+    return Handler
+
+
+def main():
+    p = argparse.ArgumentParser(description="Фейковый OpenRouter для локальных тестов")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency", type=float, default=2.0, help="секунд на картинку")
+    p.add_argument("--rps", type=int, default=0, help="лимит запросов в секунду (0 — без лимита)")
+    p.add_argument("--retry-after", type=int, default=2, help="Retry-After для 429")
+    p.add_argument("--budget", type=int, default=0, help="после стольких картинок — 402")
+    p.add_argument("--fail", type=float, default=0.0, help="доля ответов 500")
+    p.add_argument("--size", type=int, default=256, help="сторона картинки, px")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args()
+
+    state = State(args)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    print(f"  Фейковый OpenRouter: http://127.0.0.1:{args.port}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n  Выдано картинок: {state.served}, пик параллельности: {state.peak}")
+
+
+if __name__ == "__main__":
+    main()
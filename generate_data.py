@@ -1,25 +1,64 @@
 import os
 import io
 import json
-import base64
 import time
 import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 from PIL import Image
 from dotenv import load_dotenv
 
+from journal import Journal, DONE, FAILED, DUPLICATE
+from cache import ResponseCache
+from backends import load_backends
+import dedup
+from catalog import Catalog
+from telemetry import Telemetry
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUT_DIR = os.path.join(BASE_DIR, "generated_dataset")
 PROMPTS_FILE = os.path.join(BASE_DIR, "prompts.json")
+JOURNAL_FILE = os.path.join(OUT_DIR, "journal.jsonl")
+BACKENDS_FILE = os.path.join(BASE_DIR, "backends.json")
+EVENTS_FILE = os.path.join(OUT_DIR, "telemetry.jsonl")     # события (telemetry.py)
+METRICS_FILE = os.path.join(OUT_DIR, "metrics.prom")       # метрики Prometheus
 
 load_dotenv()
 
 API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Модель по умолчанию, если нет backends.json (см. backends.py)
 MODEL = "openai/gpt-5-image-mini"
-ENDPOINT = "https://openrouter.ai/api/v1/chat/completions"
+# Базовый URL можно подменить на локальный fake_openrouter.py для тестов
+API_BASE = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
 
 TOTAL = 220
 
+# ── Параллельная генерация ────────────────────────────────
+WORKERS = 4         # одновременных запросов к бэкенду по умолчанию
+RATE = 1.0          # запросов в секунду на бэкенд по умолчанию
+MAX_ERRORS = 15     # после стольких ошибок — остановка
+
+CACHE_MB = 2048     # кэш ответов модели (image_cache/), LRU по размеру
+PRICE = 0.042       # $ за картинку — для оценки, на сколько хватит баланса
+
+# ── Хранение ──────────────────────────────────────────────
+# "keep" — писать байты провайдера как есть (PNG/JPEG/WebP), без
+# перекодирования; "jpg" / "png" — явная конвертация.
+STORE_FORMAT = "keep"
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+_print_lock = threading.Lock()
+
+
+def log(msg: str):
+    """print, безопасный для нескольких потоков."""
+    with _print_lock:
+        print(msg, flush=True)
+
 
 # ──────────────────────────────────────────────────────────
 #  Загрузка и разбор prompts.json
@@ -41,7 +80,7 @@ def load_prompts():
     }
 
     Возвращает:
-        scenes  — list строк-описаний сцен
+        scenes  — {имя: описание сцены}
         classes — {0: {"name": "damaged_seat",  "prompts": [...]},
                    1: {"name": "damaged_floor", "prompts": [...]},
                    ...}
@@ -53,7 +92,7 @@ def load_prompts():
     scenes_dict = raw.get("scenes", {})
     if not scenes_dict:
         raise ValueError("prompts.json: раздел 'scenes' пуст или отсутствует")
-    scenes = list(scenes_dict.values())
+    scenes = dict(scenes_dict)
 
     # ── Дефекты → CLASSES ─────────────────────────────────
     defects_dict = raw.get("defects", {})
@@ -69,23 +108,44 @@ def load_prompts():
     return scenes, classes
 
 
-def get_balance():
+def get_balance(telemetry=None):
+    t = time.monotonic()
+    status = "error"
     try:
         r = requests.get(
-            "https://openrouter.ai/api/v1/auth/key",
+            f"{API_BASE}/auth/key",
             headers={"Authorization": f"Bearer {API_KEY}"},
             timeout=10,
         )
+        status = str(r.status_code)
         if r.status_code == 200:
             d = r.json().get("data", {})
             used = d.get("usage", 0)
             limit = d.get("limit", None)
-            return (limit - used if limit else None), used
+            remaining = limit - used if limit else None
+            if telemetry:
+                telemetry.balance(status, time.monotonic() - t, remaining=remaining, used=used)
+            return remaining, used
+    except requests.exceptions.Timeout:
+        status = "timeout"
     except Exception:
         pass
+    if telemetry:
+        telemetry.balance(status, time.monotonic() - t)
     return None, None
 
 
+def get_budget(telemetry=None):
+    """
+    (остаток $, сколько картинок на него хватит) — или (None, None), если
+    баланс не узнать. Общий предел для generate_data.py, pipeline.py и runner.py.
+    """
+    remaining, _ = get_balance(telemetry)
+    if remaining is None:
+        return None, None
+    return remaining, max(0, int(remaining / PRICE))
+
+
 def build_prompt(scene: str, defect_prompt: str) -> str:
     """
     Склеивает описание сцены + описание дефекта в один промпт.
@@ -97,92 +157,316 @@ def build_prompt(scene: str, defect_prompt: str) -> str:
     return f"{scene}\n\n{defect_prompt}"
 
 
-def generate_image(prompt: str, retries: int = 3):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://github.com/subway-damage",
-    }
+def probe_image(data: bytes):
+    """
+    Проверяет картинку по заголовку: возвращает (формат, (w, h)).
+    Пиксели не декодируются; обрезанные JPEG/PNG отсекаются по маркеру
+    конца файла.
+    """
+    with Image.open(io.BytesIO(data)) as im:
+        fmt, size = im.format, im.size
+    if not size[0] or not size[1]:
+        raise ValueError(f"пустая картинка {size}")
+    if fmt == "JPEG" and not data.rstrip(b"\0").endswith(b"\xff\xd9"):
+        raise ValueError("обрезанный JPEG")
+    if fmt == "PNG" and b"IEND" not in data[-16:]:
+        raise ValueError("обрезанный PNG")
+    return fmt, size
+
+
+def save_image(data: bytes, stem: str, out_format: str = STORE_FORMAT) -> str:
+    """
+    Сохраняет картинку в stem + расширение, возвращает полный путь.
 
-    for attempt in range(1, retries + 1):
-        try:
-            r = requests.post(
-                ENDPOINT,
-                headers=headers,
-                json={
-                    "model": MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                },
-                timeout=180,
-            )
-
-            if r.status_code == 200:
-                body = r.json()
-                cost = body.get("usage", {}).get("cost", 0)
-
-                # Извлечение base64-картинки из ответа
-                images = (
-                    body.get("choices", [{}])[0]
-                    .get("message", {})
-                    .get("images", [])
-                )
-                for item in images:
-                    url = item.get("image_url", {}).get("url", "")
-                    if url.startswith("data:image"):
-                        b64 = url.split(",", 1)[1]
-                        img = Image.open(
-                            io.BytesIO(base64.b64decode(b64))
-                        ).convert("RGB")
-                        return img, cost
-                # Модель ответила, но без картинки
-                print("[нет картинки]", end="", flush=True)
-                return None, cost
-
-            elif r.status_code == 429:
-                wait = 20 * attempt
-                print(f"[429 ждём {wait}с]", end="", flush=True)
-                time.sleep(wait)
-                continue
+    out_format="keep" — байты провайдера пишутся как есть, в исходном
+    контейнере (без декодирования и повторного сжатия). "jpg" / "png" —
+    явная конвертация: только тогда декодируем пиксели.
+    Запись атомарная: tmp → rename.
+    """
+    fmt, _ = probe_image(data)
+    ext = EXTENSIONS.get(fmt)
 
-            elif r.status_code == 402:
-                return "NO_MONEY", 0
+    if out_format == "keep" and ext:
+        path = stem + ext
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+    else:
+        target = "PNG" if out_format == "png" else "JPEG"
+        path = stem + EXTENSIONS[target]
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        if target == "JPEG":
+            img.save(path + ".tmp", "JPEG", quality=95)
+        else:
+            img.save(path + ".tmp", "PNG")
+    os.replace(path + ".tmp", path)
+    return path
 
-            else:
-                print(f"[HTTP {r.status_code}]", end="", flush=True)
-                return None, 0
 
-        except requests.exceptions.Timeout:
-            print(f"[таймаут #{attempt}]", end="", flush=True)
-            if attempt < retries:
-                time.sleep(5)
-                continue
+def find_output(stem: str):
+    """Уже сохранённая картинка с этим именем (любое расширение) или None."""
+    for ext in IMAGE_EXTS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def cached_image(cache, pool, prompt: str, variant: int = 0):
+    """Проверенный ответ из кэша по (модель пула, prompt, variant) или None."""
+    t = time.monotonic()
+    data = cache.get(pool.models, prompt, variant)
+    if data is None:
+        return None
+    try:
+        probe_image(data)
+    except Exception as e:
+        log(f"    [кэш: битая картинка, перезапрос: {e}]")
+        return None
+    if pool.telemetry:
+        pool.telemetry.image("cache", time.monotonic() - t)
+    return data
+
+
+def generate_image(prompt: str, pool, stop=None, cache=None, variant: int = 0,
+                   fresh: bool = False):
+    """
+    Картинка для промпта. Возвращает (bytes | None | "NO_MONEY" | "SKIPPED", cost).
+
+    bytes — закодированная картинка провайдера, проверенная по заголовку
+    (probe_image); декодировать её или нет — решает вызывающий.
+    pool — BackendPool: выбирает бэкенд и делает failover.
+    Если передан cache, сначала ищем ответ по (модель, prompt, variant)
+    для всех моделей пула: попадание не тратит ни денег, ни запросов.
+    fresh — не смотреть в кэш (ответ всё равно туда записывается).
+    Исход и полное время пишутся в pool.telemetry (если задана).
+    """
+    tel = pool.telemetry
+    t = time.monotonic()
+    if cache is not None and not fresh:
+        data = cached_image(cache, pool, prompt, variant)
+        if data is not None:
+            return data, 0
+
+    data, cost, backend = pool.generate(prompt, stop)
+    name = backend.name if backend else ""
+    if not isinstance(data, bytes):
+        if tel:
+            outcome = {"NO_MONEY": "no_money", "SKIPPED": "skipped"}.get(data, "failed")
+            tel.image("empty" if data is None and cost else outcome, time.monotonic() - t, cost, name)
+        return data, cost
+
+    try:
+        probe_image(data)
+    except Exception as e:
+        log(f"    [{backend.name}: битая картинка: {e}]")
+        if tel:
+            tel.image("bad", time.monotonic() - t, cost, name)
+        return None, cost
+    if cache is not None:
+        cache.put(backend.model, prompt, variant, data, cost)
+    if tel:
+        tel.image("ok", time.monotonic() - t, cost, name)
+    return data, cost
+
+
+def _worker(item, pool, stop, cache, out_format, index=None, radius=dedup.DISTANCE):
+    """
+    Задача пула: сгенерировать (или взять из кэша) одну картинку и сразу
+    записать её и метку на диск. Возвращает (item, путь | None | сигнал, cost).
+
+    index — dedup.HashIndex: почти-копии уже имеющихся картинок не
+    сохраняются (сигнал "DUPLICATE").
+    """
+    if stop.is_set():
+        return item, "SKIPPED", 0
+    prompt, variant = item["prompt"], item.get("variant", 0)
+
+    def duplicate(data):
+        try:
+            hit = index.add_if_new(item["id"], dedup.hash_bytes(data), radius)
         except Exception as e:
-            print(f"[ошибка: {e}]", end="", flush=True)
+            log(f"    [{item['id']}: pHash не посчитан: {e}]")
+            return None
+        # Свой же хэш — прошлый запуск упал между индексом и записью файла
+        return hit if hit and hit[1] != item["id"] else None
+
+    data = cached_image(cache, pool, prompt, variant) if cache is not None else None
+    cost = 0
+    if data is not None and index is not None and duplicate(data):
+        # Повтор из кэша, который уже лежит в датасете: за него ничего не
+        # платили, и дубликатом он не считается — просто нужна новая картинка.
+        data = None
+    if data is None:
+        data, cost = generate_image(prompt, pool, stop=stop, cache=cache, variant=variant,
+                                    fresh=cache is not None)
+        if not isinstance(data, bytes):
+            return item, data, cost
+        if index is not None:
+            hit = duplicate(data)
+            if hit:
+                item["dup_of"] = hit[1]
+                return item, "DUPLICATE", cost
+
+    # YOLO-метка: класс + bbox на всё изображение. Пишется до картинки и
+    # атомарно: --resume считает готовым то, у чего есть картинка, значит
+    # метка к этому моменту уже должна лежать целиком.
+    label = os.path.join(OUT_DIR, item["label"])
+    with open(label + ".tmp", "w") as lf:
+        lf.write(f"{item['cls_id']} 0.500000 0.500000 1.000000 1.000000\n")
+    os.replace(label + ".tmp", label)
+    stem = os.path.join(OUT_DIR, item["cls_name"], item["id"])
+    try:
+        path = save_image(data, stem, out_format)
+    except Exception as e:
+        log(f"    [{item['id']}: не удалось сохранить: {e}]")
+        os.remove(label)
+        return item, None, cost
+    return item, os.path.relpath(path, OUT_DIR).replace(os.sep, "/"), cost
 
-    return None, 0
+
+def build_schedule(classes, scenes, actual: int, journal, variants: int = 0, counts=None):
+    """
+    Расписание на actual картинок поровну по классам (записывается в журнал).
+    counts — {cls_id: сколько} вместо поровну. Элемент — dict: id (имя
+    файла), cls_id, cls_name, index, scene, prompt, variant, label.
+    """
+    # Каждому изображению назначаем:
+    #   • случайную сцену   (old / mid / new)
+    #   • случайный промпт дефекта из класса
+    per_class = actual // len(classes)
+    remainder = actual % len(classes)
+    schedule = []
+
+    for cls_id, info in classes.items():
+        count = per_class + (1 if cls_id < remainder else 0)
+        if counts is not None:
+            count = counts.get(cls_id, 0)
+        for _ in range(count):
+            scene = random.choice(list(scenes))
+            defect = random.choice(info["prompts"])
+            full_prompt = build_prompt(scenes[scene], defect)
+            schedule.append((cls_id, info["name"], scene, full_prompt))
+
+    random.shuffle(schedule)
+
+    # Имена файлов назначаем заранее (воркеры завершаются в любом
+    # порядке) и продолжаем нумерацию из журнала — без перезаписи.
+    counters = {info["name"]: journal.last_index.get(info["name"], 0)
+                for info in classes.values()}
+    # Номер варианта — какой по счёту раз этот промпт встречается в
+    # журнале и расписании: новый запуск продолжает нумерацию и получает
+    # новые картинки, а не оплаченные прошлыми запусками. Из кэша берутся
+    # только те же (промпт, вариант) — при --resume или после потери
+    # журнала; --variants N ограничивает число разных картинок.
+    seen = {}
+    for it in journal.items.values():
+        seen[it["prompt"]] = seen.get(it["prompt"], 0) + 1
+    for n, (cls_id, cls_name, scene, prompt) in enumerate(schedule):
+        counters[cls_name] += 1
+        fname = f"{cls_name}_{counters[cls_name]:04d}"
+        variant = seen.get(prompt, 0)
+        seen[prompt] = variant + 1
+        if variants > 0:
+            variant %= variants
+        schedule[n] = {
+            "id": fname,
+            "cls_id": cls_id,
+            "cls_name": cls_name,
+            "index": counters[cls_name],
+            "scene": scene,
+            "prompt": prompt,
+            "variant": variant,
+            "label": f"labels/{fname}.txt",
+        }
+    journal.schedule(schedule)
+    return schedule
+
+
+def default_pool(path=BACKENDS_FILE, workers=None, rate=RATE, burst=None):
+    """Пул бэкендов из backends.json или один OpenRouter с MODEL (см. backends.py)."""
+    return load_backends(path, default=[{
+        "name": "openrouter",
+        "type": "openrouter",
+        "model": MODEL,
+        "base_url": API_BASE,
+        "concurrency": workers or WORKERS,
+        "rate": rate,
+        "burst": burst,
+        "cost": 0.042,
+    }], log=log)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Генерация датасета повреждений через OpenRouter")
+    p.add_argument("--total", type=int, default=TOTAL, help="сколько картинок сгенерировать")
+    p.add_argument("--backends", default=BACKENDS_FILE,
+                   help="JSON с пулом бэкендов (по умолчанию backends.json, если есть)")
+    p.add_argument("--workers", type=int, default=None,
+                   help="одновременных запросов (по умолчанию — сумма concurrency бэкендов)")
+    p.add_argument("--rate", type=float, default=RATE,
+                   help="лимит запросов в секунду для бэкенда по умолчанию")
+    p.add_argument("--burst", type=int, default=None,
+                   help="ёмкость token bucket бэкенда по умолчанию (= workers)")
+    p.add_argument("--resume", action="store_true",
+                   help="догенерировать незавершённые элементы из journal.jsonl")
+    p.add_argument("--no-cache", action="store_true", help="не использовать кэш ответов")
+    p.add_argument("--cache-mb", type=float, default=CACHE_MB, help="предельный размер кэша, МБ")
+    p.add_argument("--format", choices=("keep", "jpg", "png"), default=STORE_FORMAT,
+                   help="keep — сохранять как прислал провайдер, иначе конвертировать")
+    p.add_argument("--no-dedup", action="store_true",
+                   help="не отбрасывать почти-дубликаты (pHash, см. dedup.py)")
+    p.add_argument("--dedup-distance", type=int, default=dedup.DISTANCE,
+                   help="порог Хэмминга для дубликатов")
+    p.add_argument("--events", default=EVENTS_FILE,
+                   help="журнал событий телеметрии (JSONL, дописывается); '' — не писать")
+    p.add_argument("--metrics", default=METRICS_FILE,
+                   help="файл метрик в формате Prometheus (textfile collector); '' — не писать")
+    p.add_argument("--metrics-port", type=int, default=None,
+                   help="отдавать метрики по http://127.0.0.1:PORT/metrics во время генерации")
+    p.add_argument("--variants", type=int, default=0,
+                   help="N разных картинок на один промпт: повторы берутся из кэша "
+                        "(0 — каждый повтор промпта — новая картинка); с dedup повтор, "
+                        "уже лежащий в датасете, запрашивается заново")
+    return p.parse_args()
 
 
 def main():
+    args = parse_args()
+
     # ── Загрузка ──────────────────────────────────────────
     scenes, CLASSES = load_prompts()
+    pool = default_pool(args.backends, args.workers, args.rate, args.burst)
+    workers = max(1, args.workers or pool.capacity)
+    os.makedirs(OUT_DIR, exist_ok=True)
+    tel = Telemetry(args.events or None, args.metrics or None)
+    pool.telemetry = tel
+    if args.metrics_port:
+        tel.serve(args.metrics_port)
 
     print("=" * 60)
     print("  ДАТАСЕТ ПОВРЕЖДЕНИЙ — МОСКОВСКОЕ МЕТРО")
-    print(f"  Модель:  {MODEL}")
-    print(f"  Цель:    {TOTAL} изображений")
+    for b in pool.backends:
+        print(f"  Модель:  {b.model}  [{b.name}, ×{b.concurrency}, {b.limiter.max_rate:g} запр/с]")
+    print(f"  Цель:    {'по журналу (--resume)' if args.resume else f'{args.total} изображений'}")
     print(f"  Классов: {len(CLASSES)}")
     print(f"  Сцен:    {len(scenes)}")
+    print(f"  Потоков: {workers}")
     print("=" * 60)
 
+    cache = None if args.no_cache else ResponseCache(max_mb=args.cache_mb)
+    index = None if args.no_dedup else dedup.HashIndex(dedup.INDEX_FILE).load()
+
+    # ── Журнал ────────────────────────────────────────────
+    journal = Journal(JOURNAL_FILE).load()
+    if journal.items:
+        c = journal.counts()
+        print(f"\n  Журнал:   {len(journal.items)} записей "
+              f"(готово {c[DONE]}, в очереди {len(journal.items) - c[DONE]}, "
+              f"потрачено ${journal.spent:.2f})")
+
     # ── Баланс ────────────────────────────────────────────
-    remaining, used = get_balance()
-    actual = TOTAL
+    remaining, budget = get_budget(tel)
     if remaining is not None:
-        max_imgs = int(remaining / 0.042)
-        actual = min(TOTAL, max_imgs)
-        print(f"\n  Остаток:  ${remaining:.2f} (~{max_imgs} картинок)")
-        if actual < TOTAL:
-            print(f"  ⚠ Хватит только на {actual} из {TOTAL}")
+        print(f"\n  Остаток:  ${remaining:.2f} (~{budget} картинок)")
     else:
         print("\n  Баланс: не удалось определить, продолжаем...")
 
@@ -196,87 +480,123 @@ def main():
         for cls_id in sorted(CLASSES.keys()):
             f.write(CLASSES[cls_id]["name"] + "\n")
 
-    # ── Расписание ────────────────────────────────────────
-    # Каждому изображению назначаем:
-    #   • случайную сцену   (old / mid / new)
-    #   • случайный промпт дефекта из класса
-    per_class = actual // len(CLASSES)
-    remainder = actual % len(CLASSES)
-    schedule = []
-
-    for cls_id, info in CLASSES.items():
-        count = per_class + (1 if cls_id < remainder else 0)
-        for _ in range(count):
-            scene = random.choice(scenes)
-            defect = random.choice(info["prompts"])
-            full_prompt = build_prompt(scene, defect)
-            schedule.append((cls_id, info["name"], full_prompt))
+    # Каталог датасета (catalog.py): класс, сцена и промпт каждой картинки
+    catalog = Catalog()
+    catalog.set_classes({cls_id: info["name"] for cls_id, info in CLASSES.items()})
+
+    def register(item, image):
+        catalog.add("generated", os.path.join(OUT_DIR, image),
+                    label_path=os.path.join(OUT_DIR, item["label"]),
+                    source=item["id"], cls_id=item["cls_id"],
+                    scene=item.get("scene"), prompt=item["prompt"])
+
+    if args.resume:
+        # ── Продолжение по журналу ────────────────────────
+        # Картинка уже на диске (сохраняется атомарно), но процесс упал
+        # до записи "done" — засчитываем без повторной оплаты.
+        schedule = []
+        for item in journal.pending():
+            found = find_output(os.path.join(OUT_DIR, item["cls_name"], item["id"]))
+            if found:
+                image = os.path.relpath(found, OUT_DIR).replace(os.sep, "/")
+                journal.mark(item["id"], DONE, recovered=True, image=image)
+                register(item, image)
+            else:
+                schedule.append(item)
+        if budget is not None and budget < len(schedule):
+            print(f"  ⚠ Хватит только на {budget} из {len(schedule)}")
+            schedule = schedule[:budget]
+    else:
+        actual = args.total
+        if budget is not None and budget < actual:
+            print(f"  ⚠ Хватит только на {budget} из {actual}")
+            actual = budget
 
-    random.shuffle(schedule)
+        schedule = build_schedule(CLASSES, scenes, actual, journal, args.variants)
 
     # ── Статистика по сценам ──────────────────────────────
     print(f"\n  Распределение по классам:")
     for cls_id in sorted(CLASSES.keys()):
         info = CLASSES[cls_id]
-        c = sum(1 for s in schedule if s[0] == cls_id)
+        c = sum(1 for s in schedule if s["cls_id"] == cls_id)
         print(f"    [{cls_id}] {info['name']:20s} — {c} шт")
 
-    est_cost = len(schedule) * 0.042
-    est_time = len(schedule) * 55 / 60
+    est_cost = len(schedule) * PRICE
+    est_time = len(schedule) * 55 / 60 / workers
     print(f"\n  Всего:    {len(schedule)} изображений")
     print(f"  Оценка:   ~${est_cost:.2f}, ~{est_time:.0f} мин")
     print(f"\n{'─' * 60}\n")
 
     # ── Генерация ─────────────────────────────────────────
     t0 = time.time()
-    ok = errors = 0
+    ok = errors = dups = 0
     total_spent = 0.0
-    counters = {c: 0 for c in CLASSES}
-
-    for i, (cls_id, cls_name, prompt) in enumerate(schedule, 1):
-        counters[cls_id] += 1
-        idx = counters[cls_id]
-        fname = f"{cls_name}_{idx:04d}"
-
-        print(f"  [{i:3d}/{len(schedule)}] {fname:30s} ", end="", flush=True)
-
-        img, cost = generate_image(prompt)
-
-        # Деньги кончились
-        if img == "NO_MONEY":
-            print("💰 БАЛАНС КОНЧИЛСЯ!")
-            break
-
-        total_spent += cost if isinstance(cost, (int, float)) else 0
-
-        if img is not None and img != "NO_MONEY":
-            # Сохраняем изображение
-            img.save(
-                os.path.join(OUT_DIR, cls_name, f"{fname}.jpg"),
-                "JPEG",
-                quality=95,
-            )
-            # YOLO-метка: класс + bbox на всё изображение
-            with open(os.path.join(labels_dir, f"{fname}.txt"), "w") as lf:
-                lf.write(f"{cls_id} 0.500000 0.500000 1.000000 1.000000\n")
-
-            ok += 1
-            elapsed = time.time() - t0
-            eta = (elapsed / i) * (len(schedule) - i)
-            print(
-                f"✅ ${cost:.3f}  "
-                f"[{elapsed / 60:.0f}м / ~{eta / 60:.0f}м]  "
-                f"итого ${total_spent:.2f}"
-            )
-        else:
-            errors += 1
-            print("❌")
-            if errors > 15:
-                print("\n  ⛔ Слишком много ошибок подряд, остановка.")
-                break
+    stop = threading.Event()
+    stop_reason = None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_worker, item, pool, stop, cache, args.format,
+                            index, args.dedup_distance)
+            for item in schedule
+        ]
+        for i, fut in enumerate(as_completed(futures), 1):
+            item, saved, cost = fut.result()
+            tel.flush()
+            if saved == "SKIPPED":
+                continue
 
-        # Пауза между запросами
-        time.sleep(3)
+            # Деньги кончились — останавливаем всех воркеров
+            if saved == "NO_MONEY":
+                if not stop.is_set():
+                    stop_reason = "💰 БАЛАНС КОНЧИЛСЯ!"
+                    stop.set()
+                continue
+
+            cost = cost if isinstance(cost, (int, float)) else 0
+            total_spent += cost
+            fname = item["id"]
+            head = f"  [{i:3d}/{len(schedule)}] {fname:30s} "
+
+            if saved == "DUPLICATE":
+                journal.mark(fname, DUPLICATE, cost, of=item["dup_of"])
+                dups += 1
+                log(f"{head}♻ дубликат {item['dup_of']}  ${cost:.3f}")
+            elif saved is not None:
+                # Картинка и метка уже записаны воркером
+                journal.mark(fname, DONE, cost, image=saved)
+                register(item, saved)
+
+                ok += 1
+                elapsed = time.time() - t0
+                # ETA по скорости за последние минуты, а не по среднему с начала
+                eta = tel.eta(len(schedule) - i)
+                if eta is None:
+                    eta = (elapsed / i) * (len(schedule) - i)
+                log(
+                    f"{head}✅ ${cost:.3f}  "
+                    f"[{elapsed / 60:.0f}м / ~{eta / 60:.0f}м]  "
+                    f"итого ${total_spent:.2f}"
+                )
+            else:
+                journal.mark(fname, FAILED, cost)
+                errors += 1
+                log(f"{head}❌")
+                if errors > MAX_ERRORS and not stop.is_set():
+                    stop_reason = "⛔ Слишком много ошибок, остановка."
+                    stop.set()
+
+    journal.close()
+    catalog.sync("generated", OUT_DIR)     # картинки прошлых прогонов мимо каталога
+    hist = catalog.histogram("generated")
+    catalog.close()
+    if index is not None:
+        index.close()
+    if stop_reason:
+        print(f"\n  {stop_reason}")
+    left = len(journal.pending())
+    if left:
+        print(f"  Незавершённых: {left} — продолжить: python generate_data.py --resume")
 
     # ── Итоги ─────────────────────────────────────────────
     t = time.time() - t0
@@ -284,13 +604,31 @@ def main():
     print(f"  ГОТОВО")
     print(f"  Успешно:  {ok} картинок")
     print(f"  Ошибок:   {errors}")
+    if dups:
+        print(f"  Дублей:   {dups} (не сохранены)")
     print(f"  Потрачено: ${total_spent:.2f}")
     print(f"  Время:    {int(t // 60)}м {int(t % 60)}с")
+    if len(pool.backends) > 1 or any(b.stats["requests"] for b in pool.backends):
+        print(f"{'─' * 60}")
+        for line in pool.report():
+            print(line)
+        print(f"{'─' * 60}")
+    if cache is not None:
+        s = cache.stats()
+        cache.close()
+        print(f"  Кэш:      {s['hits']} попаданий / {s['misses']} промахов "
+              f"({s['hit_rate']:.0%}), сэкономлено ${s['saved']:.2f}")
+        print(f"            {s['entries']} записей, {s['size_mb']:.1f} МБ"
+              + (f", вытеснено {s['evicted']}" if s['evicted'] else ""))
+    print(f"{'─' * 60}")
+    for line in tel.report():
+        print(line)
+    tel.close()
+    print(f"  Телеметрия: {args.events or '—'}, {args.metrics or '—'}")
     print(f"{'─' * 60}")
     for cls_id in sorted(CLASSES.keys()):
         info = CLASSES[cls_id]
-        d = os.path.join(OUT_DIR, info["name"])
-        c = len([f for f in os.listdir(d) if f.endswith(".jpg")])
+        c = hist.get(cls_id, (0, 0))[0]
         print(f"    {info['name']:20s}  {c:4d} файлов")
     print(f"{'─' * 60}")
     print(f"  📁 {OUT_DIR}")
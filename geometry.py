@@ -0,0 +1,134 @@
+"""
+Геометрические аугментации одним ресэмплингом.
+
+Каждая операция (отражение, поворот, кроп, масштаб) — матрица 3×3 в
+пиксельных координатах (0..w, 0..h), переводящая точку исходной картинки
+в точку результата. Цепочка операций перемножается в одну матрицу и
+применяется одним Image.transform — картинка интерполируется один раз,
+а не на каждой операции. Чистые отражения идут через transpose (без
+интерполяции вообще).
+
+Та же матрица переводит YOLO-боксы: четыре угла каждого бокса
+преобразуются разом (numpy), берётся описывающий прямоугольник, он
+обрезается по кадру, а вырожденные и почти ушедшие за край боксы
+выбрасываются.
+"""
+import numpy as np
+from PIL import Image
+
+RESAMPLE = Image.BICUBIC
+FILL = (0, 0, 0)
+MIN_BOX_PX = 2.0        # бокс уже/ниже этого (в пикселях) после обрезки — выбрасываем
+MIN_VISIBLE = 0.25      # какая доля площади бокса должна остаться в кадре
+
+_I = np.eye(3)
+
+
+# ──────────────────────────────────────────────────────────
+#  Матрицы (источник → результат)
+# ──────────────────────────────────────────────────────────
+def flip_h(w, h):
+    return np.array([[-1.0, 0, w], [0, 1, 0], [0, 0, 1]])
+
+
+def flip_v(w, h):
+    return np.array([[1.0, 0, 0], [0, -1, h], [0, 0, 1]])
+
+
+def rotation(angle, w, h):
+    """Поворот вокруг центра на angle градусов против часовой (как Image.rotate)."""
+    t = np.deg2rad(angle)
+    c, s = np.cos(t), np.sin(t)
+    cx, cy = w / 2, h / 2
+    return np.array([
+        [c, s, cx - c * cx - s * cy],
+        [-s, c, cy + s * cx - c * cy],
+        [0, 0, 1],
+    ])
+
+
+def crop_resize(x0, y0, cw, ch, w, h):
+    """Вырезать (x0, y0, cw, ch) и растянуть обратно до w×h."""
+    sx, sy = w / cw, h / ch
+    return np.array([[sx, 0, -x0 * sx], [0, sy, -y0 * sy], [0, 0, 1]])
+
+
+def scale(f, w, h):
+    """Масштаб f вокруг центра (f > 1 — приближение)."""
+    cx, cy = w / 2, h / 2
+    return np.array([[f, 0, cx - f * cx], [0, f, cy - f * cy], [0, 0, 1]])
+
+
+def compose(*mats):
+    """Матрица цепочки: mats применяются по порядку, первая — первой."""
+    m = _I
+    for a in mats:
+        m = a @ m
+    return m
+
+
+# ──────────────────────────────────────────────────────────
+#  Картинка
+# ──────────────────────────────────────────────────────────
+def _transpose_for(m, w, h):
+    """Если m — тождество или чистое отражение, метод transpose (или None)."""
+    for method, ref in (
+        (None, _I),
+        (Image.FLIP_LEFT_RIGHT, flip_h(w, h)),
+        (Image.FLIP_TOP_BOTTOM, flip_v(w, h)),
+        (Image.ROTATE_180, flip_v(w, h) @ flip_h(w, h)),
+    ):
+        if np.allclose(m, ref, atol=1e-9):
+            return method
+    return False
+
+
+def warp(img, m):
+    """Применяет матрицу m к картинке PIL за один ресэмплинг; размер сохраняется."""
+    w, h = img.size
+    method = _transpose_for(m, w, h)
+    if method is None:
+        return img
+    if method is not False:
+        return img.transpose(method)
+    inv = np.linalg.inv(m)
+    return img.transform((w, h), Image.AFFINE, tuple(inv[:2].ravel()),
+                         resample=RESAMPLE, fillcolor=FILL)
+
+
+# ──────────────────────────────────────────────────────────
+#  Боксы
+# ──────────────────────────────────────────────────────────
+def transform_boxes(boxes, m, size):
+    """
+    boxes — (N, 4) YOLO xc, yc, bw, bh (доли кадра). Возвращает
+    (новые боксы (K, 4), маска оставленных (N,)).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    w, h = size
+    xc, yc = boxes[:, 0] * w, boxes[:, 1] * h
+    bw, bh = boxes[:, 2] * w, boxes[:, 3] * h
+
+    # Углы (N, 4, 3) в однородных координатах
+    x0, x1 = xc - bw / 2, xc + bw / 2
+    y0, y1 = yc - bh / 2, yc + bh / 2
+    ones = np.ones_like(x0)
+    corners = np.stack([
+        np.stack([x0, y0, ones], -1), np.stack([x1, y0, ones], -1),
+        np.stack([x1, y1, ones], -1), np.stack([x0, y1, ones], -1),
+    ], axis=1)
+    pts = corners @ m.T
+
+    nx0, ny0 = pts[..., 0].min(1), pts[..., 1].min(1)
+    nx1, ny1 = pts[..., 0].max(1), pts[..., 1].max(1)
+    full = (nx1 - nx0) * (ny1 - ny0)
+
+    nx0, nx1 = np.clip(nx0, 0, w), np.clip(nx1, 0, w)
+    ny0, ny1 = np.clip(ny0, 0, h), np.clip(ny1, 0, h)
+    cw, ch = nx1 - nx0, ny1 - ny0
+
+    keep = (cw >= MIN_BOX_PX) & (ch >= MIN_BOX_PX)
+    keep &= cw * ch >= MIN_VISIBLE * np.maximum(full, 1e-9)
+
+    out = np.stack([(nx0 + nx1) / 2 / w, (ny0 + ny1) / 2 / h, cw / w, ch / h], -1)
+    return out[keep], keep
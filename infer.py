@@ -0,0 +1,169 @@
+"""
+Инференс экспортированной модели через onnxruntime — без torch и Ultralytics.
+
+    from infer import Model, to_json
+    model = Model("runs/metro_damage/weights/best.onnx")
+    dets = model.detect([Image.open("car.jpg")])[0]     # (k, 6): x1, y1, x2, y2, conf, класс
+    to_json(dets, model.names)   # [{"class": 0, "name": "damaged_seat", "conf": 0.91, "box": [...]}]
+
+Препроцессинг — тот же letterbox, что при обучении (letterbox.py):
+картинка вписывается в imgsz×imgsz с серыми полями, JPEG декодируется
+сразу в уменьшенном виде. Выход YOLOv8 (batch, 4 + nc, anchors)
+декодируется и прореживается NMS на numpy, боксы возвращаются в пикселях
+исходного кадра. Имена классов и imgsz берутся из метаданных ONNX.
+"""
+import io
+import os
+import ast
+
+import numpy as np
+from PIL import Image
+
+import letterbox
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL = os.path.join(BASE_DIR, "runs", "metro_damage", "weights", "best.onnx")
+
+IMGSZ = 640
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+CONF = 0.25
+IOU = 0.45
+MAX_DET = 300
+MAX_NMS = 30000     # кандидатов до NMS
+MAX_WH = 7680       # сдвиг боксов по классу — NMS по классам за один проход
+
+
+# ──────────────────────────────────────────────────────────
+#  Пре- и постобработка
+# ──────────────────────────────────────────────────────────
+def load(data: bytes):
+    """Байты JPEG/PNG → PIL.Image (ещё не декодирована — preprocess сделает draft)."""
+    return Image.open(io.BytesIO(data))
+
+
+def preprocess(img, imgsz: int = IMGSZ):
+    """
+    Картинка → (тензор 3×imgsz×imgsz float32 0..1, кадр). Кадр —
+    (px, py, nw, nh, w, h): смещение и размер вписанной картинки и
+    исходный размер, для обратного пересчёта боксов.
+    """
+    w, h = img.size
+    img.draft("RGB", letterbox.fit(w, h, imgsz)[:2])
+    nw, nh, px, py, _, _ = letterbox.fit(*img.size, imgsz)
+    img = letterbox.letterbox(img.convert("RGB"), imgsz)
+    x = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return np.ascontiguousarray(x), (px, py, nw, nh, w, h)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou: float = IOU) -> np.ndarray:
+    """Жадный NMS: индексы оставленных боксов (xyxy) по убыванию score."""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = iw * ih
+        order = rest[inter / (areas[i] + areas[rest] - inter + 1e-9) <= iou]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode(pred: np.ndarray, conf: float = CONF, iou: float = IOU,
+           agnostic: bool = False, max_det: int = MAX_DET) -> np.ndarray:
+    """
+    Выход одной картинки (4 + nc, anchors) → детекции (k, 6):
+    x1, y1, x2, y2, conf, класс — в пикселях кадра letterbox.
+    """
+    pred = pred.T
+    scores = pred[:, 4:]
+    cls = scores.argmax(1)
+    best = scores[np.arange(len(cls)), cls]
+    mask = best > conf
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+    xywh, best, cls = pred[mask, :4], best[mask], cls[mask]
+    if len(best) > MAX_NMS:
+        top = best.argsort()[::-1][:MAX_NMS]
+        xywh, best, cls = xywh[top], best[top], cls[top]
+    boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], 1)
+    offset = 0 if agnostic else cls[:, None] * MAX_WH
+    keep = nms(boxes + offset, best, iou)[:max_det]
+    return np.concatenate([boxes[keep], best[keep, None], cls[keep, None]], 1).astype(np.float32)
+
+
+def unletterbox(dets: np.ndarray, frame) -> np.ndarray:
+    """Боксы кадра letterbox → пиксели исходной картинки (обрезаны по краям)."""
+    px, py, nw, nh, w, h = frame
+    out = dets.copy()
+    out[:, [0, 2]] = ((out[:, [0, 2]] - px) * (w / nw)).clip(0, w)
+    out[:, [1, 3]] = ((out[:, [1, 3]] - py) * (h / nh)).clip(0, h)
+    return out
+
+
+def to_json(dets: np.ndarray, names: dict):
+    return [{"class": int(c), "name": names.get(int(c), str(int(c))), "conf": round(float(s), 4),
+             "box": [round(float(v), 1) for v in (x1, y1, x2, y2)]}
+            for x1, y1, x2, y2, s, c in dets]
+
+
+# ──────────────────────────────────────────────────────────
+#  Модель
+# ──────────────────────────────────────────────────────────
+def session(path: str, threads: int = 0, inter_threads: int = 0, spin: bool = True):
+    """
+    Сессия onnxruntime для CPU: все оптимизации графа, число потоков
+    внутри оператора (0 — по ядрам) и между операторами (>0 включает
+    параллельное выполнение веток). spin=False — потоки не крутятся в
+    ожидании работы (сервер между запросами не ест CPU).
+    """
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        opts.intra_op_num_threads = threads
+    if inter_threads:
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        opts.inter_op_num_threads = inter_threads
+    if not spin:
+        opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        opts.add_session_config_entry("session.inter_op.allow_spinning", "0")
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+
+class Model:
+    """ONNX-модель YOLOv8: run() — сырой выход на батче, detect() — боксы на картинках."""
+
+    def __init__(self, path: str = MODEL, threads: int = 0, inter_threads: int = 0,
+                 spin: bool = True):
+        self.path = path
+        self.session = session(path, threads, inter_threads, spin)
+        inp = self.session.get_inputs()[0]
+        self.input = inp.name
+        self.dtype = np.float16 if "float16" in inp.type else np.float32
+        # Переменный batch — если модель экспортирована с dynamic=True
+        self.dynamic = not isinstance(inp.shape[0], int)
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else {}
+        imgsz = ast.literal_eval(meta["imgsz"]) if "imgsz" in meta else None
+        if imgsz is None:
+            imgsz = inp.shape[2] if isinstance(inp.shape[2], int) else IMGSZ
+        self.imgsz = imgsz[0] if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def run(self, x: np.ndarray) -> np.ndarray:
+        """Тензор (batch, 3, imgsz, imgsz) → выход (batch, 4 + nc, anchors)."""
+        x = x.astype(self.dtype, copy=False)
+        if self.dynamic or len(x) == 1:
+            return self.session.run(None, {self.input: x})[0]
+        return np.concatenate([self.session.run(None, {self.input: x[i:i + 1]})[0]
+                               for i in range(len(x))])
+
+    def detect(self, images, conf: float = CONF, iou: float = IOU):
+        """Список PIL-картинок → список массивов (k, 6) в пикселях исходников."""
+        prepared = [preprocess(img, self.imgsz) for img in images]
+        out = self.run(np.stack([x for x, _ in prepared]))
+        return [unletterbox(decode(p, conf, iou), frame) for p, (_, frame) in zip(out, prepared)]
@@ -0,0 +1,134 @@
+"""
+Журнал генерации: append-only JSONL рядом с датасетом.
+
+Каждая строка — одно событие:
+    {"op": "schedule", "id": "damaged_seat_0001", "cls_id": 0, "cls_name": ...,
+     "prompt": ..., "label": "labels/damaged_seat_0001.txt", "ts": ...}
+    {"op": "done",   "id": "damaged_seat_0001", "cost": 0.04,
+     "image": "damaged_seat/damaged_seat_0001.png", "ts": ...}
+    {"op": "failed", "id": "damaged_seat_0001", "cost": 0.0,  "ts": ...}
+    {"op": "duplicate", "id": "damaged_seat_0002", "cost": 0.04,
+     "of": "damaged_seat_0001", "ts": ...}
+
+Состояние элемента — последнее событие по его id. Журнал никогда не
+переписывается, только дописывается, поэтому падение процесса теряет
+максимум одну недописанную строку (она пропускается при чтении).
+"""
+import os
+import json
+import time
+import threading
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+DUPLICATE = "duplicate"     # почти копия уже имеющейся картинки (dedup.py)
+
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self.items = {}          # id → словарь элемента (dict сохраняет порядок)
+        self.last_index = {}     # cls_name → максимальный номер файла
+        self.spent = 0.0
+        self.lock = threading.Lock()
+        self._fh = None
+
+    # ── Чтение ────────────────────────────────────────────
+    def load(self):
+        """Проигрывает журнал в self.items. Битые строки пропускаются."""
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(rec)
+        return self
+
+    def _apply(self, rec: dict):
+        op = rec.get("op")
+        rid = rec.get("id")
+        if op == "schedule":
+            item = {k: v for k, v in rec.items() if k not in ("op", "ts")}
+            item["status"] = PENDING
+            item["cost"] = 0.0
+            self.items[rid] = item
+            idx = item.get("index", 0)
+            name = item.get("cls_name")
+            if idx > self.last_index.get(name, 0):
+                self.last_index[name] = idx
+        elif rid in self.items:
+            item = self.items[rid]
+            cost = rec.get("cost") or 0.0
+            item["status"] = op
+            item["cost"] += cost
+            self.spent += cost
+            for k, v in rec.items():
+                if k not in ("op", "id", "ts", "cost"):
+                    item[k] = v
+
+    def pending(self):
+        """Элементы, которые ещё нужно сгенерировать (pending + failed).
+        Дубликаты не перезапрашиваются: за них уже заплачено."""
+        return [it for it in self.items.values()
+                if it["status"] not in (DONE, DUPLICATE)]
+
+    def counts(self):
+        c = {PENDING: 0, DONE: 0, FAILED: 0, DUPLICATE: 0}
+        for it in self.items.values():
+            c[it["status"]] = c.get(it["status"], 0) + 1
+        return c
+
+    # ── Запись ────────────────────────────────────────────
+    def _write(self, records):
+        with self.lock:
+            if self._fh is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._trim()
+                self._fh = open(self.path, "a", encoding="utf-8")
+            ts = round(time.time(), 3)
+            for rec in records:
+                rec.setdefault("ts", ts)
+                self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                self._apply(rec)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def _trim(self):
+        """Отрезает недописанный хвост (упавший процесс), чтобы новая строка не приклеилась к нему."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                cut = chunk.rfind(b"\n")
+                if cut >= 0:
+                    f.truncate(pos - step + cut + 1)
+                    return
+                pos -= step
+            f.truncate(0)
+
+    def schedule(self, items):
+        """Записывает новые элементы расписания одним fsync."""
+        self._write([{"op": "schedule", **it} for it in items])
+
+    def mark(self, item_id: str, status: str, cost: float = 0.0, **extra):
+        self._write([{"op": status, "id": item_id, "cost": cost, **extra}])
+
+    def close(self):
+        with self.lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
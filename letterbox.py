@@ -0,0 +1,266 @@
+"""
+Кэш датасета в разрешении обучения.
+
+    python letterbox.py                  # dataset_yolo/ → dataset_cache/640/
+    python letterbox.py --imgsz 512
+    python letterbox.py --no-pad         # только уменьшить (без полей)
+
+Картинки от провайдера приходят в 1024px+ и без кэша каждую эпоху заново
+декодируются и ужимаются до imgsz. Здесь это делается один раз: картинка
+вписывается в imgsz×imgsz (letterbox, поля серые 114 как у Ultralytics),
+сохраняется JPEG-ом, лейблы пересчитываются в координаты нового кадра.
+main.py обучает, валидирует и тестирует на кэше.
+
+Раскладка dataset_cache/<imgsz>/:
+    objects/ab/<sha1>.jpg   — картинка по хэшу исходника (одна на все split)
+    train/images, labels    — ссылки на objects/ и пересчитанные лейблы
+    val/...
+    data.yaml
+    manifest.json           — исходник → (размер:mtime, sha1, ширина, высота)
+
+Ключ — хэш содержимого исходника и размер: пересплит, переименование и
+повторный запуск не пересчитывают ни одной картинки, а manifest.json
+позволяет не читать неизменённые исходники даже для хэша.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from multiprocessing import Pool, cpu_count
+
+from PIL import Image
+
+import validate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BASE_DIR, "dataset_yolo")
+CACHE_DIR = os.path.join(BASE_DIR, "dataset_cache")
+
+IMGSZ = 640
+PAD = True
+PAD_COLOR = (114, 114, 114)
+QUALITY = 95
+
+
+# ──────────────────────────────────────────────────────────
+#  Геометрия
+# ──────────────────────────────────────────────────────────
+def fit(w: int, h: int, imgsz: int, pad: bool = PAD):
+    """
+    Вписывание w×h в imgsz: (новая ширина, высота, смещение x, y, ширина и
+    высота кадра). Длинная сторона → imgsz, как load_image у Ultralytics.
+    """
+    r = imgsz / max(w, h)
+    nw, nh = max(1, round(w * r)), max(1, round(h * r))
+    if not pad:
+        return nw, nh, 0, 0, nw, nh
+    return nw, nh, (imgsz - nw) // 2, (imgsz - nh) // 2, imgsz, imgsz
+
+
+def letterbox(img, imgsz: int, pad: bool = PAD):
+    nw, nh, px, py, fw, fh = fit(*img.size, imgsz, pad)
+    if img.size != (nw, nh):
+        img = img.resize((nw, nh), Image.BILINEAR, reducing_gap=2.0)
+    if not pad:
+        return img
+    out = Image.new("RGB", (fw, fh), PAD_COLOR)
+    out.paste(img, (px, py))
+    return out
+
+
+def rescale_label(text: str, w: int, h: int, imgsz: int, pad: bool = PAD) -> str:
+    """YOLO-лейбл исходника w×h → в координаты кадра letterbox."""
+    nw, nh, px, py, fw, fh = fit(w, h, imgsz, pad)
+    out = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 5:
+            if parts:
+                out.append(line.strip())      # validate.py разберётся
+            continue
+        xc, yc, bw, bh = map(float, parts[1:])
+        out.append(f"{parts[0]} {(xc * nw + px) / fw:.6f} {(yc * nh + py) / fh:.6f} "
+                   f"{bw * nw / fw:.6f} {bh * nh / fh:.6f}")
+    return "\n".join(out) + ("\n" if out else "")
+
+
+# ──────────────────────────────────────────────────────────
+#  Кэш
+# ──────────────────────────────────────────────────────────
+def cache_root(imgsz: int = IMGSZ, pad: bool = PAD) -> str:
+    return os.path.join(CACHE_DIR, f"{imgsz}" if pad else f"{imgsz}-resize")
+
+
+def _object(root: str, digest: str) -> str:
+    return os.path.join(root, "objects", digest[:2], f"{digest}.jpg")
+
+
+def _sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _render(job):
+    """Воркер: исходник → letterbox JPEG в objects/. Возвращает (исходник, ошибка)."""
+    src, dst, imgsz, pad = job
+    try:
+        with Image.open(src) as img:
+            # JPEG декодируется сразу в уменьшенном виде (масштабирование DCT)
+            img.draft("RGB", fit(*img.size, imgsz, pad)[:2])
+            out = letterbox(img.convert("RGB"), imgsz, pad)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = dst + ".tmp"
+        out.save(tmp, "JPEG", quality=QUALITY)
+        os.replace(tmp, dst)
+        return src, None
+    except Exception as e:
+        return src, str(e)
+
+
+def _link(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def build(src_root: str = SRC_DIR, imgsz: int = IMGSZ, pad: bool = PAD,
+          workers: int = None, log=print):
+    """
+    dataset_yolo/ (папки или списки train.txt/val.txt) → кэш в разрешении
+    imgsz. Считаются только картинки, которых ещё нет в objects/.
+    Возвращает путь к data.yaml кэша.
+    """
+    t0 = time.time()
+    splits, names, _ = validate.yolo_splits(src_root)
+    root = cache_root(imgsz, pad)
+    os.makedirs(root, exist_ok=True)
+
+    manifest_path = os.path.join(root, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    # Хэш исходника: из manifest.json, если файл не менялся
+    entries = {}
+    for items in splits.values():
+        for img, _ in items:
+            key = os.path.abspath(img)
+            sig = validate.file_sig(img)
+            m = manifest.get(key)
+            if m and m[0] == sig:
+                entries[key] = m
+                continue
+            with Image.open(img) as im:          # только заголовок
+                w, h = im.size
+            entries[key] = [sig, _sha1(img), w, h]
+
+    jobs, seen = [], set()
+    for key, (_, digest, _, _) in entries.items():
+        dst = _object(root, digest)
+        if digest not in seen and not os.path.exists(dst):
+            jobs.append((key, dst, imgsz, pad))
+        seen.add(digest)
+
+    failed = set()
+    if jobs:
+        log(f"  Кэш {imgsz}px: {len(jobs)} новых картинок из {len(entries)}...")
+        workers = max(1, min(workers or cpu_count(), len(jobs)))
+        if workers == 1:
+            results = map(_render, jobs)
+            pool = None
+        else:
+            pool = Pool(workers)
+            results = pool.imap_unordered(_render, jobs, chunksize=8)
+        for src, err in results:
+            if err:
+                failed.add(src)
+                log(f"  ✗ {os.path.relpath(src, BASE_DIR)}: {err}")
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Split — ссылки на objects/ и пересчитанные лейблы (дёшево, каждый раз заново)
+    for split, items in splits.items():
+        shutil.rmtree(os.path.join(root, split), ignore_errors=True)
+        img_dir = os.path.join(root, split, "images")
+        lbl_dir = os.path.join(root, split, "labels")
+        os.makedirs(img_dir)
+        os.makedirs(lbl_dir)
+        for img, lbl in items:
+            key = os.path.abspath(img)
+            if key in failed:
+                continue
+            _, digest, w, h = entries[key]
+            stem = os.path.splitext(os.path.basename(img))[0]
+            _link(_object(root, digest), os.path.join(img_dir, f"{stem}.jpg"))
+            if os.path.exists(lbl):
+                with open(lbl, encoding="utf-8") as f:
+                    text = rescale_label(f.read(), w, h, imgsz, pad)
+                with open(os.path.join(lbl_dir, f"{stem}.txt"), "w", encoding="utf-8") as f:
+                    f.write(text)
+
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({**manifest, **entries}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    yaml_path = os.path.join(root, "data.yaml")
+    with open(yaml_path, "w") as f:
+        f.write(f"path: {root}\ntrain: train/images\nval: val/images\n\nnames:\n"
+                + "".join(f"  {i}: {n}\n" for i, n in sorted(names.items())))
+    log(f"  Кэш {imgsz}px: {sum(len(i) for i in splits.values()) - len(failed)} картинок "
+        f"→ {root}  ({time.time() - t0:.1f}с)")
+    return yaml_path
+
+
+def build_dir(src: str, imgsz: int = IMGSZ):
+    """
+    Папка картинок (raw_images/ для main.py test) → уменьшенные копии
+    без полей в dataset_cache/<imgsz>-resize/<имя папки>/. Возвращает путь.
+    Копия называется полным именем исходника + .jpg (a.png и a.jpg не
+    затирают друг друга); копии удалённых и переименованных фото убираются.
+    """
+    dst = os.path.join(cache_root(imgsz, pad=False), os.path.basename(os.path.normpath(src)))
+    os.makedirs(dst, exist_ok=True)
+    fnames = [f for f in sorted(os.listdir(src)) if f.lower().endswith(validate.IMAGE_EXTS)]
+    wanted = {f + ".jpg" for f in fnames}
+    for name in os.listdir(dst):
+        if name not in wanted:
+            os.remove(os.path.join(dst, name))
+    for fname in fnames:
+        out = os.path.join(dst, fname + ".jpg")
+        if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(os.path.join(src, fname)):
+            continue
+        _, err = _render((os.path.join(src, fname), out, imgsz, False))
+        if err:
+            print(f"  ✗ {fname}: {err}")
+    return dst
+
+
+def main():
+    p = argparse.ArgumentParser(description="Кэш dataset_yolo/ в разрешении обучения")
+    p.add_argument("--imgsz", type=int, default=IMGSZ)
+    p.add_argument("--no-pad", action="store_true", help="только уменьшить, без полей до квадрата")
+    p.add_argument("--src", default=SRC_DIR, help="папка датасета с data.yaml")
+    p.add_argument("--workers", type=int, default=cpu_count())
+    args = p.parse_args()
+
+    if not os.path.exists(os.path.join(args.src, "data.yaml")):
+        sys.exit(f"Нет {args.src}/data.yaml\nСначала запустите data.py")
+    print("=" * 55)
+    print("  КЭШ В РАЗРЕШЕНИИ ОБУЧЕНИЯ")
+    print("=" * 55)
+    yaml_path = build(args.src, args.imgsz, not args.no_pad, args.workers)
+    print(f"\n  data.yaml: {yaml_path}")
+    print(f"{'='*55}")
+
+
+if __name__ == "__main__":
+    main()
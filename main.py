@@ -4,35 +4,72 @@ import sys
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATASET = os.path.join(BASE_DIR, "dataset_yolo", "data.yaml")
 PROJECT = os.path.join(BASE_DIR, "runs")
-
-
-def step1_train():
-    """Обучение модели."""
+IMGSZ = 640
+# Обучение/валидация/тест на кэше в разрешении IMGSZ (letterbox.py), а не
+# на исходниках 1024px+, которые иначе ужимаются заново каждую эпоху
+USE_CACHE = True
+
+
+def dataset(online=False, cache=USE_CACHE):
+    """
+    data.yaml для обучения и валидации: кэш letterbox.py (дописывается,
+    если dataset_yolo/ изменился) или сам dataset_yolo/. В режиме online
+    картинки только уменьшаются — поля letterbox повернулись бы вместе с
+    кадром в цепочках augment.py.
+    """
+    if not cache:
+        return DATASET
+    import letterbox
+    return letterbox.build(imgsz=IMGSZ, pad=not online)
+
+
+def step1_train(online=False, check=True, cache=USE_CACHE):
+    """
+    Обучение модели.
+    online — аугментации augment.py на лету в загрузчике (online_augment.py);
+    датасет готовится через `python data.py --online`.
+    check — перед обучением проверить датасет (validate.py) и убрать
+    плохие сэмплы в карантин.
+    cache — учиться на кэше в разрешении IMGSZ (letterbox.py).
+    """
     from ultralytics import YOLO
 
     print("=" * 55)
-    print("  ШАГ 1: ОБУЧЕНИЕ")
+    print("  ШАГ 1: ОБУЧЕНИЕ" + ("  (аугментация на лету)" if online else ""))
     print("=" * 55)
 
+    if check:
+        import validate
+        validate.run(quarantine_bad=True)
+    data = dataset(online, cache)
+
     model = YOLO("yolov8n.pt")  # скачает автоматически
 
+    extra = {}
+    if online:
+        from online_augment import OnlineTrainer
+        # Исходники декодируются один раз и живут в памяти
+        extra = {"trainer": OnlineTrainer, "cache": "ram"}
+
     model.train(
-        data=DATASET,
+        data=data,
         epochs=50,
-        imgsz=640,
+        imgsz=IMGSZ,
         batch=16,
         name="metro_damage",
         project=PROJECT,
+        exist_ok=True,     # всегда runs/metro_damage — на этот путь смотрят export, runner, infer
         patience=10,       # ранняя остановка если нет улучшений
         save=True,
         plots=True,
+        **extra,
     )
 
     print("\n  Модель сохранена в:")
     print(f"  {PROJECT}/metro_damage/weights/best.pt")
 
 
-def step2_validate():
+def step2_validate(cache=USE_CACHE):
     """Валидация на val-сете."""
     from ultralytics import YOLO
 
@@ -47,7 +84,7 @@ def step2_validate():
         return
 
     model = YOLO(best)
-    results = model.val(data=DATASET)
+    results = model.val(data=dataset(cache=cache), imgsz=IMGSZ)
 
     print(f"\n  mAP50:    {results.box.map50:.3f}")
     print(f"  mAP50-95: {results.box.map:.3f}")
@@ -55,7 +92,7 @@ def step2_validate():
     print(f"  Recall:    {results.box.mr:.3f}")
 
 
-def step3_test_images():
+def step3_test_images(cache=USE_CACHE):
     """Тест на реальных фото из raw_images."""
     from ultralytics import YOLO
 
@@ -72,6 +109,9 @@ def step3_test_images():
         return
 
     model = YOLO(best)
+    if cache and os.path.isdir(raw):
+        import letterbox
+        raw = letterbox.build_dir(raw, IMGSZ)     # без полей: боксы в кадре фото
 
     results = model.predict(
         source=raw,
@@ -80,7 +120,7 @@ def step3_test_images():
         project=out,
         name="results",
         conf=0.25,
-        imgsz=640,
+        imgsz=IMGSZ,
     )
 
     total = len(results)
@@ -91,8 +131,12 @@ def step3_test_images():
     print(f"  Результаты: {out}/results/")
 
 
-def step4_export():
-    """Экспорт модели для продакшена."""
+def step4_export(int8=False):
+    """
+    Экспорт модели для продакшена.
+    int8 — дополнительно статически квантованная модель best_int8.onnx
+    (quantize.py: калибровка на val и сравнение с fp32).
+    """
     from ultralytics import YOLO
 
     print("\n" + "=" * 55)
@@ -106,9 +150,14 @@ def step4_export():
 
     model = YOLO(best)
 
-    model.export(format="onnx", imgsz=640)
+    # dynamic — переменный batch: serve.py склеивает запросы в микро-батчи
+    onnx_path = model.export(format="onnx", imgsz=IMGSZ, dynamic=True)
     print("  Экспортировано в ONNX")
 
+    if int8:
+        import quantize
+        quantize.run(onnx_path, imgsz=IMGSZ)
+
 
 def main():
     print("=" * 55)
@@ -122,6 +171,12 @@ def main():
     4. export   — экспорт в ONNX
     5. all      — всё по порядку
 
+    --online    — аугментация на лету при обучении
+                  (после python data.py --online)
+    --no-check  — не проверять датасет перед обучением
+    --no-cache  — обучаться на исходниках, без кэша letterbox.py
+    --int8      — при экспорте ещё INT8-модель для CPU (quantize.py)
+
   Использование:
     python train.py train
     python train.py val
@@ -136,18 +191,20 @@ def main():
         return
 
     cmd = sys.argv[1].lower()
+    cache = "--no-cache" not in sys.argv[2:]
 
     if cmd in ("train", "all"):
-        step1_train()
+        step1_train(online="--online" in sys.argv[2:], check="--no-check" not in sys.argv[2:],
+                    cache=cache)
 
     if cmd in ("val", "all"):
-        step2_validate()
+        step2_validate(cache)
 
     if cmd in ("test", "all"):
-        step3_test_images()
+        step3_test_images(cache)
 
     if cmd in ("export", "all"):
-        step4_export()
+        step4_export(int8="--int8" in sys.argv[2:])
 
     if cmd == "all":
         print(f"\n{'='*55}")
@@ -0,0 +1,93 @@
+"""
+Аугментация на лету при обучении — вместо 8 JPEG на диске на каждый исходник.
+
+    python data.py --online          # split только исходников generated_dataset
+    python main.py train --online    # обучение с цепочками augment.py в загрузчике
+
+Каждая исходная картинка декодируется один раз и держится в памяти как
+uint8-массив (cache="ram" у Ultralytics). В каждой эпохе загрузчик для
+каждого сэмпла выбирает случайную цепочку политики augment.json (для
+класса сэмпла; оригинал — с тем же весом, что и при материализации,
+цепочки — с весом своего p) и применяет её в процессах-воркерах DataLoader. Боксы переводятся
+той же матрицей геометрии (geometry.py). Промежуточные картинки на диск
+не пишутся, и каждую эпоху модель видит новые варианты.
+"""
+import random
+
+import numpy as np
+from PIL import Image
+
+from augment import apply_chain, chains_for, load_policy
+import geometry
+
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+POLICY = load_policy()
+
+
+def augment_label(label, names=None):
+    """
+    Применяет случайную цепочку к сэмплу Ultralytics (до Instances):
+    label["img"] — BGR uint8, label["bboxes"] — YOLO xywh (доли), label["cls"] — (N, 1).
+    names — {id: имя класса} для цепочек класса (по первому боксу).
+    """
+    cls_name = None
+    if names and label.get("cls") is not None and len(label["cls"]):
+        cls_name = names.get(int(label["cls"][0][0]))
+    chains = chains_for(POLICY, cls_name)
+    # Оригинал — одна из «цепочек», как и в augmented_dataset/
+    chain = random.choices([None] + chains, weights=[1.0] + [c.p for c in chains])[0]
+    if chain is None:
+        return label
+
+    # Кэш "ram" отдаёт общий массив — работаем с копией через PIL
+    img = Image.fromarray(label["img"][..., ::-1])
+    img, m = apply_chain(img, chain.steps)
+    label["img"] = np.ascontiguousarray(np.asarray(img)[..., ::-1])
+
+    bboxes = label.get("bboxes")
+    if bboxes is not None and len(bboxes):
+        boxes, keep = geometry.transform_boxes(bboxes, m, img.size)
+        label["bboxes"] = boxes.astype(np.float32)
+        label["cls"] = label["cls"][keep]
+        if label.get("segments") is not None and len(label["segments"]):
+            label["segments"] = []      # детекция: сегменты после warp не нужны
+    return label
+
+
+class OnlineAugmentMixin:
+    """Подмешивается к датасету Ultralytics: цепочки augment.py перед его собственными."""
+
+    def update_labels_info(self, label):
+        if self.augment:
+            label = augment_label(label, getattr(self, "data", None) and self.data.get("names"))
+        return super().update_labels_info(label)
+
+
+class OnlineYOLODataset(OnlineAugmentMixin, YOLODataset):
+    pass
+
+
+def _online_class(base):
+    """Класс с подмешанной аугментацией. Для YOLODataset — объявленный здесь
+    (пиклится воркерами и при spawn), для прочих собирается на лету."""
+    if base is YOLODataset:
+        return OnlineYOLODataset
+    name = f"Online{base.__name__}"
+    if name not in globals():
+        globals()[name] = type(name, (OnlineAugmentMixin, base), {})
+    return globals()[name]
+
+
+class OnlineTrainer(DetectionTrainer):
+    """DetectionTrainer, у которого train-датасет аугментирует на лету."""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if mode == "train":
+            # Класс датасета зависит от версии Ultralytics и настроек —
+            # подмешиваемся к тому, что собрал родитель
+            dataset.__class__ = _online_class(type(dataset))
+        return dataset
+
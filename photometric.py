@@ -0,0 +1,181 @@
+"""
+Слитое (fused) цветовое ядро для цепочек аугментации.
+
+Цепочка цветовых операций компилируется в несколько проходов по одному
+uint8-буферу вместо PIL → float32 → uint8 → PIL на каждую операцию:
+
+  • поканальные операции (brightness, contrast, shift — warm/cold)
+    сворачиваются в одну таблицу 3×256 (LUT); промежуточное округление и
+    обрезка повторяются прямо на 256 значениях таблицы, поэтому результат
+    совпадает с последовательным применением;
+  • среднее для contrast считается по гистограмме, а не по пикселям:
+    гистограмма входа + текущая LUT дают среднее после любых LUT-операций;
+  • попиксельные операции (saturation, noise) выполняются в том же проходе,
+    полосами по CHUNK_ROWS строк во временном float32 — без полноразмерных
+    float-копий.
+
+Операции:
+    ("brightness", f)     — как ImageEnhance.Brightness
+    ("contrast", f)       — как ImageEnhance.Contrast
+    ("saturation", f)     — как ImageEnhance.Color
+    ("shift", dr, dg, db) — сдвиг каналов (warm / cold)
+    ("noise", sigma)      — гауссов шум
+
+apply()       — одна картинка (PIL или uint8 H×W×3).
+apply_batch() — пачка одинаковых по размеру картинок N×H×W×3 с одинаковой
+                структурой цепочки и своими параметрами у каждой.
+"""
+import numpy as np
+from PIL import Image
+
+LUT_OPS = ("brightness", "contrast", "shift")
+PIXEL_OPS = ("saturation", "noise")
+CHUNK_ROWS = 128
+
+# Коэффициенты PIL для convert("L")
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_IDENTITY = np.arange(256, dtype=np.float32)
+
+
+def _stages(names):
+    """
+    Разбивает цепочку на проходы: [(lut_ops, pixel_ops), ...].
+    Каждый проход — сначала LUT, потом попиксельные операции; LUT-операция
+    после попиксельной начинает новый проход.
+    """
+    stages = []
+    lut, pix = [], []
+    for i, name in enumerate(names):
+        if name in LUT_OPS:
+            if pix:
+                stages.append((lut, pix))
+                lut, pix = [], []
+            lut.append(i)
+        elif name in PIXEL_OPS:
+            pix.append(i)
+        else:
+            raise ValueError(f"photometric: неизвестная операция '{name}'")
+    if lut or pix:
+        stages.append((lut, pix))
+    return stages
+
+
+def _as_pil(a):
+    """uint8 H×W×3 → PIL.Image без копирования (для C-функций PIL)."""
+    h, w = a.shape[:2]
+    return Image.frombuffer("RGB", (w, h), np.ascontiguousarray(a), "raw", "RGB", 0, 1)
+
+
+def _histogram(img):
+    """Гистограмма по каналам (3, 256) — считается в C через PIL."""
+    return np.asarray(img.histogram(), dtype=np.float64).reshape(3, 256)
+
+
+def _build_lut(ops, hist_fn):
+    """
+    Сворачивает LUT-операции в таблицу (3, 256) uint8.
+    hist_fn() — гистограмма входа; вызывается, только если есть contrast.
+    """
+    lut = np.tile(_IDENTITY, (3, 1))
+    hist = None
+    for op in ops:
+        name = op[0]
+        if name == "brightness":
+            lut = np.floor(np.clip(lut * op[1], 0, 255))
+        elif name == "contrast":
+            if hist is None:
+                hist = hist_fn()
+            # Среднее яркости текущего (после lut) изображения
+            means = (hist * lut).sum(axis=1) / max(hist[0].sum(), 1)
+            mean = int(float(_LUMA @ means.astype(np.float32)) + 0.5)
+            lut = np.floor(np.clip(mean + (lut - mean) * op[1], 0, 255))
+        elif name == "shift":
+            lut = np.floor(np.clip(lut + np.array(op[1:4], dtype=np.float32)[:, None], 0, 255))
+    return lut.astype(np.uint8)
+
+
+def _pixel_pass(f, ops, rng):
+    """Попиксельные операции над полосой f (float32, in-place)."""
+    for op in ops:
+        name = op[0]
+        if name == "saturation":
+            luma = np.floor(f @ _LUMA + 0.5)[..., None]
+            f -= luma
+            f *= op[1]
+            f += luma
+        elif name == "noise":
+            f += rng.standard_normal(f.shape, dtype=np.float32) * np.float32(op[1])
+        np.clip(f, 0, 255, out=f)
+        np.floor(f, out=f)
+
+
+def _pixel_stage(a, lut, pix, rng):
+    """Один проход полосами: LUT (если есть) и попиксельные операции."""
+    for r0 in range(0, a.shape[0], CHUNK_ROWS):
+        band = a[r0:r0 + CHUNK_ROWS]
+        if lut is not None:
+            for c in range(3):
+                band[..., c] = lut[c][band[..., c]]
+        f = band.astype(np.float32)
+        _pixel_pass(f, pix, rng)
+        band[...] = f
+
+
+def _run(a, ops, rng):
+    """Применяет операции к одной картинке a (uint8 H×W×3, in-place)."""
+    for lut_idx, pix_idx in _stages([op[0] for op in ops]):
+        lut = None
+        if lut_idx:
+            lut = _build_lut([ops[i] for i in lut_idx], lambda: _histogram(_as_pil(a)))
+        if pix_idx:
+            _pixel_stage(a, lut, [ops[i] for i in pix_idx], rng)
+        else:
+            a[...] = np.asarray(_as_pil(a).point(lut.ravel().tolist()))
+    return a
+
+
+def apply_batch(batch, ops_list, rng=None):
+    """
+    batch — uint8 (N, H, W, 3), изменяется на месте; ops_list — N списков
+    операций одинаковой структуры (имена совпадают, параметры свои).
+    """
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2 ** 31))
+    if len(ops_list) != len(batch):
+        raise ValueError("apply_batch: число цепочек не совпадает с размером пачки")
+    for a, ops in zip(batch, ops_list):
+        _run(a, ops, rng)
+    return batch
+
+
+def apply(img, ops, rng=None):
+    """
+    Применяет цепочку операций к одной картинке.
+    PIL.Image → PIL.Image, ndarray → тот же ndarray (изменён на месте).
+    Случайность шума берётся из np.random, если rng не передан.
+    """
+    if not ops:
+        return img
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2 ** 31))
+    if isinstance(img, np.ndarray):
+        return _run(img, ops, rng)
+
+    # PIL: чисто LUT-проходы делаем прямо в PIL (histogram + point в C),
+    # в numpy переходим только ради попиксельных операций.
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    a = None
+    for lut_idx, pix_idx in _stages([op[0] for op in ops]):
+        lut = None
+        if lut_idx:
+            src = img if a is None else _as_pil(a)
+            lut = _build_lut([ops[i] for i in lut_idx], lambda: _histogram(src))
+        if pix_idx:
+            if a is None:
+                a = np.array(img)
+            _pixel_stage(a, lut, [ops[i] for i in pix_idx], rng)
+        else:
+            img = (img if a is None else Image.fromarray(a)).point(lut.ravel().tolist())
+            a = None
+    return img if a is None else Image.fromarray(a)
@@ -0,0 +1,341 @@
+"""
+Потоковый режим: генерация → аугментация → split без ожидания между стадиями.
+
+    python pipeline.py --total 220
+    python pipeline.py --total 60 --workers 8 --aug-workers 4
+
+Стадии — генераторы, соединённые ограниченными очередями (QUEUE):
+    generate  — потоки generate_data._worker: картинка и лейбл на диск,
+                журнал, дедупликация, кэш ответов — как в generate_data.py
+    augment   — процессы augment.process_image (цепочки augment.json)
+    split     — ссылки в dataset_yolo/train|val, catalog.sqlite, data.yaml
+
+Картинка уходит дальше, как только пришла от API: аугментация идёт, пока
+следующие запросы ждут ответа, а dataset_yolo/ пригоден для обучения уже
+во время генерации. Если стадия не успевает, очередь перед ней
+заполняется и предыдущая ждёт — новых запросов к API не больше числа
+потоков сверх очереди, память не растёт.
+
+Split потоковый: часть выбирается по crc32(seed:источник) — все
+аугментации одной картинки в одной части, и разложенные файлы не
+переезжают при появлении новых. Стратифицированный split по классам
+после окончания — обычный `python data.py`.
+"""
+import os
+import time
+import zlib
+import queue
+import shutil
+import argparse
+import threading
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import generate_data as gd
+import augment
+import catalog
+import data
+import dedup
+from journal import Journal, DONE, FAILED, DUPLICATE
+from telemetry import Telemetry
+from cache import ResponseCache
+
+QUEUE = 32          # сэмплов в очереди между стадиями
+SPLIT = data.SPLIT
+SEED = data.SEED
+
+
+# ──────────────────────────────────────────────────────────
+#  Связка стадий
+# ──────────────────────────────────────────────────────────
+_END = object()
+
+
+def threaded(gen, maxsize: int = QUEUE):
+    """
+    Выполняет генератор gen в своём потоке и отдаёт его элементы через
+    очередь на maxsize: когда потребитель отстаёт, put() блокирует gen.
+    Исключение стадии пробрасывается потребителю.
+    """
+    q = queue.Queue(maxsize)
+
+    def run():
+        try:
+            for x in gen:
+                q.put(x)
+            q.put(_END)
+        except BaseException as e:
+            q.put(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        x = q.get()
+        if x is _END:
+            return
+        if isinstance(x, BaseException):
+            raise x
+        yield x
+
+
+def part_of(source: str, split: float = SPLIT, seed: int = SEED) -> str:
+    """train/val для источника — не зависит от порядка и состава датасета."""
+    return "train" if zlib.crc32(f"{seed}:{source}".encode("utf-8")) < split * 2 ** 32 else "val"
+
+
+# ──────────────────────────────────────────────────────────
+#  Стадии
+# ──────────────────────────────────────────────────────────
+def generate_stage(schedule, pool, workers, journal, cat, stats, stop,
+                   cache=None, index=None, out_format=gd.STORE_FORMAT, radius=dedup.DISTANCE):
+    """
+    Выдаёт (элемент расписания, путь картинки в generated_dataset/) по мере
+    готовности. В работе одновременно не больше workers запросов.
+    """
+    items = iter(schedule)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def fill():
+            while len(pending) < workers and not stop.is_set():
+                item = next(items, None)
+                if item is None:
+                    return
+                pending.add(executor.submit(gd._worker, item, pool, stop, cache,
+                                            out_format, index, radius))
+
+        fill()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                pending.discard(fut)
+                item, saved, cost = fut.result()
+                if pool.telemetry:
+                    pool.telemetry.flush()
+                if saved == "SKIPPED":
+                    continue
+                if saved == "NO_MONEY":
+                    if not stop.is_set():
+                        stats["stop"] = "💰 БАЛАНС КОНЧИЛСЯ!"
+                        stop.set()
+                    continue
+                cost = cost if isinstance(cost, (int, float)) else 0
+                stats["spent"] += cost
+                fname = item["id"]
+                if saved == "DUPLICATE":
+                    journal.mark(fname, DUPLICATE, cost, of=item["dup_of"])
+                    stats["dups"] += 1
+                    gd.log(f"  {fname:30s} ♻ дубликат {item['dup_of']}")
+                elif saved is not None:
+                    journal.mark(fname, DONE, cost, image=saved)
+                    cat.add("generated", os.path.join(gd.OUT_DIR, saved),
+                            label_path=os.path.join(gd.OUT_DIR, item["label"]),
+                            source=fname, cls_id=item["cls_id"],
+                            scene=item.get("scene"), prompt=item["prompt"])
+                    stats["generated"] += 1
+                    gd.log(f"  {fname:30s} ✅ ${cost:.3f}  "
+                           f"[{stats['generated']}/{len(schedule)}, {time.time() - stats['t0']:.0f}с]")
+                    yield item, saved
+                else:
+                    journal.mark(fname, FAILED, cost)
+                    stats["errors"] += 1
+                    gd.log(f"  {fname:30s} ❌")
+                    if stats["errors"] > gd.MAX_ERRORS and not stop.is_set():
+                        stats["stop"] = "⛔ Слишком много ошибок, остановка."
+                        stop.set()
+            fill()
+
+
+def augment_stage(samples, policy, workers, seed):
+    """
+    (элемент, путь) → (элемент, результат augment.process_image) в порядке
+    поступления. В пуле не больше 2×workers картинок.
+    """
+    with Pool(workers, initializer=augment._init_worker, initargs=(policy, False, False)) as pool:
+        pending = deque()
+        for item, saved in samples:
+            cls_dir, fname = saved.split("/")[-2:]
+            pending.append((item, pool.apply_async(augment.process_image, ((cls_dir, fname, seed),))))
+            while pending and (pending[0][1].ready() or len(pending) >= 2 * workers):
+                item, res = pending.popleft()
+                yield item, res.get()
+        while pending:
+            item, res = pending.popleft()
+            yield item, res.get()
+
+
+def split_stage(results, cat, dirs, mode, split, seed, stats):
+    """Раскладывает выходы аугментации в dataset_yolo/ и пишет их в каталог."""
+    images = os.path.join(augment.OUT_DIR, "images")
+    labels = os.path.join(augment.OUT_DIR, "labels")
+    for item, (n, errors, _, _, records) in results:
+        for name, err in errors:
+            gd.log(f"  ✗ {name}: {err}")
+        part = part_of(item["id"], split, seed)
+        for out_stem, _, _, _ in records:
+            data.put(labels, images, f"{out_stem}.jpg", f"{out_stem}.txt",
+                     dirs[f"{part}_img"], dirs[f"{part}_lbl"], mode)
+        cat.add_many("augmented", [
+            (os.path.join(images, f"{out_stem}.jpg"), {
+                "label_path": os.path.join(labels, f"{out_stem}.txt"),
+                "label_text": label, "size": size, "source": item["id"],
+                "cls_id": item["cls_id"], "aug": aug,
+            })
+            for out_stem, aug, size, label in records])
+        stats["augmented"] += n
+        stats[part] += len(records)
+        if stats["first"] is None:
+            stats["first"] = time.time() - stats["t0"]
+        yield item
+
+
+# ──────────────────────────────────────────────────────────
+#  Запуск
+# ──────────────────────────────────────────────────────────
+def prepare_split(cat, names, split, seed, link):
+    """
+    Чистый dataset_yolo/ с data.yaml и уже имеющимися аугментациями из
+    каталога (тем же правилом part_of). Возвращает (папки, способ ссылок).
+    """
+    dirs = {
+        "train_img": os.path.join(data.OUT_DIR, "train", "images"),
+        "train_lbl": os.path.join(data.OUT_DIR, "train", "labels"),
+        "val_img":   os.path.join(data.OUT_DIR, "val", "images"),
+        "val_lbl":   os.path.join(data.OUT_DIR, "val", "labels"),
+    }
+    for name in ("train", "val"):
+        shutil.rmtree(os.path.join(data.OUT_DIR, name), ignore_errors=True)
+        for ext in (".txt", ".cache"):
+            if os.path.exists(os.path.join(data.OUT_DIR, name + ext)):
+                os.remove(os.path.join(data.OUT_DIR, name + ext))
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+    with open(os.path.join(data.OUT_DIR, "data.yaml"), "w") as f:
+        f.write(f"path: {data.OUT_DIR}\ntrain: train/images\nval: val/images\n\nnames:\n"
+                + "".join(f"  {i}: {n}\n" for i, n in sorted(names.items())))
+
+    cat.sync("augmented", augment.OUT_DIR)
+    rows = cat.samples("augmented", labeled=True)
+    mode = link
+    if mode in ("auto", "list"):
+        probe = rows[0][0] if rows else None
+        mode = data.probe_mode(os.path.join(catalog.BASE_DIR, probe), data.OUT_DIR, False) \
+            if probe else "hardlink"
+    for path, source, _, label in rows:
+        full = os.path.join(catalog.BASE_DIR, *path.split("/"))
+        part = part_of(source, split, seed)
+        data.put(os.path.join(catalog.BASE_DIR, os.path.dirname(label)), os.path.dirname(full),
+                 os.path.basename(full), os.path.basename(label),
+                 dirs[f"{part}_img"], dirs[f"{part}_lbl"], mode)
+    return dirs, mode, len(rows)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Потоковый конвейер: генерация → аугментация → split")
+    p.add_argument("--total", type=int, default=gd.TOTAL, help="сколько картинок сгенерировать")
+    p.add_argument("--backends", default=gd.BACKENDS_FILE, help="JSON с пулом бэкендов")
+    p.add_argument("--workers", type=int, default=None, help="одновременных запросов к API")
+    p.add_argument("--rate", type=float, default=gd.RATE, help="запросов в секунду (бэкенд по умолчанию)")
+    p.add_argument("--aug-workers", type=int, default=max(1, cpu_count() - 1),
+                   help="процессов аугментации")
+    p.add_argument("--queue", type=int, default=QUEUE, help="ёмкость очередей между стадиями")
+    p.add_argument("--policy", default=augment.POLICY_FILE, help="политика аугментаций")
+    p.add_argument("--split", type=float, default=SPLIT, help="доля train")
+    p.add_argument("--seed", type=int, default=SEED, help="зерно split и аугментаций")
+    p.add_argument("--link", choices=data.LINK_MODES, default=data.LINK,
+                   help="как раскладывать файлы (list — недоступен, будут ссылки)")
+    p.add_argument("--format", choices=("keep", "jpg", "png"), default=gd.STORE_FORMAT)
+    p.add_argument("--no-cache", action="store_true", help="не использовать кэш ответов")
+    p.add_argument("--no-dedup", action="store_true", help="не отбрасывать почти-дубликаты")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenes, classes = gd.load_prompts()
+    names = {cls_id: info["name"] for cls_id, info in classes.items()}
+    pool = gd.default_pool(args.backends, args.workers, args.rate)
+    pool.telemetry = Telemetry(gd.EVENTS_FILE, gd.METRICS_FILE)
+    workers = max(1, args.workers or pool.capacity)
+    policy = augment.load_policy(args.policy)
+
+    print("=" * 60)
+    print("  ПОТОКОВЫЙ КОНВЕЙЕР: ГЕНЕРАЦИЯ → АУГМЕНТАЦИЯ → SPLIT")
+    print(f"  Цель:      {args.total} изображений, классов {len(classes)}")
+    print(f"  Потоков:   {workers} (API), {args.aug_workers} (аугментация)")
+    print(f"  Очереди:   {args.queue}")
+    print("=" * 60)
+
+    # ── Папки, классы, каталог ────────────────────────────
+    for info in classes.values():
+        os.makedirs(os.path.join(gd.OUT_DIR, info["name"]), exist_ok=True)
+    os.makedirs(os.path.join(gd.OUT_DIR, "labels"), exist_ok=True)
+    os.makedirs(os.path.join(augment.OUT_DIR, "images"), exist_ok=True)
+    os.makedirs(os.path.join(augment.OUT_DIR, "labels"), exist_ok=True)
+    txt = "".join(names[i] + "\n" for i in sorted(names))
+    for root in (gd.OUT_DIR, augment.OUT_DIR):
+        with open(os.path.join(root, "classes.txt"), "w", encoding="utf-8") as f:
+            f.write(txt)
+    cat = catalog.Catalog()
+    cat.set_classes(names)
+    dirs, mode, existing = prepare_split(cat, names, args.split, args.seed, args.link)
+    if existing:
+        print(f"\n  Уже в датасете: {existing} сэмплов ({mode})")
+
+    cache = None if args.no_cache else ResponseCache(max_mb=gd.CACHE_MB)
+    index = None if args.no_dedup else dedup.HashIndex(dedup.INDEX_FILE).load()
+    journal = Journal(gd.JOURNAL_FILE).load()
+
+    # Тот же предел по балансу, что в generate_data.py
+    remaining, budget = gd.get_budget(pool.telemetry)
+    total = args.total
+    if remaining is not None:
+        print(f"\n  Остаток:   ${remaining:.2f} (~{budget} картинок)")
+        if budget < total:
+            print(f"  ⚠ Хватит только на {budget} из {total}")
+            total = budget
+    else:
+        print("\n  Баланс: не удалось определить, продолжаем...")
+    schedule = gd.build_schedule(classes, scenes, total, journal)
+    print(f"\n{'─' * 60}\n")
+
+    # ── Конвейер ──────────────────────────────────────────
+    stop = threading.Event()
+    stats = {"t0": time.time(), "generated": 0, "errors": 0, "dups": 0, "spent": 0.0,
+             "augmented": 0, "train": 0, "val": 0, "first": None, "stop": None}
+    generated = threaded(generate_stage(schedule, pool, workers, journal, cat, stats, stop,
+                                        cache, index, args.format), args.queue)
+    augmented = threaded(augment_stage(generated, policy, max(1, args.aug_workers), args.seed),
+                         args.queue)
+    try:
+        for _ in split_stage(augmented, cat, dirs, mode, args.split, args.seed, stats):
+            pass
+    except KeyboardInterrupt:
+        stop.set()
+        stats["stop"] = "Прервано — продолжить генерацию: python generate_data.py --resume"
+    finally:
+        journal.close()
+        pool.telemetry.close()          # последний flush: metrics.prom на момент остановки
+        cat.close()
+        if index is not None:
+            index.close()
+        if cache is not None:
+            cache.close()
+
+    t = time.time() - stats["t0"]
+    print(f"\n{'=' * 60}")
+    if stats["stop"]:
+        print(f"  {stats['stop']}")
+    print(f"  ГОТОВО  ({int(t // 60)}м {int(t % 60)}с)")
+    print(f"  Сгенерировано: {stats['generated']}  (ошибок {stats['errors']}, дублей {stats['dups']}, "
+          f"${stats['spent']:.2f})")
+    print(f"  Аугментаций:   {stats['augmented']}")
+    print(f"  Train / Val:   +{stats['train']} / +{stats['val']}  ({mode})")
+    if stats["first"] is not None:
+        print(f"  Первый сэмпл в dataset_yolo/ через {stats['first']:.1f}с")
+    print(f"\n  {data.OUT_DIR}/data.yaml")
+    print(f"  Стратифицированный split по классам: python data.py")
+    print(f"{'=' * 60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Синтетические PNG без PIL — для заглушек (StubBackend) и fake_openrouter.py.
+"""
+import zlib
+import struct
+import random
+
+
+def make_png(width: int, height: int, color=(128, 128, 128), seed=None) -> bytes:
+    """
+    RGB PNG без PIL (чтобы сервер не требовал зависимостей).
+    Без seed — однотонный; с seed — случайная мозаика 8×8, так что разные
+    ответы не выглядят дубликатами для pHash.
+    """
+    def chunk(tag, data):
+        c = struct.pack(">I", len(data)) + tag + data
+        return c + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    if seed is None:
+        rows = (b"\x00" + bytes(color) * width) * height
+    else:
+        rnd = random.Random(seed)
+        grid = [[bytes(rnd.randrange(256) for _ in range(3)) for _ in range(8)]
+                for _ in range(8)]
+        rows = b"".join(
+            b"\x00" + b"".join(grid[y * 8 // height][x * 8 // width] for x in range(width))
+            for y in range(height)
+        )
+    raw = zlib.compress(rows, 6)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", raw) + chunk(b"IEND", b""))
@@ -0,0 +1,250 @@
+"""
+INT8-квантование ONNX-модели для CPU.
+
+    python quantize.py                     # best.onnx → best_int8.onnx + сравнение с fp32
+    python quantize.py --calib 400 --method percentile
+    python quantize.py --no-eval           # только квантовать
+    python main.py export --int8           # то же после экспорта
+
+Статическое квантование onnxruntime (QDQ): веса int8 по каналам,
+активации uint8 с диапазонами, снятыми на выборке из dataset_yolo/val
+(CALIB картинок, тот же letterbox, что при обучении). Постобработка
+головы Detect (DFL, декодирование боксов в пиксели) остаётся во float —
+координаты до 640 в 8 битах теряют точность.
+
+После квантования обе модели сравниваются: mAP50 и mAP50-95 на val
+(Ultralytics, как main.py val) и задержка на картинку через onnxruntime.
+Отчёт — <модель>_int8.json рядом с моделью; если mAP50-95 просел больше
+MAX_DROP, об этом пишется явно.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+from PIL import Image
+
+import infer
+import validate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "dataset_yolo")
+MODEL = os.path.join(BASE_DIR, "runs", "metro_damage", "weights", "best.onnx")
+
+IMGSZ = 640
+CALIB = 200             # картинок для калибровки
+METHODS = ("minmax", "entropy", "percentile")
+BENCH = 50              # картинок для замера задержки
+WARMUP = 5
+MAX_DROP = 0.01         # допустимая просадка mAP50-95 (абсолютная)
+SEED = 42
+
+
+# ──────────────────────────────────────────────────────────
+#  Калибровка
+# ──────────────────────────────────────────────────────────
+def preprocess(path: str, imgsz: int = IMGSZ) -> np.ndarray:
+    """Картинка → тензор 1×3×imgsz×imgsz float32 0..1, как у Ultralytics."""
+    with Image.open(path) as img:
+        x, _ = infer.preprocess(img, imgsz)
+    return x[None]
+
+
+def val_images(root: str = DATA_DIR, n: int = CALIB, seed: int = SEED):
+    """Случайные n картинок из val (папки или val.txt); n=None — все, перемешанные."""
+    splits, _, _ = validate.yolo_splits(root)
+    images = sorted(img for img, _ in splits.get("val", []))
+    if not images:
+        sys.exit(f"Нет val-картинок в {root}\nСначала запустите data.py")
+    random.Random(seed).shuffle(images)
+    return images if n is None else images[:n]
+
+
+def _reader(input_name: str, images, imgsz: int):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.it = iter(images)
+
+        def get_next(self):
+            path = next(self.it, None)
+            return None if path is None else {input_name: preprocess(path, imgsz)}
+
+    return Reader()
+
+
+def head_nodes(model) -> list:
+    """
+    Узлы постобработки последнего модуля (/model.N/ — голова Detect): всё,
+    кроме свёрток cv2/cv3. Их выход — координаты в пикселях.
+    """
+    heads = {n.name.split("/")[1] for n in model.graph.node
+             if n.name.startswith("/model.") and n.name.count("/") > 1}
+    if not heads:
+        return []
+    head = "/" + max(heads, key=lambda h: int(h.split(".")[1])) + "/"
+    return [n.name for n in model.graph.node
+            if n.name.startswith(head) and not n.name.startswith((head + "cv2", head + "cv3"))]
+
+
+def quantize(src: str, dst: str, images, method: str = "minmax", imgsz: int = IMGSZ):
+    """fp32 ONNX → статически квантованный INT8 (QDQ). Возвращает dst."""
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import (quantize_static, QuantFormat, QuantType,
+                                          CalibrationMethod)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Свёртка BN, инференс форм — без них диапазоны снимаются хуже
+    prep = dst + ".prep.onnx"
+    try:
+        quant_pre_process(src, prep, skip_symbolic_shape=True)
+    except Exception as e:
+        print(f"  [подготовка пропущена: {e}]")
+        prep = src
+
+    model = onnx.load(prep)
+    exclude = head_nodes(model)
+    input_name = ort.InferenceSession(prep, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    calib = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+             "percentile": CalibrationMethod.Percentile}[method]
+
+    t0 = time.time()
+    quantize_static(
+        prep, dst, _reader(input_name, images, imgsz),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+        calibrate_method=calib,
+        nodes_to_exclude=exclude,
+        extra_options={"ActivationSymmetric": False, "WeightSymmetric": True},
+    )
+    if prep != src:
+        os.remove(prep)
+    print(f"  Калибровка: {len(images)} картинок, {method}, "
+          f"{len(exclude)} узлов головы во float  ({time.time() - t0:.0f}с)")
+    return dst
+
+
+# ──────────────────────────────────────────────────────────
+#  Сравнение fp32 / int8
+# ──────────────────────────────────────────────────────────
+def latency(path: str, images, imgsz: int = IMGSZ, threads: int = 0):
+    """
+    Задержка onnxruntime на картинку (без препроцессинга): p50, p95, среднее, мс.
+    Сессия — infer.session, как у serve.py, video.py и bench.py.
+    """
+    sess = infer.session(path, threads)
+    name = sess.get_inputs()[0].name
+    batch = [preprocess(p, imgsz) for p in images]
+    for x in batch[:WARMUP]:
+        sess.run(None, {name: x})
+    times = []
+    for x in batch:
+        t = time.perf_counter()
+        sess.run(None, {name: x})
+        times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    return {"p50_ms": times[len(times) // 2],
+            "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))],
+            "mean_ms": sum(times) / len(times)}
+
+
+def accuracy(path: str, data_yaml: str, imgsz: int = IMGSZ):
+    """mAP50 и mAP50-95 на val — та же валидация Ultralytics, что в main.py val."""
+    from ultralytics import YOLO
+
+    res = YOLO(path, task="detect").val(data=data_yaml, imgsz=imgsz, batch=1,
+                                        plots=False, verbose=False)
+    return {"map50": float(res.box.map50), "map50_95": float(res.box.map)}
+
+
+def compare(fp32: str, int8: str, data_yaml: str, images, imgsz: int = IMGSZ,
+            threads: int = 0):
+    report = {"fp32": {"model": fp32, "size_mb": os.path.getsize(fp32) / 2**20},
+              "int8": {"model": int8, "size_mb": os.path.getsize(int8) / 2**20}}
+    for key, path in (("fp32", fp32), ("int8", int8)):
+        print(f"  {key}: задержка на {len(images)} картинках...")
+        report[key].update(latency(path, images, imgsz, threads))
+        print(f"  {key}: валидация...")
+        report[key].update(accuracy(path, data_yaml, imgsz))
+    a, b = report["fp32"], report["int8"]
+    report["drop_map50"] = a["map50"] - b["map50"]
+    report["drop_map50_95"] = a["map50_95"] - b["map50_95"]
+    report["speedup"] = a["p50_ms"] / b["p50_ms"] if b["p50_ms"] else None
+    report["ok"] = report["drop_map50_95"] <= MAX_DROP
+    return report
+
+
+def print_report(r):
+    print(f"\n  {'':6s} {'mAP50':>7s} {'mAP50-95':>9s} {'p50, мс':>8s} {'p95, мс':>8s} {'МБ':>6s}")
+    for key in ("fp32", "int8"):
+        m = r[key]
+        print(f"  {key:6s} {m['map50']:7.3f} {m['map50_95']:9.3f} {m['p50_ms']:8.1f} "
+              f"{m['p95_ms']:8.1f} {m['size_mb']:6.1f}")
+    print(f"\n  Просадка mAP50-95: {r['drop_map50_95']:+.3f}  (допустимо {MAX_DROP})")
+    if r["speedup"]:
+        print(f"  Ускорение:         ×{r['speedup']:.2f}")
+    if r["ok"]:
+        print("  ✅ INT8-модель можно выкатывать")
+    else:
+        print("  ⚠ Просадка больше допустимой — оставьте fp32 или увеличьте --calib / смените --method")
+
+
+def run(model: str = MODEL, calib: int = CALIB, method: str = "minmax",
+        evaluate: bool = True, data_yaml: str = None, imgsz: int = IMGSZ, threads: int = 0):
+    """best.onnx → best_int8.onnx (+ отчёт best_int8.json). Возвращает путь к int8."""
+    if not os.path.exists(model):
+        sys.exit(f"Нет модели {model}\nСначала: python main.py export")
+    dst = os.path.splitext(model)[0] + "_int8.onnx"
+    # Задержка меряется на картинках, которых калибровка не видела
+    images = val_images(n=None)
+    bench = images[calib:calib + BENCH]
+    if not bench:
+        bench = images[-max(1, min(BENCH, len(images) // 4)):]
+        print(f"  ⚠ В val всего {len(images)} картинок: калибровка на "
+              f"{len(images) - len(bench)}, замер на {len(bench)}")
+        calib = max(1, len(images) - len(bench))
+    images = images[:calib]
+    quantize(model, dst, images, method, imgsz)
+    print(f"  INT8: {dst}")
+    if not evaluate:
+        return dst
+
+    if data_yaml is None:
+        import main
+        data_yaml = main.dataset()
+    report = compare(model, dst, data_yaml, bench, imgsz, threads)
+    report.update(calib=len(images), method=method, imgsz=imgsz)
+    print_report(report)
+    with open(os.path.splitext(dst)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return dst
+
+
+def main():
+    p = argparse.ArgumentParser(description="Статическое INT8-квантование ONNX с калибровкой на val")
+    p.add_argument("--model", default=MODEL, help="fp32 ONNX (python main.py export)")
+    p.add_argument("--calib", type=int, default=CALIB, help="картинок для калибровки")
+    p.add_argument("--method", choices=METHODS, default="minmax",
+                   help="как выбирать диапазон активаций")
+    p.add_argument("--imgsz", type=int, default=IMGSZ)
+    p.add_argument("--threads", type=int, default=0, help="intra-op потоки при замере (0 — все)")
+    p.add_argument("--data", default=None, help="data.yaml для сравнения (по умолчанию как main.py val)")
+    p.add_argument("--no-eval", action="store_true", help="не сравнивать с fp32")
+    args = p.parse_args()
+
+    print("=" * 55)
+    print("  INT8-КВАНТОВАНИЕ")
+    print("=" * 55)
+    run(args.model, args.calib, args.method, not args.no_eval, args.data, args.imgsz, args.threads)
+    print(f"{'=' * 55}")
+
+
+if __name__ == "__main__":
+    main()
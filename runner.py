@@ -0,0 +1,437 @@
+"""
+Инкрементальный запуск конвейера: пересчитывается только устаревшее.
+
+    python runner.py                         # generate → augment → data → train → export
+    python runner.py augment data            # только эти стадии
+    python runner.py --dry-run               # показать, что устарело, ничего не делая
+    python runner.py --total 300             # догенерировать до 300 картинок
+
+Для каждого файла стадии хранится отпечаток входов (runner.sqlite):
+    generate — промпт картинки есть среди текущих промптов класса
+               (prompts.json). Устаревшие картинки уходят в
+               generated_dataset/_stale/, недостающие до --total догенерируются.
+    augment  — sha1 исходника и его лейбла + цепочки политики для класса
+               + seed. Пересчитываются только изменившиеся исходники, выходы
+               удалённых исходников и исчезнувших цепочек удаляются.
+    data     — размер/mtime сэмпла + его часть (train/val) + способ ссылок.
+               Часть выбирается по источнику (pipeline.part_of) и не зависит
+               от остальных сэмплов — новые картинки не перетасовывают split.
+    train    — отпечаток всего split + параметры обучения.
+    export   — sha1 best.pt + imgsz.
+
+sha1 файлов кэшируется по (размер, mtime), так что повтор без изменений —
+это stat() файлов и несколько секунд даже на 100k картинок.
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from multiprocessing import Pool, cpu_count
+
+import augment
+import catalog
+import data
+import validate
+import pipeline
+import generate_data as gd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, "runner.sqlite")
+STAGES = ("generate", "augment", "data", "train", "export")
+STALE_DIR = os.path.join(gd.OUT_DIR, "_stale")
+
+
+# ──────────────────────────────────────────────────────────
+#  Состояние: отпечатки и выходы
+# ──────────────────────────────────────────────────────────
+class State:
+    def __init__(self, path: str = STATE_FILE):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS outputs (
+                stage   TEXT NOT NULL,
+                key     TEXT NOT NULL,        -- входной файл (от корня проекта)
+                fp      TEXT NOT NULL,        -- отпечаток входов
+                outputs TEXT NOT NULL,        -- JSON: выходные файлы
+                PRIMARY KEY (stage, key)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                sig  TEXT NOT NULL,           -- размер:mtime
+                sha1 TEXT NOT NULL
+            );
+        """)
+        self.db.commit()
+        self._hashes = {p: (s, h) for p, s, h in self.db.execute("SELECT path, sig, sha1 FROM files")}
+        self._fresh_hashes = []
+
+    def entries(self, stage: str) -> dict:
+        """{ключ: (отпечаток, [выходы])}."""
+        return {k: (fp, json.loads(out)) for k, fp, out in self.db.execute(
+            "SELECT key, fp, outputs FROM outputs WHERE stage = ?", (stage,))}
+
+    def put(self, stage: str, key: str, fp: str, outputs):
+        self.db.execute("INSERT OR REPLACE INTO outputs (stage, key, fp, outputs) VALUES (?, ?, ?, ?)",
+                        (stage, key, fp, json.dumps(outputs)))
+
+    def drop(self, stage: str, key: str):
+        self.db.execute("DELETE FROM outputs WHERE stage = ? AND key = ?", (stage, key))
+
+    def sha1(self, path: str) -> str:
+        """sha1 содержимого; по неизменившемуся (размер, mtime) — из таблицы."""
+        if not path or not os.path.exists(path):
+            return ""
+        sig = validate.file_sig(path)
+        hit = self._hashes.get(path)
+        if hit and hit[0] == sig:
+            return hit[1]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[path] = (sig, digest)
+        self._fresh_hashes.append((path, sig, digest))
+        return digest
+
+    def commit(self):
+        if self._fresh_hashes:
+            self.db.executemany("INSERT OR REPLACE INTO files (path, sig, sha1) VALUES (?, ?, ?)",
+                                self._fresh_hashes)
+            self._fresh_hashes = []
+        self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def _fp(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _abs(rel: str) -> str:
+    return os.path.join(BASE_DIR, *rel.split("/"))
+
+
+def _remove(paths):
+    for p in paths:
+        if os.path.lexists(p):
+            os.remove(p)
+
+
+# ──────────────────────────────────────────────────────────
+#  Стадии. Каждая возвращает (пересчитано, удалено)
+# ──────────────────────────────────────────────────────────
+def stage_generate(state, cat, args):
+    scenes, classes = gd.load_prompts()
+    names = {cls_id: info["name"] for cls_id, info in classes.items()}
+    cat.set_classes(names)
+    cat.sync("generated", gd.OUT_DIR)
+
+    current = {cls_id: {gd.build_prompt(s, d) for s in scenes.values() for d in info["prompts"]}
+               for cls_id, info in classes.items()}
+    fresh = {cls_id: 0 for cls_id in classes}
+    stale = []
+    for path, cls_id, prompt in cat.prompts("generated"):
+        if cls_id not in classes or (prompt is not None and prompt not in current[cls_id]):
+            stale.append(path)
+        else:
+            fresh[cls_id] += 1        # без промпта (старые прогоны) — считаем актуальной
+
+    per_class, remainder = divmod(args.total, len(classes))
+    missing = {cls_id: max(0, per_class + (1 if cls_id < remainder else 0) - fresh[cls_id])
+               for cls_id in classes}
+    print(f"    актуальных: {sum(fresh.values())}, устаревших: {len(stale)}, "
+          f"догенерировать: {sum(missing.values())}")
+    if args.dry_run:
+        return sum(missing.values()), len(stale)
+
+    # Устаревшие не удаляются (за них заплачено) — в _stale/, вне конвейера
+    for path in stale:
+        src = _abs(path)
+        stem = os.path.splitext(os.path.basename(src))[0]
+        dst = os.path.join(STALE_DIR, *path.split("/")[-2:])
+        os.makedirs(os.path.join(os.path.dirname(dst)), exist_ok=True)
+        os.replace(src, dst)
+        lbl = os.path.join(gd.OUT_DIR, "labels", f"{stem}.txt")
+        if os.path.exists(lbl):
+            os.makedirs(os.path.join(STALE_DIR, "labels"), exist_ok=True)
+            os.replace(lbl, os.path.join(STALE_DIR, "labels", f"{stem}.txt"))
+    cat.remove([_abs(p) for p in stale])
+
+    if not any(missing.values()):
+        return 0, len(stale)
+
+    # Тот же предел по балансу, что в generate_data.py и pipeline.py;
+    # урезаем по кругу между классами
+    remaining, budget = gd.get_budget()
+    if budget is not None and budget < sum(missing.values()):
+        print(f"    остаток ${remaining:.2f} — хватит только на {budget} из {sum(missing.values())}")
+        order = sorted((i, cls_id) for cls_id, n in missing.items() for i in range(n))
+        missing = {cls_id: sum(1 for _, c in order[:budget] if c == cls_id) for cls_id in missing}
+        if not any(missing.values()):
+            return 0, len(stale)
+
+    for info in classes.values():
+        os.makedirs(os.path.join(gd.OUT_DIR, info["name"]), exist_ok=True)
+    os.makedirs(os.path.join(gd.OUT_DIR, "labels"), exist_ok=True)
+    with open(os.path.join(gd.OUT_DIR, "classes.txt"), "w", encoding="utf-8") as f:
+        f.write("".join(names[i] + "\n" for i in sorted(names)))
+
+    from journal import Journal
+    from cache import ResponseCache
+    import dedup
+    pool = gd.default_pool(workers=args.workers)
+    workers = max(1, args.workers or pool.capacity)
+    journal = Journal(gd.JOURNAL_FILE).load()
+    cache = ResponseCache(max_mb=gd.CACHE_MB)
+    index = dedup.HashIndex(dedup.INDEX_FILE).load()
+    schedule = gd.build_schedule(classes, scenes, 0, journal, counts=missing)
+    stats = {"t0": time.time(), "generated": 0, "errors": 0, "dups": 0, "spent": 0.0, "stop": None}
+    try:
+        for _ in pipeline.generate_stage(schedule, pool, workers, journal, cat, stats,
+                                         threading.Event(), cache, index):
+            pass
+    finally:
+        journal.close()
+        cache.close()
+        index.close()
+    if stats["stop"]:
+        print(f"    {stats['stop']}")
+    return stats["generated"], len(stale)
+
+
+def _policy_fp(policy, cls_name):
+    return _fp([(c.name, c.p, [(s.func.__name__, s.params, s.p) for s in c.steps])
+                for c in augment.chains_for(policy, cls_name)])
+
+
+def stage_augment(state, cat, args):
+    policy = augment.load_policy(args.policy)
+    cat.sync("generated", gd.OUT_DIR)
+    entries = state.entries("augment")
+    out_images = os.path.join(augment.OUT_DIR, "images")
+    out_labels = os.path.join(augment.OUT_DIR, "labels")
+
+    policy_fps = {}
+    todo, seen = [], set()
+    for path, source, cls_id, label in cat.samples("generated"):
+        cls_dir, fname = path.split("/")[-2:]
+        if cls_dir not in policy_fps:
+            policy_fps[cls_dir] = _policy_fp(policy, cls_dir)
+        fp = _fp(state.sha1(_abs(path)), state.sha1(_abs(label) if label else None),
+                 policy_fps[cls_dir], args.seed)
+        seen.add(path)
+        old = entries.get(path)
+        if old and old[0] == fp and all(os.path.exists(p) for p in
+                                        (os.path.join(out_images, f"{s}.jpg") for s in old[1])):
+            continue
+        todo.append((path, source, cls_id, cls_dir, fname, fp))
+    orphans = [k for k in entries if k not in seen]
+    print(f"    исходников: {len(seen)}, устарело: {len(todo)}, удалено исходников: {len(orphans)}")
+    if args.dry_run:
+        return len(todo), len(orphans)
+
+    # Выходы удалённых исходников и старые выходы пересчитываемых
+    removed = []
+    for key in orphans + [t[0] for t in todo]:
+        for stem in entries.get(key, (None, []))[1]:
+            removed += [os.path.join(out_images, f"{stem}.jpg"), os.path.join(out_labels, f"{stem}.txt")]
+    _remove(removed)
+    cat.remove([p for p in removed if p.endswith(".jpg")])
+    for key in orphans:
+        state.drop("augment", key)
+
+    if todo:
+        os.makedirs(out_images, exist_ok=True)
+        os.makedirs(out_labels, exist_ok=True)
+        src_cls = os.path.join(gd.OUT_DIR, "classes.txt")
+        if os.path.exists(src_cls):
+            shutil.copyfile(src_cls, os.path.join(augment.OUT_DIR, "classes.txt"))
+        augment._init_worker(policy, False, False)
+        jobs = [(cls_dir, fname, args.seed) for _, _, _, cls_dir, fname, _ in todo]
+        workers = max(1, min(args.aug_workers, len(jobs)))
+        pool = Pool(workers, initializer=augment._init_worker,
+                    initargs=(policy, False, False)) if workers > 1 else None
+        results = pool.imap(augment.process_image, jobs, chunksize=4) if pool else map(augment.process_image, jobs)
+        for (path, source, cls_id, _, _, fp), (_, errors, _, _, records) in zip(todo, results):
+            for name, err in errors:
+                print(f"    ✗ {name}: {err}")
+            cat.add_many("augmented", [
+                (os.path.join(out_images, f"{out_stem}.jpg"), {
+                    "label_path": os.path.join(out_labels, f"{out_stem}.txt"),
+                    "label_text": label, "size": size, "source": source,
+                    "cls_id": cls_id, "aug": aug,
+                })
+                for out_stem, aug, size, label in records])
+            if not errors:
+                state.put("augment", path, fp, [r[0] for r in records])
+        if pool is not None:
+            pool.close()
+            pool.join()
+    state.commit()
+    return len(todo), len(orphans)
+
+
+def stage_data(state, cat, args):
+    cat.sync("augmented", augment.OUT_DIR)
+    entries = state.entries("data")
+    dirs = {f"{part}_{kind}": os.path.join(data.OUT_DIR, part, sub)
+            for part in ("train", "val") for kind, sub in (("img", "images"), ("lbl", "labels"))}
+    # Отбракованные validate.py не возвращаем, пока их исходник не изменится
+    quarantined = set()
+    for part in ("train", "val"):
+        qdir = os.path.join(data.OUT_DIR, validate.QUARANTINE, part, "images")
+        if os.path.isdir(qdir):
+            quarantined |= set(os.listdir(qdir))
+
+    rows = cat.samples("augmented", labeled=True)
+    first_run = not entries
+    mode = args.link
+    if mode == "auto":
+        mode = data.probe_mode(_abs(rows[0][0]), data.OUT_DIR, False) if rows else "hardlink"
+
+    todo, seen = [], set()
+    for path, source, _, label in rows:
+        part = pipeline.part_of(source, args.split, args.seed)
+        img, lbl = _abs(path), _abs(label)
+        name = os.path.basename(img)
+        fp = _fp(validate.file_sig(img), validate.file_sig(lbl), part, mode)
+        seen.add(path)
+        old = entries.get(path)
+        if old and old[0] == fp and (name in quarantined or all(os.path.lexists(p) for p in old[1])):
+            continue
+        todo.append((path, img, lbl, part, fp))
+    orphans = [k for k in entries if k not in seen]
+    print(f"    сэмплов: {len(seen)}, разложить: {len(todo)}, убрать: {len(orphans)}  ({mode})")
+    if args.dry_run:
+        return len(todo), len(orphans)
+
+    os.makedirs(data.OUT_DIR, exist_ok=True)
+    if first_run:
+        # dataset_yolo/ от data.py раскладывался по-другому — начинаем с чистого
+        for part in ("train", "val"):
+            shutil.rmtree(os.path.join(data.OUT_DIR, part), ignore_errors=True)
+            _remove([os.path.join(data.OUT_DIR, f"{part}.txt"), os.path.join(data.OUT_DIR, f"{part}.cache")])
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+    for key in orphans + [t[0] for t in todo]:
+        _remove(entries.get(key, (None, []))[1])
+    for key in orphans:
+        state.drop("data", key)
+    for path, img, lbl, part, fp in todo:
+        dst_img = os.path.join(dirs[f"{part}_img"], os.path.basename(img))
+        dst_lbl = os.path.join(dirs[f"{part}_lbl"], os.path.basename(lbl))
+        _remove([dst_img, dst_lbl])
+        data.put(os.path.dirname(lbl), os.path.dirname(img), os.path.basename(img),
+                 os.path.basename(lbl), dirs[f"{part}_img"], dirs[f"{part}_lbl"], mode)
+        state.put("data", path, fp, [dst_img, dst_lbl])
+    if todo or orphans:
+        for part in ("train", "val"):       # кэш разметки Ultralytics устарел
+            _remove([os.path.join(data.OUT_DIR, part, "labels.cache")])
+
+    names = cat.classes() or catalog.read_classes(os.path.join(augment.OUT_DIR, "classes.txt"))
+    with open(os.path.join(data.OUT_DIR, "data.yaml"), "w") as f:
+        f.write(f"path: {data.OUT_DIR}\ntrain: train/images\nval: val/images\n\nnames:\n"
+                + "".join(f"  {i}: {n}\n" for i, n in sorted(names.items())))
+    state.commit()
+    return len(todo), len(orphans)
+
+
+def _best():
+    import main
+    return os.path.join(main.PROJECT, "metro_damage", "weights", "best.pt")
+
+
+def stage_train(state, cat, args):
+    import main
+    split_fp = _fp(sorted(fp for fp, _ in state.entries("data").values()), main.IMGSZ, main.USE_CACHE)
+    old = state.entries("train").get("model")
+    if old and old[0] == split_fp and os.path.exists(_best()):
+        print(f"    модель актуальна")
+        return 0, 0
+    print(f"    split изменился — обучение")
+    if args.dry_run:
+        return 1, 0
+    main.step1_train()
+    state.put("train", "model", split_fp, [_best()])
+    state.commit()
+    return 1, 0
+
+
+def stage_export(state, cat, args):
+    import main
+    best = _best()
+    if not os.path.exists(best):
+        print(f"    нет {best}")
+        return 0, 0
+    onnx = os.path.splitext(best)[0] + ".onnx"
+    fp = _fp(state.sha1(best), main.IMGSZ)
+    old = state.entries("export").get("model")
+    if old and old[0] == fp and os.path.exists(onnx):
+        print(f"    ONNX актуален")
+        return 0, 0
+    if args.dry_run:
+        return 1, 0
+    main.step4_export()
+    state.put("export", "model", fp, [onnx])
+    state.commit()
+    return 1, 0
+
+
+RUNNERS = {
+    "generate": stage_generate,
+    "augment": stage_augment,
+    "data": stage_data,
+    "train": stage_train,
+    "export": stage_export,
+}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Инкрементальный запуск конвейера")
+    # Без choices=: argparse проверяет пустой nargs="*" как [] и отвергает запуск без стадий
+    p.add_argument("stages", nargs="*",
+                   help=f"какие стадии (по умолчанию все: {' '.join(STAGES)})")
+    p.add_argument("--dry-run", action="store_true", help="только показать, что устарело")
+    p.add_argument("--total", type=int, default=gd.TOTAL, help="сколько картинок должно быть")
+    p.add_argument("--workers", type=int, default=None, help="одновременных запросов к API")
+    p.add_argument("--aug-workers", type=int, default=cpu_count(), help="процессов аугментации")
+    p.add_argument("--policy", default=augment.POLICY_FILE, help="политика аугментаций")
+    p.add_argument("--split", type=float, default=data.SPLIT, help="доля train")
+    p.add_argument("--seed", type=int, default=data.SEED, help="зерно аугментаций и split")
+    p.add_argument("--link", choices=[m for m in data.LINK_MODES if m != "list"], default="auto",
+                   help="как раскладывать файлы в dataset_yolo/")
+    args = p.parse_args()
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        p.error(f"неизвестные стадии: {' '.join(unknown)} (есть: {' '.join(STAGES)})")
+    stages = [s for s in STAGES if s in (args.stages or STAGES)]
+
+    print("=" * 55)
+    print("  ИНКРЕМЕНТАЛЬНЫЙ ЗАПУСК" + ("  (dry-run)" if args.dry_run else ""))
+    print("=" * 55)
+    state = State()
+    cat = catalog.Catalog()
+    t_all = time.time()
+    try:
+        for stage in stages:
+            t0 = time.time()
+            print(f"\n  ▸ {stage}")
+            done, removed = RUNNERS[stage](state, cat, args)
+            print(f"    пересчитано {done}, удалено {removed}  ({time.time() - t0:.1f}с)")
+    finally:
+        cat.close()
+        state.close()
+    print(f"\n{'='*55}")
+    print(f"  ГОТОВО  ({time.time() - t_all:.1f}с)")
+    print(f"{'='*55}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Сервис инференса: модель загружается один раз, запросы склеиваются в микро-батчи.
+
+    python serve.py                                   # http://127.0.0.1:8000, best.onnx
+    python serve.py --model best_int8.onnx --max-batch 16 --max-wait-ms 10
+    python serve.py --socket /tmp/metro.sock          # Unix-сокет вместо TCP
+
+    curl --data-binary @car.jpg http://127.0.0.1:8000/detect
+    curl http://127.0.0.1:8000/metrics                # Prometheus
+    python serve.py --load raw_images --concurrency 16   # нагрузочный прогон по сервису
+
+POST /detect — тело: байты JPEG/PNG, параметры ?conf=0.25&iou=0.45.
+Ответ: {"width", "height", "detections": [{"class", "name", "conf", "box"}], "ms"}.
+
+Декодирование и letterbox идут в потоках HTTP-обработчиков параллельно;
+готовые тензоры встают в ограниченную очередь (QUEUE). Поток батчей
+берёт первый запрос и добирает следующие, пока не наберёт MAX_BATCH или
+не выйдет MAX_WAIT — один прогон onnxruntime на весь батч. NMS — снова в
+потоке запроса. Переполненная очередь сразу отвечает 503, а не копит
+задержку: хвост ограничен QUEUE / пропускной способностью.
+
+Батч больше 1 требует модели с переменным batch (main.py export делает
+её с dynamic=True); у модели с фиксированным batch=1 батч прогоняется по
+одной картинке.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import http.client
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import infer
+from telemetry import Telemetry
+
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH = 8
+MAX_WAIT = 0.005        # с — сколько первый запрос ждёт попутчиков
+QUEUE = 64              # запросов в очереди на инференс; сверх — 503
+TIMEOUT = 30            # с — ответ 504, если батч не успел
+KEEP = 10000            # последних значений для квантилей /metrics
+
+
+# ──────────────────────────────────────────────────────────
+#  Микро-батчи
+# ──────────────────────────────────────────────────────────
+class Job:
+    __slots__ = ("x", "t", "done", "out", "error")
+
+    def __init__(self, x):
+        self.x = x
+        self.t = time.monotonic()
+        self.done = threading.Event()
+        self.out = None
+        self.error = None
+
+
+class Batcher:
+    """
+    Очередь тензоров → прогоны model.run по max_batch. workers потоков
+    батчей делят одну сессию (run потокобезопасен) — при нескольких ядрах
+    следующий батч собирается, пока идёт текущий.
+    """
+
+    def __init__(self, model, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT,
+                 queue_size: int = QUEUE, workers: int = 1, tel: Telemetry = None):
+        self.model = model
+        self.max_batch = max_batch if model.dynamic else 1
+        self.max_wait = max_wait
+        self.q = queue.Queue(maxsize=queue_size)
+        self.tel = tel or Telemetry(prefix="metro_serve", keep=KEEP)
+        self.threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, x: np.ndarray) -> Job:
+        """Тензор 3×H×W в очередь. queue.Full — очередь переполнена."""
+        job = Job(x)
+        self.q.put_nowait(job)
+        self.tel.gauge("queue_depth", self.q.qsize())
+        return job
+
+    def _collect(self):
+        batch = [self.q.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            left = deadline - time.monotonic()
+            try:
+                job = self.q.get(timeout=left) if left > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:                 # close(): доделать батч и выйти
+                self.q.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self.q.put(None)            # разбудить соседние потоки
+                return
+            now = time.monotonic()
+            self.tel.gauge("queue_depth", self.q.qsize())
+            for job in batch:
+                self.tel.observe("queue_seconds", now - job.t)
+            try:
+                out = self.model.run(np.stack([job.x for job in batch]))
+                for job, o in zip(batch, out):
+                    job.out = o
+            except Exception as e:
+                for job in batch:
+                    job.error = str(e)
+            self.tel.observe("infer_seconds", time.monotonic() - now)
+            self.tel.inc("batches_total")
+            self.tel.inc("batch_images_total", len(batch))
+            for job in batch:
+                job.done.set()
+
+    def close(self):
+        self.q.put(None)
+        for t in self.threads:
+            t.join()
+
+
+# ──────────────────────────────────────────────────────────
+#  HTTP
+# ──────────────────────────────────────────────────────────
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256        # backlog listen(): пачка подключений камер без RST
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def make_handler(batcher: Batcher, tcp: bool = True):
+    """tcp=False — для unix-сокета: TCP_NODELAY там не поддерживается (EOPNOTSUPP)."""
+    model, tel = batcher.model, batcher.tel
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"          # keep-alive для клиентов камер
+        disable_nagle_algorithm = tcp          # иначе +40 мс на keep-alive (delayed ACK)
+
+        def _send(self, code: int, body, ctype="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/metrics":
+                self._send(200, tel.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/health":
+                self._send(200, {"model": os.path.basename(model.path), "imgsz": model.imgsz,
+                                 "names": model.names, "max_batch": batcher.max_batch,
+                                 "queue": batcher.q.qsize()})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            t0 = time.monotonic()
+            url = urlsplit(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if url.path != "/detect":
+                return self._send(404, {"error": "not found"})
+            code, res = self.detect(body, parse_qs(url.query))
+            tel.inc("detect_total", status=str(code))
+            tel.observe("detect_seconds", time.monotonic() - t0)
+            if code == 200:
+                res["ms"] = round((time.monotonic() - t0) * 1000, 1)
+            self._send(code, res)
+
+        def detect(self, body: bytes, params):
+            try:
+                conf = float(params.get("conf", [infer.CONF])[0])
+                iou = float(params.get("iou", [infer.IOU])[0])
+                x, frame = infer.preprocess(infer.load(body), model.imgsz)
+            except Exception as e:
+                return 400, {"error": f"не картинка: {e}"}
+            try:
+                job = batcher.submit(x)
+            except queue.Full:
+                return 503, {"error": "очередь переполнена"}
+            if not job.done.wait(TIMEOUT):
+                return 504, {"error": "таймаут инференса"}
+            if job.error:
+                return 500, {"error": job.error}
+            dets = infer.unletterbox(infer.decode(job.out, conf, iou), frame)
+            return 200, {"width": frame[4], "height": frame[5],
+                         "detections": infer.to_json(dets, model.names)}
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(model_path: str = infer.MODEL, host: str = HOST, port: int = PORT, sock: str = None,
+          max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT, queue_size: int = QUEUE,
+          threads: int = 0, workers: int = 1):
+    model = infer.Model(model_path, threads=threads, spin=False)
+    batcher = Batcher(model, max_batch, max_wait, queue_size, workers)
+    # Прогрев: первый прогон выделяет память и выбирает ядра
+    model.run(np.zeros((batcher.max_batch, 3, model.imgsz, model.imgsz), dtype=np.float32))
+
+    if sock:
+        if os.path.exists(sock):
+            os.remove(sock)
+        server = UnixHTTPServer(sock, make_handler(batcher, tcp=False))
+        where = f"unix:{sock}"
+    else:
+        server = HTTPServer((host, port), make_handler(batcher))
+        where = f"http://{host}:{port}"
+
+    print(f"  Модель:  {model_path}  ({model.imgsz}px, классов {len(model.names)})")
+    print(f"  Батч:    до {batcher.max_batch}, ожидание {max_wait * 1000:.0f} мс, "
+          f"очередь {queue_size}, потоков батчей {workers}")
+    if not model.dynamic and max_batch > 1:
+        print("  ⚠ у модели фиксированный batch=1 — переэкспортируйте: python main.py export")
+    print(f"  Слушаю:  {where}  (POST /detect, GET /metrics, /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if sock and os.path.exists(sock):
+            os.remove(sock)
+
+
+# ──────────────────────────────────────────────────────────
+#  Нагрузочный клиент
+# ──────────────────────────────────────────────────────────
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def connect(host: str = HOST, port: int = PORT, sock: str = None):
+    if sock:
+        return UnixHTTPConnection(sock)
+    return http.client.HTTPConnection(host, port, timeout=TIMEOUT)
+
+
+def load(paths, concurrency: int = 16, total: int = 200, host: str = HOST, port: int = PORT,
+         sock: str = None):
+    """
+    total запросов /detect из concurrency потоков (у каждого своё
+    keep-alive соединение). Возвращает {rps, p50_ms, p95_ms, p99_ms, errors}.
+    """
+    bodies = []
+    for p in paths:
+        with open(p, "rb") as f:
+            bodies.append(f.read())
+    counter = iter(range(total))
+    lock = threading.Lock()
+    times, errors = [], {}
+
+    def client():
+        conn = connect(host, port, sock)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            t = time.perf_counter()
+            try:
+                conn.request("POST", "/detect", bodies[i % len(bodies)],
+                             {"Content-Type": "application/octet-stream"})
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except OSError as e:
+                status = type(e).__name__
+                conn.close()
+                conn = connect(host, port, sock)
+            with lock:
+                if status == 200:
+                    times.append((time.perf_counter() - t) * 1000)
+                else:
+                    errors[status] = errors.get(status, 0) + 1
+        conn.close()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        for _ in range(concurrency):
+            ex.submit(client)
+    wall = time.perf_counter() - t0
+    times.sort()
+    q = lambda p: times[min(len(times) - 1, int(len(times) * p))] if times else 0.0
+    return {"rps": len(times) / wall, "p50_ms": q(0.5), "p95_ms": q(0.95), "p99_ms": q(0.99),
+            "ok": len(times), "errors": errors}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Сервис инференса ONNX с микро-батчами")
+    p.add_argument("--model", default=infer.MODEL, help="ONNX (python main.py export [--int8])")
+    p.add_argument("--host", default=HOST)
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--socket", default=None, help="Unix-сокет вместо TCP")
+    p.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    p.add_argument("--max-wait-ms", type=float, default=MAX_WAIT * 1000,
+                   help="сколько первый запрос ждёт, пока батч наберётся")
+    p.add_argument("--queue", type=int, default=QUEUE, help="очередь на инференс; сверх — 503")
+    p.add_argument("--threads", type=int, default=0, help="intra-op потоки onnxruntime (0 — по ядрам)")
+    p.add_argument("--workers", type=int, default=1, help="потоков батчей на одну сессию")
+    p.add_argument("--load", metavar="DIR", default=None,
+                   help="не сервер, а нагрузка: слать картинки из DIR в запущенный сервис")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--requests", type=int, default=200)
+    args = p.parse_args()
+
+    if args.load:
+        paths = [os.path.join(args.load, f) for f in sorted(os.listdir(args.load))
+                 if f.lower().endswith(infer.IMAGE_EXTS)]
+        if not paths:
+            sys.exit(f"Нет картинок в {args.load}")
+        for c in sorted({1, args.concurrency}):
+            r = load(paths, c, args.requests, args.host, args.port, args.socket)
+            print(f"  клиентов {c:3d}: {r['rps']:6.1f} запр/с  p50 {r['p50_ms']:6.1f}  "
+                  f"p95 {r['p95_ms']:6.1f}  p99 {r['p99_ms']:6.1f} мс"
+                  + (f"  ошибки {r['errors']}" if r["errors"] else ""))
+        return
+
+    print("=" * 55)
+    print("  СЕРВИС ИНФЕРЕНСА")
+    print("=" * 55)
+    if not os.path.exists(args.model):
+        sys.exit(f"Нет модели {args.model}\nСначала: python main.py export")
+    serve(args.model, args.host, args.port, args.socket, args.max_batch,
+          args.max_wait_ms / 1000, args.queue, args.threads, args.workers)
+
+
+if __name__ == "__main__":
+    main()
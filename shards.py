@@ -0,0 +1,320 @@
+"""
+Упакованный датасет: несколько больших файлов вместо десятков тысяч мелких.
+
+    python shards.py pack augmented_dataset packed/augmented
+    python shards.py pack generated_dataset packed/generated
+    python shards.py unpack packed/augmented restored_dataset
+    python shards.py info packed/augmented
+
+Формат (папка):
+    shard-00000.bin ...  — байты картинок и лейблов подряд, как есть
+                           (JPEG/PNG не перекодируются), до SHARD_MB на шард
+    index.npy            — таблица смещений: шард, смещение/длина картинки,
+                           смещение/длина лейбла (по строке на сэмпл)
+    keys.txt             — относительный путь картинки на строку
+                           ("images/x.jpg", "damaged_seat/x.png")
+    meta.json            — число сэмплов, шардов, classes.txt
+
+Чтение — mmap шардов: ShardReader.image(i) отдаёт memoryview прямо в
+страницы файла без копирования, а открытие датасета — чтение index.npy и
+keys.txt, т.е. миллисекунды даже на 100k сэмплов и сетевой ФС. Лейбл
+сэмпла — labels/<stem>.txt рядом с картинкой в исходной раскладке.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+
+import numpy as np
+
+SHARD_MB = 512
+FORMAT = 1
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+INDEX_DTYPE = np.dtype([
+    ("shard", "<u4"),
+    ("img_off", "<u8"), ("img_len", "<u4"),
+    ("lbl_off", "<u8"), ("lbl_len", "<u4"),
+    ("has_lbl", "<u1"),
+])
+
+
+def _shard_name(n: int) -> str:
+    return f"shard-{n:05d}.bin"
+
+
+# ──────────────────────────────────────────────────────────
+#  Запись
+# ──────────────────────────────────────────────────────────
+class ShardWriter:
+    """
+    Пишет сэмплы подряд в шарды. Индекс, keys.txt и meta.json появляются
+    при close() (атомарно), так что недописанный датасет не открывается.
+    """
+
+    def __init__(self, root: str, shard_mb: float = SHARD_MB, classes: str = ""):
+        self.root = root
+        self.shard_bytes = int(shard_mb * 1024 * 1024)
+        self.classes = classes
+        self.keys = []
+        self.rows = []
+        self._shard = -1
+        self._fh = None
+        self._pos = 0
+        os.makedirs(root, exist_ok=True)
+        # Перепаковка поверх старого датасета: сначала убираем индекс, иначе
+        # прерванная запись открылась бы со старым индексом и обрезанными шардами
+        for name in ("index.npy", "keys.txt", "meta.json"):
+            if os.path.exists(os.path.join(root, name)):
+                os.remove(os.path.join(root, name))
+        self._next_shard()
+
+    @property
+    def shards(self) -> int:
+        return self._shard + 1
+
+    def _next_shard(self):
+        if self._fh is not None:
+            self._fh.close()
+        self._shard += 1
+        self._fh = open(os.path.join(self.root, _shard_name(self._shard)), "wb")
+        self._pos = 0
+
+    def add(self, key: str, image: bytes, label: str = None):
+        """label — текст YOLO-лейбла; None — лейбла нет (не путать с пустым)."""
+        lbl = label.encode("utf-8") if label is not None else b""
+        if self._pos and self._pos + len(image) + len(lbl) > self.shard_bytes:
+            self._next_shard()
+        img_off = self._pos
+        self._fh.write(image)
+        self._fh.write(lbl)
+        self._pos += len(image) + len(lbl)
+        self.keys.append(key)
+        self.rows.append((self._shard, img_off, len(image), img_off + len(image), len(lbl),
+                          label is not None))
+
+    def close(self):
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+        index = np.array(self.rows, dtype=INDEX_DTYPE)
+        # index.npy пишем последним: по нему читатель понимает, что датасет целый
+        with open(os.path.join(self.root, "keys.txt.tmp"), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.keys) + ("\n" if self.keys else ""))
+        os.replace(os.path.join(self.root, "keys.txt.tmp"), os.path.join(self.root, "keys.txt"))
+        meta = {"format": FORMAT, "count": len(self.keys),
+                "shards": self.shards, "classes": self.classes}
+        with open(os.path.join(self.root, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(self.root, "index.npy.tmp"), "wb") as f:
+            np.save(f, index)
+        os.replace(os.path.join(self.root, "index.npy.tmp"), os.path.join(self.root, "index.npy"))
+
+    def abort(self):
+        """Запись сорвалась: индекс не пишется, начатые шарды удаляются."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        for n in range(self.shards):
+            path = os.path.join(self.root, _shard_name(n))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# ──────────────────────────────────────────────────────────
+#  Чтение
+# ──────────────────────────────────────────────────────────
+class ShardReader:
+    def __init__(self, root: str):
+        self.root = root
+        index_path = os.path.join(root, "index.npy")
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f"{root}: нет index.npy — датасет не упакован или не дописан")
+        with open(os.path.join(root, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT:
+            raise ValueError(f"{root}: неизвестная версия формата {self.meta.get('format')}")
+        self.index = np.load(index_path, mmap_mode="r")
+        with open(os.path.join(root, "keys.txt"), encoding="utf-8") as f:
+            self.keys = f.read().splitlines()
+        self._maps = {}
+        self._pos = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def classes(self) -> str:
+        return self.meta.get("classes", "")
+
+    def _map(self, shard: int):
+        m = self._maps.get(shard)
+        if m is None:
+            with open(os.path.join(self.root, _shard_name(shard)), "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+            m = memoryview(m)
+            self._maps[shard] = m
+        return m
+
+    def find(self, key: str) -> int:
+        if self._pos is None:
+            self._pos = {k: i for i, k in enumerate(self.keys)}
+        return self._pos[key]
+
+    def image(self, i: int) -> memoryview:
+        """Закодированные байты картинки — memoryview без копирования."""
+        r = self.index[i]
+        off = int(r["img_off"])
+        return self._map(int(r["shard"]))[off:off + int(r["img_len"])]
+
+    def label(self, i: int):
+        """Текст лейбла или None, если у сэмпла его не было."""
+        r = self.index[i]
+        if not r["has_lbl"]:
+            return None
+        off = int(r["lbl_off"])
+        return bytes(self._map(int(r["shard"]))[off:off + int(r["lbl_len"])]).decode("utf-8")
+
+    def __iter__(self):
+        for i, key in enumerate(self.keys):
+            yield key, self.image(i), self.label(i)
+
+    def close(self):
+        for m in self._maps.values():
+            obj = m.obj
+            try:
+                m.release()
+                if isinstance(obj, mmap.mmap):
+                    obj.close()
+            except BufferError:
+                pass    # снаружи ещё держат срезы — mmap закроется сборщиком
+        self._maps = {}
+
+    def abort(self):
+        """Запись сорвалась: индекс не пишется, начатые шарды удаляются."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        for n in range(self.shards):
+            path = os.path.join(self.root, _shard_name(n))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# ──────────────────────────────────────────────────────────
+#  Конвертер папка ↔ шарды
+# ──────────────────────────────────────────────────────────
+def scan_dir(src: str):
+    """
+    [(ключ, путь картинки, путь лейбла | None)] для раскладки augmented
+    (images/ + labels/) или generated (damaged_*/ + labels/).
+    """
+    labels = os.path.join(src, "labels")
+    dirs = ["images"] if os.path.isdir(os.path.join(src, "images")) else sorted(
+        d for d in os.listdir(src)
+        if os.path.isdir(os.path.join(src, d)) and d.startswith("damaged_"))
+    items = []
+    for d in dirs:
+        for fname in sorted(os.listdir(os.path.join(src, d))):
+            if fname.lower().endswith(IMAGE_EXTS):
+                lbl = os.path.join(labels, os.path.splitext(fname)[0] + ".txt")
+                items.append((f"{d}/{fname}", os.path.join(src, d, fname),
+                              lbl if os.path.exists(lbl) else None))
+    return items
+
+
+def pack(src: str, dst: str, shard_mb: float = SHARD_MB):
+    classes = ""
+    cls_path = os.path.join(src, "classes.txt")
+    if os.path.exists(cls_path):
+        with open(cls_path, encoding="utf-8") as f:
+            classes = f.read()
+    items = scan_dir(src)
+    with ShardWriter(dst, shard_mb, classes) as w:
+        for key, img_path, lbl_path in items:
+            with open(img_path, "rb") as f:
+                data = f.read()
+            label = None
+            if lbl_path:
+                with open(lbl_path, encoding="utf-8") as f:
+                    label = f.read()
+            w.add(key, data, label)
+    return len(items)
+
+
+def unpack(src: str, dst: str):
+    with ShardReader(src) as r:
+        os.makedirs(os.path.join(dst, "labels"), exist_ok=True)
+        for key, data, label in r:
+            path = os.path.join(dst, *key.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            if label is None:
+                continue
+            stem = os.path.splitext(os.path.basename(key))[0]
+            with open(os.path.join(dst, "labels", f"{stem}.txt"), "w", encoding="utf-8") as f:
+                f.write(label)
+        if r.classes:
+            with open(os.path.join(dst, "classes.txt"), "w", encoding="utf-8") as f:
+                f.write(r.classes)
+        return len(r)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Упакованный датасет: папка ↔ шарды")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    a = sub.add_parser("pack", help="папка → шарды")
+    a.add_argument("src")
+    a.add_argument("dst")
+    a.add_argument("--shard-mb", type=float, default=SHARD_MB)
+    a = sub.add_parser("unpack", help="шарды → папка")
+    a.add_argument("src")
+    a.add_argument("dst")
+    a = sub.add_parser("info", help="сводка и время открытия")
+    a.add_argument("src")
+    args = p.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "pack":
+        if not os.path.isdir(args.src):
+            sys.exit(f"Нет папки {args.src}")
+        n = pack(args.src, args.dst, args.shard_mb)
+        print(f"  Упаковано: {n} сэмплов → {args.dst}  ({time.perf_counter() - t0:.1f}с)")
+    elif args.cmd == "unpack":
+        n = unpack(args.src, args.dst)
+        print(f"  Распаковано: {n} сэмплов → {args.dst}  ({time.perf_counter() - t0:.1f}с)")
+    else:
+        with ShardReader(args.src) as r:
+            opened = time.perf_counter() - t0
+            size = sum(os.path.getsize(os.path.join(args.src, _shard_name(s)))
+                       for s in range(r.meta["shards"]))
+            print(f"  {args.src}")
+            print(f"    Сэмплов:  {len(r)}")
+            print(f"    Шардов:   {r.meta['shards']}  ({size / 1024 / 1024:.1f} МБ)")
+            print(f"    Открытие: {opened * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Телеметрия генерации: поток событий (JSONL) и агрегированные метрики.
+
+События — по строке JSON на каждый запрос к бэкенду, ожидание лимита,
+попадание в кэш, битую/пустую картинку, запрос баланса:
+    {"ts": 1718000000.123, "event": "request", "backend": "gpt-image",
+     "status": "rate_limited", "seconds": 0.41, "backoff": 20, ...}
+
+Метрики — счётчики и гистограммы задержек (p50/p95/p99) с метками;
+render() отдаёт их в текстовом формате Prometheus: в файл (node_exporter
+textfile collector) и/или по HTTP (/metrics, serve()).
+
+    python telemetry.py generated_dataset/telemetry.jsonl   # сводка по журналу событий
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "metro_gen"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW = 300        # с — окно для скорости и ETA
+
+HELP = {
+    "requests_total": "Запросы к бэкендам по статусу",
+    "retries_total": "Повторы запроса на другом бэкенде",
+    "backoff_seconds_total": "Назначенная пауза после 429",
+    "cost_dollars_total": "Потрачено, $",
+    "images_total": "Картинки по исходу (ok, cache, empty, bad, ...)",
+    "request_seconds": "Время HTTP-запроса к бэкенду",
+    "slot_wait_seconds": "Ожидание свободного бэкенда (concurrency, cooldown)",
+    "ratelimit_wait_seconds": "Ожидание токена (token bucket)",
+    "image_seconds": "Полное время получения картинки",
+    "balance_seconds": "Запрос баланса",
+    # serve.py
+    "detect_total": "Запросы /detect по HTTP-статусу",
+    "batches_total": "Выполненные микро-батчи",
+    "batch_images_total": "Картинок в микро-батчах (÷ batches_total = средний батч)",
+    "queue_depth": "Запросов в очереди на инференс",
+    "detect_seconds": "Полное время запроса /detect",
+    "queue_seconds": "Ожидание в очереди до батча",
+    "infer_seconds": "Прогон батча через onnxruntime",
+}
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def percentile(values, q: float):
+    """Квантиль по отсортированному списку (линейная интерполяция)."""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class Histogram:
+    """
+    Бакеты Prometheus + значения для точных квантилей: все или последние
+    keep (долгоживущий процесс — квантили по свежему окну, память не растёт).
+    """
+
+    def __init__(self, keep: int = None):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.values = []
+        self.recent = deque(maxlen=keep) if keep else None
+        self.n = 0
+        self.sum = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(BUCKETS, v)] += 1
+        if self.recent is not None and len(self.recent) == self.recent.maxlen:
+            del self.values[bisect.bisect_left(self.values, self.recent[0])]
+        if self.recent is not None:
+            self.recent.append(v)
+        bisect.insort(self.values, v)
+        self.n += 1
+        self.sum += v
+
+    def quantile(self, q: float):
+        return percentile(self.values, q)
+
+
+class Telemetry:
+    """
+    events — путь JSONL (дописывается) или None; metrics — файл для
+    Prometheus-текста (перезаписывается в flush()) или None; prefix —
+    префикс имён метрик; keep — сколько последних значений гистограммы
+    хранить для квантилей (None — все). Все методы потокобезопасны.
+    """
+
+    def __init__(self, events: str = None, metrics: str = None, prefix: str = PREFIX,
+                 keep: int = None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.hists = {}
+        self.prefix = prefix
+        self.keep = keep
+        self.metrics_path = metrics
+        self.done_times = []        # моменты готовых картинок — для скорости
+        self.t0 = time.time()
+        self._fh = None
+        if events:
+            os.makedirs(os.path.dirname(os.path.abspath(events)), exist_ok=True)
+            self._fh = open(events, "a", encoding="utf-8", buffering=1)
+        self._server = None
+
+    # ── Запись ────────────────────────────────────────────
+    def event(self, kind: str, **fields):
+        if self._fh is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": kind, **fields},
+                          ensure_ascii=False, default=str)
+        with self.lock:
+            self._fh.write(line + "\n")
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = Histogram(self.keep)
+            h.observe(seconds)
+
+    def gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    # ── Типовые записи (их же повторяет replay) ───────────
+    def request(self, backend: str, status: str, seconds: float, cost: float = 0.0,
+                attempt: int = 1, backoff: float = 0.0, note: str = ""):
+        """Один HTTP-запрос к бэкенду (OK, empty, rate_limited, timeout, ...)."""
+        self.inc("requests_total", backend=backend, status=status)
+        self.observe("request_seconds", seconds, backend=backend)
+        if cost:
+            self.inc("cost_dollars_total", cost, backend=backend)
+        if attempt > 1:
+            self.inc("retries_total", backend=backend)
+        if backoff:
+            self.inc("backoff_seconds_total", backoff, backend=backend)
+        self.event("request", backend=backend, status=status, seconds=round(seconds, 4),
+                   cost=cost, attempt=attempt, backoff=backoff, note=note)
+
+    def wait(self, kind: str, seconds: float, backend: str = ""):
+        """Ожидание до запроса: slot_wait (свободный бэкенд) или ratelimit_wait (токен)."""
+        self.observe(f"{kind}_seconds", seconds, backend=backend)
+        self.event(kind, backend=backend, seconds=round(seconds, 4))
+
+    def image(self, outcome: str, seconds: float, cost: float = 0.0, backend: str = ""):
+        """Итог generate_image: ok, cache, empty, bad, no_money, skipped, failed."""
+        self.inc("images_total", outcome=outcome)
+        self.observe("image_seconds", seconds, outcome=outcome)
+        if outcome in ("ok", "cache"):
+            with self.lock:
+                self.done_times.append(time.monotonic())
+        self.event("image", outcome=outcome, seconds=round(seconds, 4), cost=cost, backend=backend)
+
+    def balance(self, status: str, seconds: float, **fields):
+        self.observe("balance_seconds", seconds, status=status)
+        self.event("balance", status=status, seconds=round(seconds, 4), **fields)
+
+    # ── Запросы ───────────────────────────────────────────
+    def rate(self, window: float = WINDOW) -> float:
+        """Картинок в секунду за последние window секунд (0 — ещё нет данных)."""
+        now = time.monotonic()
+        with self.lock:
+            recent = [t for t in self.done_times if now - t <= window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / max(now - recent[0], 1e-9)
+
+    def eta(self, remaining: int, window: float = WINDOW):
+        """Секунд до конца по текущей скорости или None."""
+        r = self.rate(window)
+        return remaining / r if r > 0 else None
+
+    def counter(self, name: str, **labels) -> float:
+        """Сумма счётчика по всем меткам, совпадающим с labels."""
+        want = set(labels.items())
+        with self.lock:
+            return sum(v for (n, lb), v in self.counters.items() if n == name and want <= set(lb))
+
+    # ── Prometheus ────────────────────────────────────────
+    def render(self) -> str:
+        out = []
+        with self.lock:
+            scalars = ([(k, v, "counter") for k, v in sorted(self.counters.items())]
+                       + [(k, v, "gauge") for k, v in sorted(self.gauges.items())])
+            hists = sorted(self.hists.items())
+            typed = set()
+            for (name, labels), v, kind in scalars:
+                full = f"{self.prefix}_{name}"
+                if full not in typed:
+                    typed.add(full)
+                    out.append(f"# HELP {full} {HELP.get(name, name)}")
+                    out.append(f"# TYPE {full} {kind}")
+                out.append(f"{full}{_labels(dict(labels))} {v:g}")
+            for (name, labels), h in hists:
+                full = f"{self.prefix}_{name}"
+                labels = dict(labels)
+                if full not in typed:
+                    typed.add(full)
+                    out.append(f"# HELP {full} {HELP.get(name, name)}")
+                    out.append(f"# TYPE {full} histogram")
+                acc = 0
+                for le, c in zip(BUCKETS + ("+Inf",), h.counts):
+                    acc += c
+                    out.append(f"{full}_bucket{_labels({**labels, 'le': le})} {acc}")
+                out.append(f"{full}_sum{_labels(labels)} {h.sum:.6f}")
+                out.append(f"{full}_count{_labels(labels)} {h.n}")
+            # Точные квантили — отдельным семейством (гистограмма их не хранит)
+            for (name, labels), h in hists:
+                full = f"{self.prefix}_{name}_quantile"
+                if full not in typed:
+                    typed.add(full)
+                    out.append(f"# TYPE {full} gauge")
+                for q in QUANTILES:
+                    out.append(f"{full}{_labels({**dict(labels), 'quantile': q})} {h.quantile(q):.6f}")
+        return "\n".join(out) + "\n"
+
+    def flush(self):
+        """Метрики в файл (атомарно) — для textfile collector."""
+        if not self.metrics_path:
+            return
+        tmp = self.metrics_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, self.metrics_path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """GET /metrics в фоне на время генерации."""
+        tel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tel.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    # ── Сводка ────────────────────────────────────────────
+    def report(self):
+        """Строки: задержки по бэкендам и куда ушло время."""
+        def row(name, labels, h):
+            q = [h.quantile(x) for x in QUANTILES]
+            tag = ",".join(f"{v}" for _, v in labels) or "—"
+            return (f"  {name:16s} {tag:24s} {h.n:6d} "
+                    + " ".join(f"{v:7.2f}" for v in q) + f" {h.sum:9.1f}")
+
+        lines = [f"  {'Метрика':16s} {'метки':24s} {'n':>6s} {'p50':>7s} {'p95':>7s} "
+                 f"{'p99':>7s} {'Σ, с':>9s}"]
+        with self.lock:
+            for (name, labels), h in sorted(self.hists.items()):
+                lines.append(row(name.replace("_seconds", ""), labels, h))
+        backoff = self.counter("backoff_seconds_total")
+        retries = self.counter("retries_total")
+        wall = time.time() - self.t0
+        lines.append(f"  Пауз после 429: {backoff:.0f}с, повторов: {retries:.0f}, "
+                     f"скорость: {self.rate() * 60:.1f} карт/мин, всего {wall:.0f}с")
+        return lines
+
+
+def replay(path: str) -> Telemetry:
+    """Метрики по уже записанному журналу событий."""
+    tel = Telemetry()
+    record = {"request": tel.request, "image": tel.image, "balance": tel.balance,
+              "slot_wait": lambda **e: tel.wait("slot_wait", **e),
+              "ratelimit_wait": lambda **e: tel.wait("ratelimit_wait", **e)}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            e.pop("ts", None)
+            fn = record.get(e.pop("event", None))
+            if fn is not None:
+                fn(**e)
+    return tel
+
+
+def main():
+    p = argparse.ArgumentParser(description="Сводка по журналу телеметрии генерации")
+    p.add_argument("events", help="telemetry.jsonl")
+    p.add_argument("--prom", action="store_true", help="вывести метрики в формате Prometheus")
+    args = p.parse_args()
+    if not os.path.exists(args.events):
+        sys.exit(f"Нет файла {args.events}")
+    tel = replay(args.events)
+    if args.prom:
+        sys.stdout.write(tel.render())
+        return
+    for line in tel.report()[:-1]:
+        print(line)
+    print(f"  Пауз после 429: {tel.counter('backoff_seconds_total'):.0f}с, "
+          f"повторов: {tel.counter('retries_total'):.0f}, "
+          f"потрачено ${tel.counter('cost_dollars_total'):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Инференс по тайлам для фото высокого разрешения.
+
+    python tiles.py raw_images/                       # все фото, вывод детекций
+    python tiles.py car.jpg --save tiles_out/         # + картинка с боксами
+    python tiles.py car.jpg --tile 960 --overlap 0.25 --merge nms --no-full
+
+Целиком ужатое до 640 фото 4000×3000 теряет мелкие дефекты: прожог или
+ржавый винт становится парой пикселей. Здесь фото режется на
+перекрывающиеся тайлы TILE×TILE (в пикселях исходника, по умолчанию =
+imgsz модели — без масштабирования), тайлы идут через одну сессию
+батчами по BATCH, батчи раскладываются по пулу потоков. Опционально
+(по умолчанию включено) добавляется проход по всему кадру — крупные
+повреждения, которые не помещаются в тайл.
+
+Детекции тайлов переводятся в координаты фото и склеиваются:
+    fuse — объект, разрезанный швом, собирается в один бокс: боксы
+           одного класса сопоставимого размера, перекрывающие не меньше
+           MATCH площади меньшего (IoS), объединяются;
+    nms  — обычный NMS по классам между всеми тайлами.
+
+Время на фото ограничено: если тайлов выходит больше MAX_TILES, тайл
+увеличивается (и уменьшается до imgsz при прогоне).
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import infer
+
+OVERLAP = 0.2           # доля перекрытия соседних тайлов
+BATCH = 8               # тайлов в одном прогоне
+MAX_TILES = 64          # больше — тайл укрупняется
+MATCH = 0.5             # IoS для склейки разрезанного объекта (fuse)
+MAX_RATIO = 4.0         # склеиваются только боксы сопоставимой площади
+MERGES = ("fuse", "nms")
+
+
+# ──────────────────────────────────────────────────────────
+#  Сетка
+# ──────────────────────────────────────────────────────────
+def grid(w: int, h: int, tile: int, overlap: float = OVERLAP):
+    """Окна (x0, y0, x1, y1) с перекрытием; крайние прижаты к краю кадра."""
+    step = max(1, int(tile * (1 - overlap)))
+
+    def starts(n):
+        if n <= tile:
+            return [0]
+        s = list(range(0, n - tile, step))
+        return s + [n - tile]
+
+    return [(x, y, min(x + tile, w), min(y + tile, h)) for y in starts(h) for x in starts(w)]
+
+
+def plan(w: int, h: int, tile: int, overlap: float = OVERLAP, max_tiles: int = MAX_TILES):
+    """Сетка не больше max_tiles окон: при необходимости тайл растёт."""
+    windows = grid(w, h, tile, overlap)
+    while len(windows) > max_tiles:
+        tile = int(tile * 1.25)
+        windows = grid(w, h, tile, overlap)
+    return tile, windows
+
+
+# ──────────────────────────────────────────────────────────
+#  Склейка
+# ──────────────────────────────────────────────────────────
+def fuse(dets: np.ndarray, match: float = MATCH) -> np.ndarray:
+    """
+    Жадно по убыванию conf: бокс поглощает боксы того же класса, которые
+    лежат внутри него на ≥ match своей площади (или он внутри них) и не
+    отличаются по площади больше MAX_RATIO раз. Итог — объединение боксов,
+    conf — максимальный.
+    """
+    dets = dets[dets[:, 4].argsort()[::-1]]
+    area = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    used = np.zeros(len(dets), dtype=bool)
+    out = []
+    for i in range(len(dets)):
+        if used[i]:
+            continue
+        used[i] = True
+        d = dets[i].copy()
+        rest = np.nonzero(~used & (dets[:, 5] == d[5]))[0]
+        if len(rest):
+            iw = np.clip(np.minimum(d[2], dets[rest, 2]) - np.maximum(d[0], dets[rest, 0]), 0, None)
+            ih = np.clip(np.minimum(d[3], dets[rest, 3]) - np.maximum(d[1], dets[rest, 1]), 0, None)
+            small = np.minimum(area[i], area[rest])
+            ratio = np.maximum(area[i], area[rest]) / np.maximum(small, 1e-9)
+            members = rest[(iw * ih / np.maximum(small, 1e-9) >= match) & (ratio <= MAX_RATIO)]
+            if len(members):
+                d[0:2] = np.minimum(d[0:2], dets[members, 0:2].min(0))
+                d[2:4] = np.maximum(d[2:4], dets[members, 2:4].max(0))
+                used[members] = True
+        out.append(d)
+    return np.stack(out)
+
+
+def merge(dets: np.ndarray, how: str = "fuse", iou: float = infer.IOU) -> np.ndarray:
+    if len(dets) == 0:
+        return dets
+    if how == "nms":
+        keep = infer.nms(dets[:, :4] + dets[:, 5:6] * infer.MAX_WH, dets[:, 4], iou)
+        return dets[keep]
+    # Сначала NMS убирает точные дубли из перекрытий, потом склейка по швам
+    keep = infer.nms(dets[:, :4] + dets[:, 5:6] * infer.MAX_WH, dets[:, 4], iou)
+    return fuse(dets[keep])
+
+
+# ──────────────────────────────────────────────────────────
+#  Прогон
+# ──────────────────────────────────────────────────────────
+class Tiler:
+    """
+    Модель + пул потоков. workers батчей считаются одновременно (у каждого
+    прогона threads intra-op потоков), так что фото из N тайлов занимает
+    ≈ N / (BATCH · workers) прогонов, а не N.
+    """
+
+    def __init__(self, model: infer.Model, tile: int = None, overlap: float = OVERLAP,
+                 full: bool = True, merge_how: str = "fuse", batch: int = BATCH,
+                 workers: int = 2, max_tiles: int = MAX_TILES):
+        self.model = model
+        self.tile = tile or model.imgsz
+        self.overlap = overlap
+        self.full = full
+        self.merge = merge_how
+        self.batch = batch
+        self.max_tiles = max_tiles
+        self.pool = ThreadPoolExecutor(max(1, workers))
+
+    def _run(self, img, windows, conf, iou):
+        """Окна → детекции в координатах фото (окно None — весь кадр)."""
+        xs, frames = [], []
+        for win in windows:
+            x, frame = infer.preprocess(img if win is None else img.crop(win), self.model.imgsz)
+            xs.append(x)
+            frames.append(frame)
+        out = self.model.run(np.stack(xs))
+        dets = []
+        for pred, frame, win in zip(out, frames, windows):
+            d = infer.unletterbox(infer.decode(pred, conf, iou), frame)
+            if win is not None:
+                d[:, [0, 2]] += win[0]
+                d[:, [1, 3]] += win[1]
+            dets.append(d)
+        return np.concatenate(dets) if dets else np.zeros((0, 6), dtype=np.float32)
+
+    def detect(self, img, conf: float = infer.CONF, iou: float = infer.IOU):
+        """PIL-картинка → (детекции (k, 6) в пикселях фото, число тайлов)."""
+        img = img.convert("RGB")
+        _, windows = plan(*img.size, self.tile, self.overlap, self.max_tiles)
+        jobs = [windows[i:i + self.batch] for i in range(0, len(windows), self.batch)]
+        if self.full and len(windows) > 1:
+            jobs.append([None])
+        parts = list(self.pool.map(lambda w: self._run(img, w, conf, iou), jobs))
+        return merge(np.concatenate(parts), self.merge, iou), len(windows)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def draw(img, dets: np.ndarray, names: dict):
+    img = img.convert("RGB")
+    d = ImageDraw.Draw(img)
+    for x1, y1, x2, y2, s, c in dets:
+        d.rectangle([x1, y1, x2, y2], outline=(255, 0, 0), width=3)
+        d.text((x1 + 3, y1 + 3), f"{names.get(int(c), int(c))} {s:.2f}", fill=(255, 0, 0))
+    return img
+
+
+def main():
+    p = argparse.ArgumentParser(description="Детекция мелких дефектов на больших фото по тайлам")
+    p.add_argument("source", help="фото или папка")
+    p.add_argument("--model", default=infer.MODEL, help="ONNX (python main.py export)")
+    p.add_argument("--tile", type=int, default=None, help="размер тайла в пикселях фото (по умолчанию imgsz)")
+    p.add_argument("--overlap", type=float, default=OVERLAP)
+    p.add_argument("--merge", choices=MERGES, default="fuse")
+    p.add_argument("--no-full", action="store_true", help="без прохода по всему кадру")
+    p.add_argument("--conf", type=float, default=infer.CONF)
+    p.add_argument("--batch", type=int, default=BATCH, help="тайлов в одном прогоне")
+    p.add_argument("--workers", type=int, default=2, help="прогонов одновременно")
+    p.add_argument("--threads", type=int, default=0, help="intra-op потоки на прогон (0 — ядра / workers)")
+    p.add_argument("--max-tiles", type=int, default=MAX_TILES)
+    p.add_argument("--save", default=None, help="папка для картинок с боксами")
+    args = p.parse_args()
+
+    if not os.path.exists(args.model):
+        sys.exit(f"Нет модели {args.model}\nСначала: python main.py export")
+    if os.path.isdir(args.source):
+        paths = [os.path.join(args.source, f) for f in sorted(os.listdir(args.source))
+                 if f.lower().endswith(infer.IMAGE_EXTS)]
+    else:
+        paths = [args.source]
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    model = infer.Model(args.model, threads=threads)
+    tiler = Tiler(model, args.tile, args.overlap, not args.no_full, args.merge, args.batch,
+                  args.workers, args.max_tiles)
+
+    print("=" * 55)
+    print("  ДЕТЕКЦИЯ ПО ТАЙЛАМ")
+    print("=" * 55)
+    times = []
+    for path in paths:
+        with Image.open(path) as img:
+            t = time.perf_counter()
+            dets, n = tiler.detect(img, args.conf)
+            times.append(time.perf_counter() - t)
+            print(f"  {os.path.basename(path):30s} {img.size[0]}×{img.size[1]}  тайлов {n:3d}  "
+                  f"детекций {len(dets):3d}  {times[-1] * 1000:6.0f} мс")
+            for x1, y1, x2, y2, s, c in dets:
+                print(f"      {model.names.get(int(c), int(c)):16s} {s:.2f}  "
+                      f"[{x1:.0f}, {y1:.0f}, {x2:.0f}, {y2:.0f}]")
+            if args.save:
+                draw(img, dets, model.names).save(
+                    os.path.join(args.save, os.path.splitext(os.path.basename(path))[0] + ".jpg"),
+                    quality=90)
+    tiler.close()
+    if times:
+        times.sort()
+        print(f"\n  Фото: {len(times)}, p50 {times[len(times) // 2] * 1000:.0f} мс, "
+              f"макс {times[-1] * 1000:.0f} мс")
+    print(f"{'=' * 55}")
+
+
+if __name__ == "__main__":
+    main()
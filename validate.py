@@ -0,0 +1,356 @@
+"""
+Проверка датасета перед обучением.
+
+    python validate.py                       # dataset_yolo/ по data.yaml — отчёт
+    python validate.py --quarantine          # плохие сэмплы убрать в dataset_yolo/quarantine/
+    python validate.py --dir augmented_dataset   # любая папка (images/ или damaged_*/ + labels/)
+
+Для каждого сэмпла: картинка декодируется целиком (обрезанный JPEG/PNG),
+размер не меньше MIN_SIZE, лейбл есть, в каждой строке 5 чисел, класс из
+names, бокс ненулевой и внутри кадра. Проверка идёт в нескольких
+процессах, результат кэшируется в validate_cache.sqlite по (размер, mtime)
+картинки и лейбла — повторная проверка неизменённого датасета сводится к
+stat() файлов. main.py train запускает её с карантином перед обучением.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from multiprocessing import Pool, cpu_count
+
+from PIL import Image
+
+import shards
+import catalog
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUT_DIR = os.path.join(BASE_DIR, "dataset_yolo")
+CACHE_FILE = os.path.join(BASE_DIR, "validate_cache.sqlite")
+QUARANTINE = "quarantine"
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+MIN_SIZE = 10       # px — меньше Ultralytics не принимает
+EPS = 1e-3          # допуск на округление координат (6 знаков в лейблах)
+
+
+# ──────────────────────────────────────────────────────────
+#  Проверка одного сэмпла (в процессе-воркере)
+# ──────────────────────────────────────────────────────────
+def check_image(path: str):
+    """(ширина, высота, [ошибки])."""
+    try:
+        with Image.open(path) as img:
+            fmt = img.format
+            img.load()          # полное декодирование: обрезанный файл → OSError
+            w, h = img.size
+    except Exception as e:
+        return None, None, [f"битая картинка ({e})"]
+    errors = []
+    if fmt == "JPEG":
+        with open(path, "rb") as f:
+            f.seek(-2, os.SEEK_END)
+            if f.read() != b"\xff\xd9":
+                errors.append("JPEG без маркера конца (обрезан)")
+    if min(w, h) < MIN_SIZE:
+        errors.append(f"маленькая картинка ({w}x{h})")
+    return w, h, errors
+
+
+def check_label(path: str, nc: int):
+    """[ошибки] для YOLO-лейбла; пустой файл — допустимый фон. nc=0 — классы не известны."""
+    if path is None or not os.path.exists(path):
+        return ["нет лейбла"]
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        return [f"лейбл не читается ({e})"]
+    errors = []
+    for n, line in enumerate(lines, 1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 5:
+            errors.append(f"не 5 полей (строка {n}: {len(parts)})")
+            continue
+        try:
+            cls_id = int(parts[0])
+            xc, yc, w, h = map(float, parts[1:])
+        except ValueError:
+            errors.append(f"не число (строка {n})")
+            continue
+        if cls_id < 0 or (nc and cls_id >= nc):
+            errors.append(f"класс вне 0..{nc - 1 if nc else '∞'} (строка {n}: {cls_id})")
+        if not (w > 0 and h > 0):
+            errors.append(f"пустой бокс (строка {n})")
+        elif (xc - w / 2 < -EPS or yc - h / 2 < -EPS
+              or xc + w / 2 > 1 + EPS or yc + h / 2 > 1 + EPS):
+            errors.append(f"бокс вне кадра (строка {n})")
+    return errors
+
+
+def check_sample(job):
+    img_path, lbl_path, nc = job
+    w, h, errors = check_image(img_path)
+    errors += check_label(lbl_path, nc)
+    return img_path, w, h, "; ".join(errors)
+
+
+# ──────────────────────────────────────────────────────────
+#  Кэш результатов
+# ──────────────────────────────────────────────────────────
+def file_sig(path):
+    """Отпечаток файла без чтения: размер и mtime (ns)."""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class CheckCache:
+    def __init__(self, path: str = CACHE_FILE):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS checks (
+                path    TEXT PRIMARY KEY,
+                img_sig TEXT NOT NULL,
+                lbl_sig TEXT NOT NULL,
+                nc      INTEGER NOT NULL,
+                width   INTEGER,
+                height  INTEGER,
+                error   TEXT NOT NULL       -- '' — сэмпл в порядке
+            )
+        """)
+        self.db.commit()
+        # Весь кэш в память одним запросом — на 100k строк это доли секунды
+        self.rows = {r[0]: r[1:] for r in self.db.execute(
+            "SELECT path, img_sig, lbl_sig, nc, width, height, error FROM checks")}
+
+    def get(self, path, img_sig, lbl_sig, nc):
+        r = self.rows.get(path)
+        if r and r[0] == img_sig and r[1] == lbl_sig and r[2] == nc:
+            return r[3], r[4], r[5]
+        return None
+
+    def put_many(self, rows):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO checks (path, img_sig, lbl_sig, nc, width, height, error)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# ──────────────────────────────────────────────────────────
+#  Откуда брать сэмплы
+# ──────────────────────────────────────────────────────────
+def read_data_yaml(path: str):
+    """({path, train, val, ...}, {id: имя}) из data.yaml в формате data.py (без PyYAML)."""
+    conf, names, in_names = {}, {}, False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            key, _, value = line.strip().partition(":")
+            if in_names and line[0] in " \t":
+                names[int(key)] = value.strip()
+                continue
+            in_names = key == "names" and not value.strip()
+            conf[key] = value.strip()
+    return conf, names
+
+
+def label_for(img_path: str) -> str:
+    """Путь лейбла по правилу Ultralytics: .../images/x.jpg → .../labels/x.txt."""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return os.path.splitext(sb.join(img_path.rsplit(sa, 1)))[0] + ".txt"
+
+
+def yolo_splits(root: str = OUT_DIR):
+    """
+    {split: [(картинка, лейбл)]}, {id: имя}, {split: файл списка | None}
+    для dataset_yolo/ — папки train/images или списки train.txt (data.py --link list).
+    """
+    yaml_path = os.path.join(root, "data.yaml")
+    if not os.path.exists(yaml_path):
+        sys.exit(f"Нет файла {yaml_path}\nСначала запустите data.py")
+    conf, names = read_data_yaml(yaml_path)
+    base = conf.get("path") or root
+    splits, lists = {}, {}
+    for split in ("train", "val"):
+        ref = os.path.join(base, conf.get(split, ""))
+        if ref.endswith(".txt"):
+            with open(ref, encoding="utf-8") as f:
+                images = [l.strip() if os.path.isabs(l.strip()) else os.path.join(base, l.strip())
+                          for l in f if l.strip()]
+            lists[split] = ref
+        else:
+            images = [os.path.join(ref, f) for f in sorted(os.listdir(ref))
+                      if f.lower().endswith(IMAGE_EXTS)] if os.path.isdir(ref) else []
+            lists[split] = None
+        splits[split] = [(p, label_for(p)) for p in images]
+    return splits, names, lists
+
+
+def dir_split(src: str):
+    """Папка в раскладке augmented/generated (shards.scan_dir) как один split."""
+    names = catalog.read_classes(os.path.join(src, "classes.txt"))
+    items = [(img, lbl or os.path.join(src, "labels", os.path.splitext(os.path.basename(img))[0] + ".txt"))
+             for _, img, lbl in shards.scan_dir(src)]
+    return {os.path.basename(os.path.normpath(src)): items}, names, {}
+
+
+# ──────────────────────────────────────────────────────────
+#  Проверка и карантин
+# ──────────────────────────────────────────────────────────
+def validate(splits, nc: int, workers: int = None, cache_path: str = CACHE_FILE):
+    """
+    {split: [(картинка, лейбл)]} → {split: [(картинка, лейбл, ошибка)]} —
+    только плохие сэмплы. Уже проверенные и не изменившиеся файлы берутся
+    из кэша. Возвращает (плохие, всего, проверено заново).
+    """
+    cache = CheckCache(cache_path)
+    results = {}
+    jobs, meta = [], {}
+    for split, items in splits.items():
+        for img, lbl in items:
+            key = os.path.abspath(img)
+            sigs = (file_sig(img), file_sig(lbl))
+            hit = cache.get(key, *sigs, nc)
+            if hit is not None:
+                results[key] = hit[2]
+            else:
+                meta[img] = (key, sigs)
+                jobs.append((img, lbl, nc))
+
+    fresh = []
+    if jobs:
+        workers = max(1, min(workers or cpu_count(), len(jobs)))
+        if workers == 1:
+            it = map(check_sample, jobs)
+            pool = None
+        else:
+            pool = Pool(workers)
+            it = pool.imap_unordered(check_sample, jobs, chunksize=16)
+        for img, w, h, error in it:
+            key, sigs = meta[img]
+            results[key] = error
+            fresh.append((key, *sigs, nc, w, h, error))
+        if pool is not None:
+            pool.close()
+            pool.join()
+        cache.put_many(fresh)
+    cache.close()
+
+    bad = {split: [(img, lbl, results[os.path.abspath(img)]) for img, lbl in items
+                   if results[os.path.abspath(img)]]
+           for split, items in splits.items()}
+    total = sum(len(items) for items in splits.values())
+    return bad, total, len(fresh)
+
+
+def label_cache(images) -> str:
+    """Куда Ultralytics пишет кэш разметки split: папка лейбла первой картинки + .cache."""
+    return os.path.dirname(label_for(images[0])) + ".cache" if images else None
+
+
+def quarantine(bad, lists, root: str, splits=None):
+    """
+    Убирает плохие сэмплы из обучения: из папок split — переносом в
+    <root>/quarantine/<split>/, из списков train.txt/val.txt — вычёркиванием
+    (исходные файлы не трогаются). Причины — в quarantine/report.tsv.
+    splits — полный состав split: по нему находится кэш Ultralytics (для
+    списков он лежит рядом с лейблами, например augmented_dataset/labels.cache).
+    """
+    qdir = os.path.join(root, QUARANTINE)
+    moved = 0
+    for split, items in bad.items():
+        if not items:
+            continue
+        caches = {os.path.join(root, split, "labels.cache"), os.path.join(root, f"{split}.cache"),
+                  label_cache([img for img, _ in (splits or {}).get(split, [])])}
+        if lists.get(split):
+            drop = {os.path.abspath(img) for img, _, _ in items}
+            with open(lists[split], encoding="utf-8") as f:
+                keep = [l for l in f if l.strip() and os.path.abspath(l.strip()) not in drop]
+            with open(lists[split], "w", encoding="utf-8") as f:
+                f.writelines(keep)
+        else:
+            for sub in ("images", "labels"):
+                os.makedirs(os.path.join(qdir, split, sub), exist_ok=True)
+            for img, lbl, _ in items:
+                os.replace(img, os.path.join(qdir, split, "images", os.path.basename(img)))
+                if lbl and os.path.lexists(lbl):
+                    os.replace(lbl, os.path.join(qdir, split, "labels", os.path.basename(lbl)))
+        moved += len(items)
+        # Кэш разметки Ultralytics устарел
+        for stale in caches:
+            if stale and os.path.exists(stale):
+                os.remove(stale)
+    os.makedirs(qdir, exist_ok=True)
+    with open(os.path.join(qdir, "report.tsv"), "a", encoding="utf-8") as f:
+        for split, items in bad.items():
+            for img, _, error in items:
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{split}\t{img}\t{error}\n")
+    return moved
+
+
+def run(root: str = OUT_DIR, src: str = None, quarantine_bad: bool = False,
+        workers: int = None, show: int = 10):
+    """Проверка + отчёт (+ карантин). Возвращает число плохих сэмплов."""
+    t0 = time.time()
+    splits, names, lists = dir_split(src) if src else yolo_splits(root)
+    nc = len(names)
+    bad, total, checked = validate(splits, nc, workers)
+    n_bad = sum(len(items) for items in bad.values())
+
+    print(f"\n  Проверено: {total} сэмплов ({checked} заново, остальное — кэш), "
+          f"{time.time() - t0:.1f}с")
+    for split, items in splits.items():
+        print(f"    {split:10s} {len(items):7d}   плохих: {len(bad[split])}")
+    if n_bad:
+        kinds = {}
+        for items in bad.values():
+            for _, _, error in items:
+                for e in error.split("; "):
+                    kind = e.split(" (")[0]
+                    kinds[kind] = kinds.get(kind, 0) + 1
+        print(f"\n  Проблемы:")
+        for kind, n in sorted(kinds.items(), key=lambda x: -x[1]):
+            print(f"    {kind:35s} {n:6d}")
+        shown = [x for items in bad.values() for x in items][:show]
+        for img, _, error in shown:
+            print(f"    ✗ {os.path.relpath(img, BASE_DIR)}: {error}")
+        if n_bad > len(shown):
+            print(f"    ... и ещё {n_bad - len(shown)}")
+        if quarantine_bad:
+            moved = quarantine(bad, lists, src or root, splits)
+            print(f"\n  В карантин: {moved}  ({os.path.join(src or root, QUARANTINE)}/report.tsv)")
+    return n_bad
+
+
+def main():
+    p = argparse.ArgumentParser(description="Проверка датасета (картинки и YOLO-лейблы)")
+    p.add_argument("--dir", metavar="DIR",
+                   help="проверить папку в раскладке augmented/generated вместо dataset_yolo/")
+    p.add_argument("--quarantine", action="store_true", help="убрать плохие сэмплы из обучения")
+    p.add_argument("--workers", type=int, default=cpu_count(), help="процессов")
+    p.add_argument("--show", type=int, default=10, help="сколько плохих сэмплов показать")
+    args = p.parse_args()
+
+    print("=" * 55)
+    print("  ПРОВЕРКА ДАТАСЕТА")
+    print("=" * 55)
+    n_bad = run(src=args.dir, quarantine_bad=args.quarantine, workers=args.workers, show=args.show)
+    print(f"\n{'='*55}")
+    print(f"  {'Всё в порядке' if not n_bad else f'Плохих сэмплов: {n_bad}'}")
+    print(f"{'='*55}")
+    sys.exit(1 if n_bad and not args.quarantine else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Инференс по видео с камер вагона: один дефект — одно событие, а не детекция на каждый кадр.
+
+    python video.py cam1.mp4                          # файл: события в cam1.events.jsonl
+    python video.py frames/ --fps 25                  # папка кадров
+    python video.py rtsp://10.0.0.5/stream --realtime # живой поток
+    python video.py cam1.mp4 --realtime --target-fps 8 --snapshots shots/
+
+Поток декодирования читает кадры и готовит тензоры (letterbox), пока
+основной поток считает модель (infer.py, onnxruntime) — очередь между
+ними короткая (QUEUE).
+
+Какие кадры считаются:
+    шаг     — берётся каждый stride-й кадр: fps источника / --target-fps,
+              а если модель не успевает — реже, по фактическому времени
+              кадра (скользящее среднее), чтобы не отставать от потока.
+              Пропущенные кадры только grab() — без конвертации.
+    сцена   — если кадр почти не изменился с последнего посчитанного
+              (средняя разница миниатюры < --motion), модель не
+              запускается, треки прошлого кадра продлеваются (но не
+              набирают попаданий). Раз в FORCE секунд кадр считается всё равно.
+    --realtime — источник отдаёт кадры со своей скоростью (как камера);
+              если обработка отстала, старые кадры из очереди выбрасываются.
+
+Детекции склеиваются в треки по IoU и классу, бокс сглаживается.
+Трек становится событием после MIN_HITS попаданий и закрывается, если
+его не видно TTL секунд. В журнал пишутся start и end с лучшим кадром,
+уверенностью и длительностью; --snapshots сохраняет лучший кадр с боксом.
+"""
+import os
+import sys
+import json
+import math
+import time
+import queue
+import argparse
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import infer
+
+FPS = 25                # для папки кадров, если --fps не задан
+TARGET_FPS = 5          # кадров модели на секунду видео (0 — все кадры)
+QUEUE = 4               # кадров между декодированием и моделью
+MOTION = 2.0            # порог изменения сцены (0..255); 0 — считать каждый взятый кадр
+THUMB = 10              # шаг прореживания тензора для миниатюры (640 → 64×64)
+FORCE = 2.0             # с — максимум без запуска модели на неподвижной сцене
+
+TRACK_IOU = 0.3         # IoU для продолжения трека
+MIN_HITS = 3            # попаданий до события
+TTL = 3.0               # с — трек закрывается, если его не видно
+ALPHA = 0.5             # сглаживание бокса (доля новой детекции)
+
+
+# ──────────────────────────────────────────────────────────
+#  Источник кадров
+# ──────────────────────────────────────────────────────────
+class Source:
+    """Видеофайл / поток (OpenCV) или папка кадров. grab() — следующий кадр, retrieve() — картинка."""
+
+    def __init__(self, src: str, fps: float = None):
+        self.src = src
+        self.cap = None
+        if os.path.isdir(src):
+            self.files = [os.path.join(src, f) for f in sorted(os.listdir(src))
+                          if f.lower().endswith(infer.IMAGE_EXTS)]
+            self.fps = fps or FPS
+            self.total = len(self.files)
+            self.i = -1
+            return
+        import cv2
+        self.cv2 = cv2
+        self.cap = cv2.VideoCapture(src)
+        if not self.cap.isOpened():
+            sys.exit(f"Не открывается {src}")
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or FPS
+        self.total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+
+    def grab(self) -> bool:
+        if self.cap is not None:
+            return self.cap.grab()
+        self.i += 1
+        return self.i < self.total
+
+    def retrieve(self):
+        if self.cap is not None:
+            ok, frame = self.cap.retrieve()
+            return Image.fromarray(self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB)) if ok else None
+        return Image.open(self.files[self.i])
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class Pace:
+    """
+    Шаг по кадрам: fps / target_fps, но не чаще, чем модель успевает в
+    реальном времени (по скользящему среднему времени кадра).
+    """
+
+    def __init__(self, fps: float, target_fps: float):
+        self.fps = fps
+        self.target = target_fps
+        self.stride = max(1, round(fps / target_fps)) if target_fps else 1
+        self.cost = None
+
+    def update(self, seconds: float):
+        if not self.target:
+            return
+        self.cost = seconds if self.cost is None else 0.8 * self.cost + 0.2 * seconds
+        rate = min(self.target, 1 / max(self.cost, 1e-6))
+        self.stride = max(1, math.ceil(self.fps / rate - 1e-9))
+
+
+def decoder(source: Source, pace: Pace, imgsz: int, out: queue.Queue, stats: dict,
+            realtime: bool, stop: threading.Event):
+    """Поток: кадры с шагом pace.stride → (номер, время, картинка, тензор, кадр letterbox)."""
+    def put(item):
+        # С таймаутом: после stop основной поток очередь больше не читает
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    t0 = time.monotonic()
+    i, take = -1, 0
+    try:
+        while not stop.is_set() and source.grab():
+            i += 1
+            ts = i / source.fps
+            if realtime:                        # камера не ждёт обработку
+                delay = t0 + ts - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if i < take:
+                stats["stride"] += 1
+                continue
+            take = i + pace.stride
+            img = source.retrieve()
+            if img is None:
+                continue
+            x, frame = infer.preprocess(img, imgsz)
+            item = (i, ts, img, x, frame)
+            if not realtime:
+                put(item)
+                continue
+            while True:
+                try:
+                    out.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        out.get_nowait()        # выбросить самый старый
+                        stats["dropped"] += 1
+                    except queue.Empty:
+                        pass
+    finally:
+        stats["frames"] = i + 1
+        put(None)
+
+
+# ──────────────────────────────────────────────────────────
+#  Треки и события
+# ──────────────────────────────────────────────────────────
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.clip(rb - lt, 0, None).prod(2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+class Track:
+    def __init__(self, tid: int, det: np.ndarray, t: float, frame: int, img):
+        self.id = tid
+        self.cls = int(det[5])
+        self.box = det[:4].copy()
+        self.first = self.last = t
+        self.hits = 1
+        self.confirmed = False
+        self.conf = float(det[4])
+        self.best = (float(det[4]), frame, det[:4].copy(), img)
+
+    def update(self, det: np.ndarray, t: float, frame: int, img):
+        self.box = ALPHA * det[:4] + (1 - ALPHA) * self.box
+        self.last = t
+        self.hits += 1
+        self.conf = max(self.conf, float(det[4]))
+        if det[4] > self.best[0]:
+            self.best = (float(det[4]), frame, det[:4].copy(), img)
+
+
+class Tracker:
+    """Склейка детекций по кадрам: IoU внутри класса, подтверждение, истечение."""
+
+    def __init__(self, names: dict, iou: float = TRACK_IOU, min_hits: int = MIN_HITS,
+                 ttl: float = TTL):
+        self.names = names
+        self.iou = iou
+        self.min_hits = min_hits
+        self.ttl = ttl
+        self.tracks = []
+        self.next_id = 1
+        self.noise = 0          # треки, не дожившие до события
+        self.seen = None        # время последнего update()
+
+    def event(self, kind: str, tr: Track, t: float):
+        return {"event": kind, "track": tr.id, "class": tr.cls,
+                "name": self.names.get(tr.cls, str(tr.cls)), "t": round(t, 2),
+                "start": round(tr.first, 2), "duration": round(tr.last - tr.first, 2),
+                "hits": tr.hits, "conf": round(tr.conf, 4), "frame": tr.best[1],
+                "box": [round(float(v), 1) for v in tr.box]}
+
+    def update(self, dets: np.ndarray, t: float, frame: int, img=None):
+        """Детекции кадра → события start для новых подтверждённых треков."""
+        matched_t, matched_d = set(), set()
+        if self.tracks and len(dets):
+            boxes = np.stack([tr.box for tr in self.tracks])
+            ious = iou_matrix(boxes, dets[:, :4])
+            same = np.array([tr.cls for tr in self.tracks])[:, None] == dets[None, :, 5].astype(int)
+            ious = np.where(same, ious, 0)
+            for ti, di in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+                if ious[ti, di] < self.iou:
+                    break
+                if ti in matched_t or di in matched_d:
+                    continue
+                matched_t.add(ti)
+                matched_d.add(di)
+                self.tracks[ti].update(dets[di], t, frame, img)
+        for di in range(len(dets)):
+            if di not in matched_d:
+                self.tracks.append(Track(self.next_id, dets[di], t, frame, img))
+                self.next_id += 1
+        self.seen = t
+        events = []
+        for tr in self.tracks:
+            if not tr.confirmed and tr.hits >= self.min_hits:
+                tr.confirmed = True
+                events.append(self.event("start", tr, t))
+        return events
+
+    def keep_alive(self, t: float):
+        """Кадр без запуска модели: треки, видимые на последнем посчитанном кадре, не истекают."""
+        for tr in self.tracks:
+            if self.seen is not None and tr.last >= self.seen:
+                tr.last = t
+
+    def expire(self, t: float, force: bool = False):
+        """Закрыть треки, не виденные TTL секунд (force — все). События end и закрытые треки."""
+        events, ended, alive = [], [], []
+        for tr in self.tracks:
+            if force or t - tr.last > self.ttl:
+                if tr.confirmed:
+                    events.append(self.event("end", tr, t))
+                    ended.append(tr)
+                else:
+                    self.noise += 1
+            else:
+                alive.append(tr)
+        self.tracks = alive
+        return events, ended
+
+
+def snapshot(tr: Track, frame_size, path: str):
+    """Лучший кадр трека с рамкой. frame_size — исходный (w, h), картинка может быть уменьшена draft."""
+    conf, _, box, img = tr.best
+    if img is None:
+        return
+    img = img.convert("RGB")
+    s = img.size[0] / frame_size[0]
+    ImageDraw.Draw(img).rectangle([float(v) * s for v in box], outline=(255, 0, 0), width=3)
+    img.save(path, quality=90)
+
+
+# ──────────────────────────────────────────────────────────
+#  Прогон
+# ──────────────────────────────────────────────────────────
+def run(src: str, model: infer.Model, target_fps: float = TARGET_FPS, fps: float = None,
+        conf: float = infer.CONF, motion: float = MOTION, realtime: bool = False,
+        events_path: str = None, snapshots: str = None, log=print):
+    source = Source(src, fps)
+    pace = Pace(source.fps, target_fps)
+    tracker = Tracker(model.names)
+    stats = {"frames": 0, "stride": 0, "dropped": 0, "motion": 0, "inferred": 0}
+    frames = queue.Queue(maxsize=QUEUE)
+    stop = threading.Event()
+    thread = threading.Thread(target=decoder, args=(source, pace, model.imgsz, frames, stats,
+                                                    realtime, stop), daemon=True)
+    if snapshots:
+        os.makedirs(snapshots, exist_ok=True)
+    out = open(events_path, "a", encoding="utf-8") if events_path else None
+    all_events = []
+
+    def emit(events, ended=()):
+        for e in events:
+            e["source"] = src
+            all_events.append(e)
+            if out:
+                out.write(json.dumps(e, ensure_ascii=False) + "\n")
+                out.flush()
+            mark = "▶" if e["event"] == "start" else "■"
+            log(f"  {e['t']:8.1f}с {mark} #{e['track']:<4d} {e['name']:16s} "
+                f"conf {e['conf']:.2f}  {e['duration']:.1f}с")
+        if snapshots:
+            for tr in ended:
+                snapshot(tr, size, os.path.join(snapshots, f"track{tr.id:04d}_{tr.best[1]:06d}.jpg"))
+
+    t0 = time.monotonic()
+    thread.start()
+    last_thumb, last_t, size, ts = None, -FORCE, None, 0.0
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            i, ts, img, x, frame = item
+            size = frame[4:]
+            thumb = x[:, ::THUMB, ::THUMB].mean(0)
+            if (motion and last_thumb is not None and ts - last_t < FORCE
+                    and np.abs(thumb - last_thumb).mean() * 255 < motion):
+                stats["motion"] += 1
+                tracker.keep_alive(ts)
+            else:
+                t = time.perf_counter()
+                pred = model.run(x[None])[0]
+                dets = infer.unletterbox(infer.decode(pred, conf), frame)
+                pace.update(time.perf_counter() - t)
+                stats["inferred"] += 1
+                last_thumb, last_t = thumb, ts
+                emit(tracker.update(dets, ts, i, img if snapshots else None))
+            emit(*tracker.expire(ts))
+    except KeyboardInterrupt:
+        stop.set()
+    emit(*tracker.expire(ts, force=True))
+    stop.set()
+    thread.join()
+    source.close()
+    if out:
+        out.close()
+    stats.update(wall=time.monotonic() - t0, video=stats["frames"] / source.fps,
+                 stride_last=pace.stride, noise=tracker.noise,
+                 events=sum(1 for e in all_events if e["event"] == "start"))
+    return stats, all_events
+
+
+def main():
+    p = argparse.ArgumentParser(description="Детекция повреждений по видео / потоку / папке кадров")
+    p.add_argument("source", help="видеофайл, rtsp://... или папка кадров")
+    p.add_argument("--model", default=infer.MODEL, help="ONNX (python main.py export [--int8])")
+    p.add_argument("--fps", type=float, default=None, help="fps источника (для папки кадров)")
+    p.add_argument("--target-fps", type=float, default=TARGET_FPS,
+                   help="кадров модели на секунду видео; 0 — каждый кадр")
+    p.add_argument("--conf", type=float, default=infer.CONF)
+    p.add_argument("--motion", type=float, default=MOTION,
+                   help="порог изменения сцены; 0 — не пропускать неподвижные кадры")
+    p.add_argument("--realtime", action="store_true",
+                   help="источник идёт со своей скоростью, отставшие кадры выбрасываются")
+    p.add_argument("--events", default=None, help="журнал событий JSONL (по умолчанию <источник>.events.jsonl)")
+    p.add_argument("--snapshots", default=None, help="папка для лучших кадров событий")
+    p.add_argument("--threads", type=int, default=0, help="intra-op потоки onnxruntime")
+    args = p.parse_args()
+
+    if not os.path.exists(args.model):
+        sys.exit(f"Нет модели {args.model}\nСначала: python main.py export")
+    events = args.events
+    if events is None and os.path.exists(args.source):
+        events = os.path.splitext(os.path.normpath(args.source))[0] + ".events.jsonl"
+
+    print("=" * 55)
+    print("  ДЕТЕКЦИЯ ПО ВИДЕО")
+    print("=" * 55)
+    model = infer.Model(args.model, threads=args.threads)
+    stats, _ = run(args.source, model, args.target_fps, args.fps, args.conf, args.motion,
+                   args.realtime, events, args.snapshots)
+
+    s = stats
+    print(f"\n{'─' * 55}")
+    print(f"  Кадров:    {s['frames']}  ({s['video']:.1f}с видео за {s['wall']:.1f}с, "
+          f"×{s['video'] / max(s['wall'], 1e-9):.1f} реального времени)")
+    print(f"  Модель:    {s['inferred']} кадров  (шаг {s['stride_last']}, пропущено: "
+          f"шаг {s['stride']}, сцена {s['motion']}, отстали {s['dropped']})")
+    print(f"  События:   {s['events']}  (отброшено мерцаний: {s['noise']})")
+    if events:
+        print(f"  Журнал:    {events}")
+    print(f"{'=' * 55}")
+
+
+if __name__ == "__main__":
+    main()